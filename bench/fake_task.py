@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+""" ---------------------------------------------------------------------------
+
+    fake_task.py - Stand-in for the TaskWarrior `task` command
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+# Answers the commands TaskWrapper runs (`task <filter> export` and
+# `task <filter> count`) from the export.json written by taskgen.py, so that
+# benchmarks measure TaskHUD rather than TaskWarrior. The data directory is
+# taken from rc.data.location or $TASKDATA, as with TaskWarrior.
+#
+# Commands changing tasks (done, start, stop, modify, annotate) update
+# export.json, and write pending.data, backlog.data and undo.data the way
+# TaskWarrior does, so TaskHUD's watcher picks the change up.
+
+import calendar
+import json
+import os
+import re
+import sys
+import time
+
+from taskgen import ff4_line
+
+COMMANDS = {"export", "count"}
+WRITE_COMMANDS = {"done", "start", "stop", "modify", "annotate"}
+
+# Attributes `modify` understands abbreviations of
+ATTRIBUTES = ("project", "priority", "recur", "estimate", "client")
+
+# Fields in `task export` output that aren't stored in backlog.data
+EXPORT_ONLY_FIELDS = {"id", "urgency"}
+
+UUID_RE = re.compile(r"^[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}$")
+
+def parse_date(value):
+    """
+    returns filter date (seconds since epoch, or export format) as seconds
+    since epoch
+    """
+    if value.isdigit():
+        return int(value)
+
+    return calendar.timegm(time.strptime(value, "%Y%m%dT%H%M%SZ"))
+
+def attribute_test(name, value):
+    """
+    returns function testing a task against filter term `name`:`value`
+    """
+    if name in ("end.after", "end.before"):
+        limit = parse_date(value)
+        after = name == "end.after"
+
+        def test(task):
+            if "end" not in task:
+                return False
+            end = parse_date(task["end"])
+            return end > limit if after else end < limit
+        return test
+
+    if name == "project":
+        # matches subprojects too, like TaskWarrior
+        return lambda task: task.get("project", "") == value \
+            or task.get("project", "").startswith(value + ".")
+
+    return lambda task: str(task.get(name, "")) == value
+
+def parse_filter(terms):
+    """
+    returns function testing a task against the filter `terms`. Supports
+    attribute:value, +tag, -tag, ids, uuids, and/or and parentheses.
+    """
+    pos = 0
+
+    def expression():
+        nonlocal pos
+        tests = [[]]
+
+        while pos < len(terms) and terms[pos] != ")":
+            term = terms[pos]
+            pos += 1
+
+            if term == "or":
+                tests.append([])
+            elif term == "and":
+                pass
+            else:
+                tests[-1].append(primary(term))
+
+        # `or` binds looser than the implicit `and` between terms
+        return lambda task: any(
+            all(test(task) for test in group) for group in tests
+        )
+
+    def primary(term):
+        nonlocal pos
+
+        if term == "(":
+            test = expression()
+            pos += 1
+            return test
+
+        if term.startswith("+"):
+            return lambda task: term[1:] in task.get("tags", ())
+        if term.startswith("-"):
+            return lambda task: term[1:] not in task.get("tags", ())
+
+        if term.isdigit():
+            return lambda task: task.get("id") == int(term)
+        if UUID_RE.match(term):
+            return lambda task: task["uuid"] == term
+
+        name, sep, value = term.partition(":")
+        if sep:
+            return attribute_test(name, value)
+
+        raise SystemExit("fake_task: unsupported filter term {}".format(term))
+
+    return expression()
+
+def change_task(task, command, args, now):
+    """
+    make the change `task <filter> <command> <args>` makes to `task`
+    """
+    if command == "done":
+        task["status"] = "completed"
+        task["end"] = now
+        task["id"] = 0
+        task.pop("start", None)
+    elif command == "start":
+        task["start"] = now
+    elif command == "stop":
+        task.pop("start", None)
+    elif command == "annotate":
+        text = " ".join(a for a in args if a != "--")
+        task.setdefault("annotations", []).append(
+            {"entry": now, "description": text}
+        )
+    elif command == "modify":
+        words = []
+        for arg in args:
+            name, sep, value = arg.partition(":")
+            if arg.startswith("+"):
+                task.setdefault("tags", []).append(arg[1:])
+            elif arg.startswith("-"):
+                tags = [t for t in task.get("tags", []) if t != arg[1:]]
+                task["tags"] = tags
+                if not tags:
+                    del task["tags"]
+            elif sep and name.isidentifier():
+                # attribute names can be abbreviated
+                name = next(
+                    (a for a in ATTRIBUTES if a.startswith(name)), name
+                )
+                if value:
+                    task[name] = value
+                else:
+                    task.pop(name, None)
+            else:
+                words.append(arg)
+        if words:
+            task["description"] = " ".join(words)
+
+    task["modified"] = now
+
+def write_tasks(data_path, tasks, changed, old_lines):
+    """
+    save `tasks` after `changed` (list of tasks) have been changed from
+    `old_lines` (their FF4 lines before the change)
+    """
+    with open(os.path.join(data_path, "export.json"), "w",
+              encoding="utf-8") as f:
+        json.dump(tasks, f, ensure_ascii=False)
+
+    # garbage collection is off, so finished tasks stay in pending.data
+    pending = [t for t in tasks if t["id"] or t in changed]
+    with open(os.path.join(data_path, "pending.data"), "w",
+              encoding="utf-8") as f:
+        for task in pending:
+            f.write(ff4_line(task))
+
+    with open(os.path.join(data_path, "backlog.data"), "a",
+              encoding="utf-8") as f:
+        for task in changed:
+            record = {
+                k: v for k, v in task.items() if k not in EXPORT_ONLY_FIELDS
+            }
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    with open(os.path.join(data_path, "undo.data"), "a",
+              encoding="utf-8") as f:
+        for task, old_line in zip(changed, old_lines):
+            f.write("time {}\n".format(int(time.time())))
+            f.write("old " + old_line)
+            f.write("new " + ff4_line(task))
+            f.write("---\n")
+
+def main():
+    args = sys.argv[1:]
+    data_path = os.environ.get("TASKDATA", os.path.expanduser("~/.task"))
+
+    # rc overrides, the filter before the command, and arguments after it
+    terms = []
+    command = None
+    command_args = []
+    for arg in args:
+        if arg.startswith("rc.") and not command_args:
+            name, _, value = arg[3:].partition("=")
+            if name == "data.location":
+                data_path = value
+        elif command is None and arg in COMMANDS | WRITE_COMMANDS:
+            command = arg
+        elif command is None:
+            terms.append(arg)
+        else:
+            command_args.append(arg)
+
+    if command is None:
+        raise SystemExit("fake_task: unsupported command {}".format(args))
+
+    # "." isn't a filter, TaskHUD uses it to mean everything. A list of ids
+    # and uuids matches any of them, like TaskWarrior
+    ids = {t for t in terms if t.isdigit() or UUID_RE.match(t)}
+    terms = [t for t in terms if t != "." and t not in ids]
+
+    filter_test = parse_filter(terms)
+    if ids:
+        test = lambda task: filter_test(task) and (
+            str(task.get("id")) in ids or task["uuid"] in ids
+        )
+    else:
+        test = filter_test
+
+    with open(os.path.join(data_path, "export.json"), encoding="utf-8") as f:
+        everything = json.load(f)
+    tasks = [task for task in everything if test(task)]
+
+    if command in WRITE_COMMANDS:
+        if not tasks:
+            raise SystemExit("fake_task: no matching tasks")
+
+        now = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        old_lines = [ff4_line(task) for task in tasks]
+        for task in tasks:
+            change_task(task, command, command_args, now)
+
+        # ids are given out in pending.data order, finished tasks lose theirs
+        next_id = 1
+        for task in everything:
+            if task["id"]:
+                task["id"] = next_id
+                next_id += 1
+
+        write_tasks(data_path, everything, tasks, old_lines)
+        return
+
+    if command == "count":
+        print(len(tasks))
+        return
+
+    # one task per line, as TaskWarrior prints them
+    out = sys.stdout
+    out.write("[\n")
+    for n, task in enumerate(tasks):
+        out.write(json.dumps(task, ensure_ascii=False))
+        out.write(",\n" if n < len(tasks) - 1 else "\n")
+    out.write("]\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+""" ---------------------------------------------------------------------------
+
+    headless.py - Curses screen stand-in for running CursesHud without a
+                  terminal
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import curses
+from contextlib import contextmanager
+
+class HeadlessScreen:
+    """
+    Stands in for the curses screen passed to CursesHud. Text written to it
+    is kept in a list of lines, and calls and characters written are counted
+    so benchmarks can see how much drawing a frame does. Keys queued in
+    `keys` are returned by getch().
+    """
+    def __init__(self, lines=50, cols=160):
+        self.keys = []
+
+        # counters, reset with reset_counters()
+        self.addstr_calls = 0
+        self.chars_written = 0
+        self.scrolls = 0
+
+        self.resize(lines, cols)
+
+    def resize(self, lines, cols):
+        """
+        change the size of the screen, clearing it
+        """
+        self.height = lines
+        self.width = cols
+        self.clear()
+
+    def reset_counters(self):
+        self.addstr_calls = 0
+        self.chars_written = 0
+        self.scrolls = 0
+
+    def text(self):
+        """
+        returns what is on screen, as a string
+        """
+        return "\n".join(line.rstrip() for line in self.lines)
+
+    def addstr(self, y, x, text, attr=0):
+        if not (0 <= y < self.height and 0 <= x + len(text) <= self.width):
+            raise curses.error("addstr() returned ERR")
+
+        self.addstr_calls += 1
+        self.chars_written += len(text)
+
+        line = self.lines[y]
+        self.lines[y] = line[:x] + text + line[x + len(text):]
+
+    def scroll(self, n=1):
+        top, bottom = self.region
+        region = self.lines[top:bottom + 1]
+
+        if n > 0:
+            region = region[n:] + [" " * self.width] * n
+        else:
+            region = [" " * self.width] * -n + region[:n]
+
+        self.lines[top:bottom + 1] = region
+        self.scrolls += 1
+
+    def setscrreg(self, top, bottom):
+        self.region = (top, bottom)
+
+    def clear(self):
+        self.lines = [" " * self.width] * self.height
+        self.region = (0, self.height - 1)
+
+    def getch(self):
+        if self.keys:
+            return self.keys.pop(0)
+        return -1
+
+    def nodelay(self, flag):
+        pass
+
+    def idlok(self, flag):
+        pass
+
+    def keypad(self, flag):
+        pass
+
+    def scrollok(self, flag):
+        pass
+
+    def noutrefresh(self):
+        pass
+
+    def refresh(self):
+        pass
+
+@contextmanager
+def headless_curses(screen):
+    """
+    patch the curses module so CursesHud can run on HeadlessScreen `screen`
+    without initscr(). curses.LINES and curses.COLS follow the screen size,
+    updated by curses.update_lines_cols() as after a real resize.
+    """
+    saved = {
+        name: getattr(curses, name, None) for name in (
+            "LINES", "COLS", "doupdate", "curs_set", "update_lines_cols",
+            "resizeterm",
+        )
+    }
+
+    def update_lines_cols():
+        curses.LINES = screen.height
+        curses.COLS = screen.width
+
+    curses.doupdate = lambda: None
+    curses.curs_set = lambda visibility: None
+    curses.update_lines_cols = update_lines_cols
+    curses.resizeterm = lambda lines, cols: screen.resize(lines, cols)
+    update_lines_cols()
+
+    try:
+        yield screen
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                if hasattr(curses, name):
+                    delattr(curses, name)
+            else:
+                setattr(curses, name, value)
@@ -0,0 +1,484 @@
+""" ---------------------------------------------------------------------------
+
+    run_bench.py - Timed TaskHUD scenarios against synthetic task data
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+# Usage: python bench/run_bench.py [--tasks 1000,10000] [--output out.json]
+#                                  [--compare baseline.json]
+#
+# Generates TaskWarrior data directories with taskgen.py, points TaskWrapper
+# at fake_task.py, and draws CursesHud on a HeadlessScreen. Results are
+# written as JSON, and --compare reports scenarios that got slower than a
+# previous run.
+
+import time
+
+# startup is timed from here, before any TaskHUD modules are imported
+PROCESS_START = time.monotonic()
+
+import argparse
+import curses
+import datetime
+import json
+import os
+import platform
+import resource
+import select
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from headless import HeadlessScreen, headless_curses
+from taskgen import generate_tasks, write_data_dir
+
+FAKE_TASK = os.path.join(BENCH_DIR, "fake_task.py")
+
+# version of the results format
+RESULTS_VERSION = 1
+
+SCENARIOS = (
+    "startup", "startup_cached", "full_refresh", "single_edit",
+    "scroll_frame", "resize", "search_keystroke", "sort_switch",
+)
+
+def data_dir(root, tasks, seed):
+    """
+    returns path to a data directory of `tasks` tasks under `root`,
+    generating it if needed
+    """
+    path = os.path.join(root, "tasks-{}-{}".format(tasks, seed))
+
+    if not os.path.isfile(os.path.join(path, "export.json")):
+        write_data_dir(path, generate_tasks(tasks, seed))
+
+    return path
+
+def make_wrapper(path, **kwargs):
+    """
+    returns TaskWrapper reading data directory `path` through fake_task.py
+    """
+    from taskwrapper import TaskWrapper
+
+    os.environ["TASKDATA"] = path
+    kwargs.setdefault("use_cache", False)
+
+    return TaskWrapper(FAKE_TASK, path, **kwargs)
+
+def load_hud(path, screen):
+    """
+    returns (hud, wrapper) with every task in `path` loaded and drawn
+    """
+    from taskhud import make_hud
+
+    hud = make_hud(screen)
+    wrapper = make_wrapper(path, history="eager")
+
+    def apply(delta):
+        hud.add_record(delta.added + delta.modified)
+        hud.remove_record(delta.deleted)
+
+    wrapper.change_cb = apply
+    wrapper.update_task_db()
+    hud.render()
+
+    return hud, wrapper
+
+def timed(func, repeat):
+    """
+    returns list of milliseconds taken by each of `repeat` calls to func()
+    """
+    runs = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append((time.perf_counter() - start) * 1000)
+
+    return runs
+
+#------------------------------------------------------------------------------
+# Scenarios, each returning (list of run times in ms, dict of extra figures)
+
+def bench_startup(path, repeat, cache_dir=None):
+    """
+    time from process start to first paint, and to everything being loaded,
+    each run in a fresh process
+    """
+    cmd = [sys.executable, os.path.abspath(__file__), "--startup-child", path]
+    if cache_dir is not None:
+        cmd += ["--cache-dir", cache_dir]
+
+        # first run fills the cache
+        subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+
+    runs = []
+    loaded = []
+    for _ in range(repeat):
+        out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+        result = json.loads(out.decode("utf-8"))
+        runs.append(result["first_paint"])
+        loaded.append(result["loaded"])
+
+    return runs, {"loaded_median_ms": statistics.median(loaded)}
+
+def startup_child(path, cache_dir):
+    """
+    runs in the child process started by bench_startup(), prints timings as
+    JSON
+    """
+    from taskhud import make_hud
+
+    screen = HeadlessScreen()
+    with headless_curses(screen):
+        hud = make_hud(screen)
+
+        wrapper = make_wrapper(
+            path, use_cache=cache_dir is not None, cache_dir=cache_dir
+        )
+        wrapper.change_cb = lambda delta: hud.post_update(
+            delta.added + delta.modified, delta.deleted
+        )
+        wrapper.load_cb = hud.wakeup
+        wrapper.start()
+
+        # CursesHud.mainloop() without the terminal input
+        while True:
+            more = hud._apply_updates(0.5 / hud.max_fps)
+            if hud.dirty:
+                hud.dirty = False
+                hud.render()
+
+            if wrapper.loaded.is_set() and not more \
+                    and hud.update_queue.empty():
+                break
+
+            if not more:
+                select.select([hud.wakeup_r], [], [], 0.1)
+                try:
+                    while os.read(hud.wakeup_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+
+        hud.render()
+        loaded = time.monotonic()
+
+    print(json.dumps({
+        "first_paint": (hud.first_paint - PROCESS_START) * 1000,
+        "loaded": (loaded - PROCESS_START) * 1000,
+    }))
+
+def bench_full_refresh(hud, wrapper, screen, repeat):
+    """
+    redraw every line of the screen
+    """
+    def refresh():
+        screen.clear()
+        hud._invalidate()
+        hud.render()
+
+    screen.reset_counters()
+    runs = timed(refresh, repeat)
+
+    return runs, {"chars_per_frame": screen.chars_written / repeat}
+
+def bench_single_edit(hud, wrapper, screen, repeat):
+    """
+    time from a task change being written to backlog.data (as `task modify`
+    would) until the HUD has drawn it, without the watcher's debounce delay
+    """
+    pending = [r for r in wrapper.task_db.values() if r.get("id")]
+    backlog_size = os.path.getsize(wrapper.backlog_path)
+
+    wrapper.change_cb = lambda delta: hud.post_update(
+        delta.added + delta.modified, delta.deleted
+    )
+
+    edits = iter(range(repeat))
+
+    def edit():
+        n = next(edits)
+        record = pending[n % len(pending)].to_dict()
+        record.pop("id")
+        record.pop("urgency", None)
+        record["description"] += " (edit {})".format(n)
+
+        with open(wrapper.backlog_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        wrapper.update_task_db_incremental({"backlog.data"})
+        hud._apply_updates(1.0)
+        hud.render()
+
+    try:
+        runs = timed(edit, repeat)
+    finally:
+        # leave the data directory as it was generated
+        os.truncate(wrapper.backlog_path, backlog_size)
+
+    return runs, {}
+
+def bench_scroll_frame(hud, wrapper, screen, repeat):
+    """
+    move the selection down one line past the bottom of the screen, and
+    redraw
+    """
+    rows = hud._visible_rows()
+    hud.scrollpos = 0
+    hud.selectpos = rows - 1
+    hud.render()
+
+    def scroll():
+        hud._handle_key(curses.KEY_DOWN)
+        hud.render()
+
+    screen.reset_counters()
+    runs = timed(scroll, repeat * 20)
+
+    return runs, {
+        "chars_per_frame": screen.chars_written / (repeat * 20),
+        "scrolls": screen.scrolls,
+    }
+
+def bench_resize(hud, wrapper, screen, repeat):
+    """
+    resize the terminal between two sizes, and redraw
+    """
+    sizes = iter([(40, 120), (50, 160)] * repeat)
+
+    def resize():
+        screen.resize(*next(sizes))
+        hud._handle_key(curses.KEY_RESIZE)
+        hud.render()
+
+    return timed(resize, repeat), {}
+
+def bench_search_keystroke(hud, wrapper, screen, repeat):
+    """
+    type a search one character at a time, redrawing after each
+    """
+    build = timed(hud._build_search_index, 1)[0]
+
+    query = "write pro"
+    runs = []
+    for _ in range(repeat):
+        for n in range(1, len(query) + 1):
+            runs += timed(lambda: (hud.set_search(query[:n]), hud.render()), 1)
+        hud.set_search("")
+
+    return runs, {"index_build_ms": build}
+
+def bench_sort_switch(hud, wrapper, screen, repeat):
+    """
+    switch to the next sort order, and redraw
+    """
+    def switch():
+        hud._handle_key(ord("o"))
+        hud.render()
+
+    runs = timed(switch, repeat * len(hud.sort_orders))
+
+    # later switches reuse cached sort values
+    return runs, {"first_cycle_ms": sum(runs[:len(hud.sort_orders)])}
+
+HUD_SCENARIOS = {
+    "full_refresh": bench_full_refresh,
+    "single_edit": bench_single_edit,
+    "scroll_frame": bench_scroll_frame,
+    "resize": bench_resize,
+    "search_keystroke": bench_search_keystroke,
+    "sort_switch": bench_sort_switch,
+}
+
+#------------------------------------------------------------------------------
+
+def summarise(scenario, tasks, runs, extra):
+    """
+    returns result entry for one scenario
+    """
+    result = {
+        "scenario": scenario,
+        "tasks": tasks,
+        "unit": "ms",
+        "runs": [round(run, 3) for run in runs],
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "mean": statistics.mean(runs),
+        "max": max(runs),
+    }
+    result.update(extra)
+
+    return result
+
+def run_size(root, tasks, seed, scenarios, repeat, report):
+    """
+    returns list of results for every scenario with `tasks` tasks
+    """
+    path = data_dir(root, tasks, seed)
+    results = []
+
+    def add(scenario, runs, extra):
+        result = summarise(scenario, tasks, runs, extra)
+        results.append(result)
+        report(result)
+
+    if "startup" in scenarios:
+        add("startup", *bench_startup(path, repeat))
+
+    if "startup_cached" in scenarios:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            add("startup_cached", *bench_startup(path, repeat, cache_dir))
+
+    hud_scenarios = [s for s in scenarios if s in HUD_SCENARIOS]
+    if not hud_scenarios:
+        return results
+
+    screen = HeadlessScreen()
+    with headless_curses(screen):
+        start = time.perf_counter()
+        hud, wrapper = load_hud(path, screen)
+        load_time = (time.perf_counter() - start) * 1000
+
+        add("load", [load_time], {
+            "task_db_bytes": wrapper.task_db.memory_usage(),
+            "task_db": wrapper.task_db.memory_report(),
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+
+        for scenario in hud_scenarios:
+            add(scenario, *HUD_SCENARIOS[scenario](
+                hud, wrapper, screen, repeat
+            ))
+
+        wrapper.watcher.close()
+
+    return results
+
+def git_commit():
+    """
+    returns commit of the TaskHUD checkout, or None
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+        ).stdout.decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """
+    print how median times changed since `baseline` results, returns list
+    of scenarios that got slower by more than `threshold` times
+    """
+    old = {(r["scenario"], r["tasks"]): r for r in baseline["results"]}
+    slower = []
+
+    print("{:<18} {:>8} {:>10} {:>10} {:>7}".format(
+        "scenario", "tasks", "before", "after", "ratio"
+    ), file=sys.stderr)
+
+    for result in results:
+        key = (result["scenario"], result["tasks"])
+        if key not in old:
+            continue
+
+        before = old[key]["median"]
+        ratio = result["median"] / before if before else float("inf")
+
+        flag = ""
+        if ratio > threshold:
+            flag = "  SLOWER"
+            slower.append(key)
+
+        print("{:<18} {:>8} {:>10.2f} {:>10.2f} {:>6.2f}x{}".format(
+            key[0], key[1], before, result["median"], ratio, flag
+        ), file=sys.stderr)
+
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark TaskHUD")
+    parser.add_argument("--tasks", default="1000,10000",
+                        help="comma separated task counts (default 1000,10000)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma separated scenarios (default all)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs of each scenario (default 5)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir",
+                        help="keep generated data here, to reuse next time")
+    parser.add_argument("--output", help="write results here (default stdout)")
+    parser.add_argument("--compare", help="results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="--compare fails if a median grows by more than "
+                             "this factor (default 1.25)")
+    parser.add_argument("--startup-child", help=argparse.SUPPRESS)
+    parser.add_argument("--cache-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_child:
+        return startup_child(args.startup_child, args.cache_dir)
+
+    scenarios = args.scenarios.split(",")
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("unknown scenario {}".format(scenario))
+
+    def report(result):
+        print("{:<18} {:>8} tasks  median {:>9.2f} ms".format(
+            result["scenario"], result["tasks"], result["median"]
+        ), file=sys.stderr)
+        if "task_db" in result:
+            print("{:<18} {}".format("", result["task_db"]), file=sys.stderr)
+
+    root = args.data_dir or tempfile.mkdtemp(prefix="taskhud-bench-")
+
+    results = []
+    try:
+        for tasks in (int(n) for n in args.tasks.split(",")):
+            results += run_size(
+                root, tasks, args.seed, scenarios, args.repeat, report
+            )
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(root)
+
+    output = {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+""" ---------------------------------------------------------------------------
+
+    taskgen.py - Generates synthetic TaskWarrior data directories
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import argparse
+import calendar
+import json
+import os
+import random
+import time
+import uuid
+
+# Words used to make up descriptions and annotations
+WORDS = (
+    "call email write review fix update plan buy book check clean prepare "
+    "send read finish start organise schedule renew cancel pay order sort "
+    "report invoice meeting budget garden kitchen car bike doctor dentist "
+    "presentation slides release backup server laptop printer taxes "
+    "insurance passport birthday present groceries milk bread coffee paint "
+    "fence gutters roof tyres notes draft proposal contract client supplier "
+    "newsletter blog article talk conference flights hotel visa library "
+    "course chapter exercise python curses terminal database export sync "
+    "quarterly weekly monthly annual urgent follow up with about for the "
+    "new old big small first last next café naïve résumé"
+).split()
+
+PROJECTS = (
+    "home", "home.garden", "home.repairs", "home.kitchen", "work",
+    "work.reports", "work.meetings", "work.release", "work.hiring", "errands",
+    "health", "finance", "finance.taxes", "learning.python",
+    "learning.spanish", "travel", "family", "taskhud",
+)
+
+TAGS = (
+    "next", "phone", "email", "computer", "errand", "someday", "review",
+    "waiting", "quick", "home", "office",
+)
+
+# Statuses, weighted roughly like a database that has been used for a while
+STATUSES = (
+    ("pending", 20), ("waiting", 3), ("recurring", 1), ("completed", 70),
+    ("deleted", 6),
+)
+
+DATE_FIELDS = {
+    "due", "scheduled", "wait", "until", "start", "end", "entry", "modified"
+}
+
+# Fields in `task export` output that aren't stored in the data files
+EXPORT_ONLY_FIELDS = {"id", "urgency"}
+
+def format_date(epoch):
+    """
+    returns seconds since epoch as a TaskWarrior export date
+    """
+    return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(epoch))
+
+def parse_date(value):
+    """
+    returns TaskWarrior export date as seconds since epoch
+    """
+    return calendar.timegm(time.strptime(value, "%Y%m%dT%H%M%SZ"))
+
+def _words(rng, low, high):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+def generate_tasks(count, seed=0, now=None):
+    """
+    returns list of `count` tasks (dicts, as produced by `task export`), with
+    a realistic mix of statuses, projects, tags, dates, annotations,
+    dependencies and UDAs. The same `seed` always gives the same tasks.
+    """
+    rng = random.Random(seed)
+    if now is None:
+        now = 1500000000
+
+    statuses = [s for s, weight in STATUSES for _ in range(weight)]
+    tasks = []
+
+    for n in range(count):
+        entry = now - rng.randint(0, 3 * 365 * 24 * 60 * 60)
+        status = rng.choice(statuses)
+
+        task = {
+            "uuid": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "description": _words(rng, 2, 10).capitalize(),
+            "status": status,
+            "entry": entry,
+        }
+
+        if rng.random() < 0.8:
+            task["project"] = rng.choice(PROJECTS)
+
+        if rng.random() < 0.6:
+            task["tags"] = rng.sample(TAGS, rng.randint(1, 3))
+
+        if rng.random() < 0.3:
+            task["priority"] = rng.choice("HML")
+
+        if rng.random() < 0.3:
+            task["due"] = entry + rng.randint(1, 120) * 24 * 60 * 60
+        if rng.random() < 0.05:
+            task["scheduled"] = entry + rng.randint(1, 30) * 24 * 60 * 60
+
+        if status == "waiting":
+            task["wait"] = now + rng.randint(1, 60) * 24 * 60 * 60
+        elif status == "recurring":
+            task["recur"] = rng.choice(("daily", "weekly", "monthly"))
+            task["due"] = task.get("due", entry + 24 * 60 * 60)
+            task["mask"] = "".join(rng.choice("+-") for _ in range(8))
+        elif status in ("completed", "deleted"):
+            task["end"] = min(entry + rng.randint(60, 90 * 24 * 60 * 60), now)
+        elif rng.random() < 0.05:
+            task["start"] = now - rng.randint(60, 3 * 24 * 60 * 60)
+
+        if rng.random() < 0.2:
+            times = sorted(
+                rng.randint(entry, now) for _ in range(rng.randint(1, 3))
+            )
+            task["annotations"] = [
+                {"entry": t, "description": _words(rng, 3, 15)} for t in times
+            ]
+
+        if tasks and rng.random() < 0.05:
+            task["depends"] = sorted({
+                rng.choice(tasks)["uuid"] for _ in range(rng.randint(1, 2))
+            })
+
+        # UDAs
+        if rng.random() < 0.3:
+            task["estimate"] = rng.choice((0.5, 1, 2, 4, 8))
+        if rng.random() < 0.2:
+            task["client"] = rng.choice(("acme", "globex", "initech"))
+
+        task["modified"] = max(
+            [entry] + [task[k] for k in ("end", "start") if k in task]
+            + [a["entry"] for a in task.get("annotations", ())]
+        )
+
+        tasks.append(task)
+
+    # pending.data comes first in exports, and is where ids come from
+    live = [t for t in tasks if t["status"] not in ("completed", "deleted")]
+    done = [t for t in tasks if t["status"] in ("completed", "deleted")]
+    done.sort(key=lambda t: t["end"])
+
+    for n, task in enumerate(live):
+        task["id"] = n + 1
+    for task in done:
+        task["id"] = 0
+
+    for task in live + done:
+        task["urgency"] = _urgency(task, now)
+
+    return [_export_dates(task) for task in live + done]
+
+def _urgency(task, now):
+    """
+    rough version of TaskWarrior's urgency calculation
+    """
+    urgency = 0.0
+
+    if task["status"] != "pending":
+        return urgency
+
+    urgency += {"H": 6.0, "M": 3.9, "L": 1.8}.get(task.get("priority"), 0)
+    urgency += 1.0 if "project" in task else 0
+    urgency += min(len(task.get("tags", ())), 3) * 0.3
+    urgency += 4.0 if "start" in task else 0
+    urgency += min((now - task["entry"]) / (365 * 24 * 60 * 60), 1) * 2
+
+    if "due" in task:
+        days = (task["due"] - now) / (24 * 60 * 60)
+        urgency += 12 * max(min((14 - days) / 21, 1), 0.2)
+
+    return round(urgency, 4)
+
+def _export_dates(task):
+    """
+    returns copy of `task` with dates in TaskWarrior export format
+    """
+    task = dict(task)
+
+    for k in DATE_FIELDS & set(task):
+        task[k] = format_date(task[k])
+
+    for annotation in task.get("annotations", ()):
+        annotation["entry"] = format_date(annotation["entry"])
+
+    return task
+
+def _ff4_escape(value):
+    """
+    escapes a value for a data file line, as TaskWarrior does
+    """
+    value = json.dumps(value, ensure_ascii=False)[1:-1]
+    return value.replace("[", "&open;").replace("]", "&close;")
+
+def ff4_line(task):
+    """
+    returns `task` as a line of pending.data / completed.data / undo.data
+    (TaskWarrior's FF4 format)
+    """
+    fields = []
+
+    for k, v in sorted(task.items()):
+        if k in EXPORT_ONLY_FIELDS:
+            continue
+
+        if k == "annotations":
+            for annotation in v:
+                fields.append((
+                    "annotation_{}".format(parse_date(annotation["entry"])),
+                    annotation["description"]
+                ))
+            continue
+
+        if k in ("tags", "depends"):
+            v = ",".join(v)
+        elif k in DATE_FIELDS:
+            v = str(parse_date(v))
+
+        fields.append((k, str(v)))
+
+    return "[" + " ".join(
+        '{}:"{}"'.format(k, _ff4_escape(v)) for k, v in fields
+    ) + "]\n"
+
+def write_data_dir(path, tasks, backlog_size=1000, undo_size=1000):
+    """
+    writes `tasks` to a TaskWarrior data directory at `path`: pending.data,
+    completed.data, a backlog.data and undo.data holding the most recently
+    modified `backlog_size` and `undo_size` tasks, and export.json (which
+    fake_task.py answers exports from)
+    """
+    os.makedirs(path, exist_ok=True)
+
+    with open(os.path.join(path, "pending.data"), "w", encoding="utf-8") as f:
+        for task in tasks:
+            if task["id"]:
+                f.write(ff4_line(task))
+
+    with open(os.path.join(path, "completed.data"), "w",
+              encoding="utf-8") as f:
+        for task in tasks:
+            if not task["id"]:
+                f.write(ff4_line(task))
+
+    recent = sorted(tasks, key=lambda t: t["modified"])
+
+    with open(os.path.join(path, "backlog.data"), "w", encoding="utf-8") as f:
+        # first line of the backlog is the sync key
+        f.write(str(uuid.UUID(int=len(tasks), version=4)) + "\n")
+
+        for task in recent[-backlog_size:]:
+            record = {
+                k: v for k, v in task.items() if k not in EXPORT_ONLY_FIELDS
+            }
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    with open(os.path.join(path, "undo.data"), "w", encoding="utf-8") as f:
+        for task in recent[-undo_size:]:
+            f.write("time {}\n".format(parse_date(task["modified"])))
+            f.write("new " + ff4_line(task))
+            f.write("---\n")
+
+    with open(os.path.join(path, "export.json"), "w", encoding="utf-8") as f:
+        json.dump(tasks, f, ensure_ascii=False)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="generate a synthetic TaskWarrior data directory"
+    )
+    parser.add_argument("path", help="data directory to write")
+    parser.add_argument("--tasks", type=int, default=10000,
+                        help="number of tasks (default 10000)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_data_dir(args.path, generate_tasks(args.tasks, args.seed))
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,257 @@
 --------------------------------------------------------------------------- """
 
 import curses
+import os
+import queue
+import select
+import signal
+import sys
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import compress
+from operator import itemgetter
+
+from perfstats import stats
+
+from searchindex import SearchIndex
+
+class DisplayCache:
+    """
+    Bounded cache of display strings for record values, keyed by (record
+    key, column). Entries remember the raw value they were made from, so a
+    stale entry is never returned for a changed value. Least recently used
+    entries are dropped once `maxsize` is reached.
+
+    hits/misses count lookups, to check the cache is doing its job.
+    """
+    def __init__(self, maxsize=250000):
+        self.maxsize = maxsize
+
+        # (record key, column) -> (raw value, display string)
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, column, value, translate):
+        """
+        returns display string for `value`, calling `translate` if it isn't
+        cached
+        """
+        entry = self.entries.get((key, column))
+        if entry is not None and (entry[0] is value or entry[0] == value):
+            self.hits += 1
+            self.entries.move_to_end((key, column))
+            return entry[1]
+
+        self.misses += 1
+        string = str(translate(value))
+
+        self.entries[(key, column)] = (value, string)
+        self.entries.move_to_end((key, column))
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+        return string
+
+    def invalidate_record(self, key, columns):
+        """
+        drop cached strings for record `key` in each of `columns`
+        """
+        for column in columns:
+            self.entries.pop((key, column), None)
+
+    def invalidate_column(self, column):
+        """
+        drop cached strings for every record in `column`
+        """
+        for entry_key in [k for k in self.entries if k[1] == column]:
+            del self.entries[entry_key]
+
+# maps each byte to its complement, used to sort strings in descending order
+INVERT_BYTES = bytes(range(255, -1, -1))
+
+def sort_component(value, descending=False):
+    """
+    returns (rank, value) pair that sorts `value` in the given direction, and
+    can be compared with any other pair from the same column. Missing values
+    (None) sort last in either direction. Strings are sorted in descending
+    order by inverting the bytes of their UTF-8 encoding (which sorts in the
+    same order as the string), so sorting never needs a Python comparison
+    function.
+    """
+    if value is None:
+        return (2, None)
+
+    if isinstance(value, (int, float)):
+        return (0, -value if descending else value)
+
+    if not isinstance(value, str):
+        value = str(value)
+
+    if descending:
+        # the trailing 0xff makes a string sort before its own prefixes
+        return (1, value.encode("utf-8").translate(INVERT_BYTES) + b"\xff")
+
+    return (1, value)
+
+class SortedRecords:
+    """
+    Records kept in display order as they are added and removed, by finding
+    their position with a binary search rather than sorting every record
+    again.
+
+    `order` is a list of (column, descending) pairs, with the record's unique
+    key used last to break ties, so that every record has a distinct place.
+    `sort_values` maps columns to functions converting raw values to the
+    values sorted on (None sorts last). Sort values are cached per column
+    and direction, so switching between orders doesn't recalculate them.
+    """
+    def __init__(self, order=(), sort_values=None):
+        self.order = list(order)
+        self.sort_values = sort_values if sort_values is not None else {}
+
+        # unique key -> record
+        self.by_key = {}
+
+        # sort key tuples, records and unique keys, all in display order
+        self.sort_keys = []
+        self.records = []
+        self.keys = []
+
+        # unique key -> sort key tuple the record is stored under
+        self.record_sort_keys = {}
+
+        # (column, descending) -> dict of unique key -> sort_component()
+        self.components = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def _make_sort_keys(self, items):
+        """
+        returns list of sort key tuples for `items`, a list of (unique key,
+        record), in the current order
+        """
+        keys = [key for key, record in items]
+        columns = []
+
+        for column, descending in self.order:
+            cache = self.components.setdefault((column, descending), {})
+
+            # every record is cached once a column has been sorted on, as
+            # the cache drops records that are removed
+            if len(cache) < len(self.by_key):
+                func = self.sort_values.get(column)
+
+                for key, record in items:
+                    if key in cache:
+                        continue
+
+                    value = record.get(column)
+                    if func is not None and value is not None:
+                        value = func(value)
+
+                    cache[key] = sort_component(value, descending)
+
+            # sort keys are flat (rank, value, rank, value... unique key),
+            # as nested tuples are slower to compare
+            components = list(map(cache.__getitem__, keys))
+            columns.append(map(itemgetter(0), components))
+            columns.append(map(itemgetter(1), components))
+
+        return list(zip(*columns, keys))
+
+    def index(self, key):
+        """
+        returns position of record with unique `key`, or None if it's missing
+        """
+        sort_key = self.record_sort_keys.get(key)
+        if sort_key is None:
+            return None
+
+        return bisect_left(self.sort_keys, sort_key)
+
+    def remove(self, key):
+        """
+        remove record with unique `key` if there is one
+        """
+        i = self.index(key)
+        if i is None:
+            return
+
+        del self.sort_keys[i]
+        del self.records[i]
+        del self.keys[i]
+        del self.record_sort_keys[key]
+        del self.by_key[key]
+
+        for cache in self.components.values():
+            cache.pop(key, None)
+
+    def update(self, items):
+        """
+        add or replace records, `items` being a list of (unique key, record)
+        """
+        for key, record in items:
+            self.remove(key)
+        for key, record in items:
+            self.by_key[key] = record
+
+        sort_keys = self._make_sort_keys(items)
+        self.record_sort_keys.update(zip(
+            map(itemgetter(-1), sort_keys), sort_keys
+        ))
+
+        # Placing each record costs a copy of the lists after it, so large
+        # batches are cheaper appended and merged in by a sort (which finds
+        # the two sorted runs and merges them in linear time)
+        if len(items) * 256 < len(self.records):
+            for sort_key in sort_keys:
+                i = bisect_left(self.sort_keys, sort_key)
+
+                self.sort_keys.insert(i, sort_key)
+                self.records.insert(i, self.by_key[sort_key[-1]])
+                self.keys.insert(i, sort_key[-1])
+            return
+
+        self.sort_keys += sort_keys
+        self._sort()
+
+    def set_order(self, order):
+        """
+        re-sort records by `order`, a list of (column, descending) pairs
+        """
+        self.order = list(order)
+
+        self.sort_keys = self._make_sort_keys(list(self.by_key.items()))
+        self.record_sort_keys = dict(zip(self.by_key, self.sort_keys))
+        self._sort()
+
+    def set_sort_value(self, column, func):
+        """
+        set function converting values in `column` to the value sorted on
+        """
+        self.sort_values[column] = func
+
+        for column_direction in [c for c in self.components if c[0] == column]:
+            del self.components[column_direction]
+
+        self.set_order(self.order)
+
+    def _sort(self):
+        """
+        sort sort_keys, and put records and unique keys in the same order
+        """
+        # sort keys are distinct (they end with the unique key), so tuples
+        # are compared without ever comparing records
+        self.sort_keys.sort()
+        self.keys = list(map(itemgetter(-1), self.sort_keys))
+        self.records = list(map(self.by_key.__getitem__, self.keys))
+
+# Columns are never cut down narrower than this
+MIN_COLUMN_WIDTH = 8
 
 class CursesHud:
     """
@@ -21,12 +272,26 @@ class CursesHud:
     To modify record values, translating them to user readable values, call
     set_translation().
 
-    Column widths are initially set to the size of the largest record value's
-    length (or the column heading if longer). If the total of displayed column
-    widths exceeds available columns in the terminal, 1 column width is
-    subtracted from the largest column iteratively until all columns will fit.
+    Column widths are set to the size of the largest record value's length
+    (or the column heading if longer). When the columns don't all fit in the
+    terminal, only those that do are shown, and the left and right arrow keys
+    scroll sideways through the rest. Columns given to set_pinned_columns()
+    stay at the left while the others scroll.
 
     Any column headings/values which are truncated are suffixed by "..."
+
+    Pressing "/" filters records as a search is typed: words are matched
+    against fields set with set_search_fields() and "field:value" matches
+    the start of a field's value. Enter keeps the filter, Escape clears it.
+
+    Keys given to set_action() run an action on the selected record, which
+    may ask for some text first.
+
+    Records are kept sorted as they arrive. "o" cycles through the orders
+    given to set_sort_orders(), and "O" reverses the current one.
+
+    "p" swaps the bottom panel between the selected record and performance
+    stats (see perfstats.py).
     """
     def __init__(self, screen):
         """
@@ -35,12 +300,15 @@ class CursesHud:
         # ncurses screen object
         self.screen = screen
         self.screen.nodelay(True)   # self.screen.getch(), non-blocking
+        self.screen.idlok(True)     # allow hardware line scrolling
 
         # Column titles (keys in self.records)
         self.columns = []
 
-        # Key to sort records by
-        self.sort_key = None
+        # sort orders the user can choose from, each a list of (column,
+        # descending) pairs, and index of the one in use
+        self.sort_orders = []
+        self.sort_order_index = 0
 
         # Unique key for records used to disambiguate when records change
         # Note: if value isn't set before adding records, the first key of
@@ -50,9 +318,43 @@ class CursesHud:
         # keys in self.records that should be displayed in bottom pane
         self.extra_info_keys = []
 
-        # Records to display in centre pane
+        # Records to display in centre pane, in display order (only those
+        # matching the search, if there is one)
         self.records = []
 
+        # Records keyed by the value of their unique key
+        self.record_index = {}
+
+        # every record in display order, kept sorted as records change
+        self.sorted_records = SortedRecords()
+
+        # fields searched for words, and fields that can be used in
+        # "field:value" search terms (see set_search_fields())
+        self.search_text_fields = None
+        self.search_predicate_fields = ()
+
+        # SearchIndex of records, built when the first search is made and
+        # then kept up to date as records change
+        self.search_index = None
+
+        # current search, whether it's being typed, and unique keys of the
+        # records matching it (None when not filtering)
+        self.search_query = ""
+        self.search_editing = False
+        self.search_matches = None
+
+        # part of a multibyte character being typed
+        self.typed_bytes = b""
+
+        # key -> (function, prompt) for actions on the selected record, see
+        # set_action()
+        self.actions = {}
+
+        # (prompt, function, unique key of record) while text for an action
+        # is being typed, and the text typed so far
+        self.prompt = None
+        self.prompt_text = ""
+
         # keys - key name from records
         # values - function accepting record value, returns string
         # Used to generically convert from data format to display format
@@ -68,6 +370,91 @@ class CursesHud:
         # height of bottom panel (for extended info display)
         self.bottom_panel_height = 4
 
+        # function returning extra lines shown in the bottom panel for the
+        # selected record (see set_detail_provider())
+        self.detail_provider = None
+
+        # column -> largest display width of values in that column, and set
+        # of unique keys of records with a value that wide. Widths only grow
+        # as records are added; a column is measured again (when next
+        # needed) only once every record holding its widest value has been
+        # replaced or removed without another taking its place. Those
+        # columns are kept in `remeasure`.
+        self.column_max = {}
+        self.column_widest = {}
+        self.remeasure = set()
+
+        # columns always shown at the left (see set_pinned_columns()), and
+        # index in scroll_columns of the first of the other columns shown,
+        # moved with the left and right arrow keys
+        self.pinned_columns = []
+        self.column_offset = 0
+
+        # columns that are pinned and that aren't, in display order. Rebuilt
+        # (when None) after columns change
+        self.shown_pinned = None
+        self.scroll_columns = None
+
+        # number of scroll_columns shown by the last layout, and whether
+        # there are more off the right of the screen
+        self.scroll_shown = 0
+        self.more_columns = False
+
+        # True when the display needs redrawing
+        self.dirty = True
+
+        # upper limit on redraws per second
+        self.max_fps = 30
+
+        # (records to add, unique keys to remove) posted by other threads
+        # with post_update(), applied by the main loop between renders
+        self.update_queue = queue.SimpleQueue()
+
+        # pipe used by wakeup() to interrupt the main loop from other threads
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+
+        # set by SIGWINCH handler, terminal needs resizing
+        self.resized = False
+
+        # screen line -> (text, attribute) last drawn there, used to skip
+        # redrawing lines that haven't changed
+        self.drawn = {}
+
+        # value of scrollpos when the centre pane was last drawn
+        self.drawn_scrollpos = None
+
+        # list of (column, first screen column, width) for displayed columns
+        self.layout = []
+
+        # translated display strings, filled as records are added so that
+        # translations aren't called again for every render
+        self.display_cache = DisplayCache()
+
+        # text shown at the left and right of the title bar
+        self.title = ""
+        self.status = ""
+
+        # time.monotonic() of the first render that showed any records
+        self.first_paint = None
+
+        # called when the selection gets within a screen of the last record,
+        # so more records can be loaded before the user gets there
+        self.end_cb = None
+
+        # True when the bottom panel shows performance stats instead of the
+        # selected record (toggled with 'p')
+        self.show_stats = False
+
+        self.stats_prefix = stats.register_gauges("hud", self, {
+            "records": lambda hud: len(hud.record_index),
+            "shown": lambda hud: len(hud.records),
+            "columns": lambda hud: len(hud.columns),
+            "display_cache_hits": lambda hud: hud.display_cache.hits,
+            "display_cache_misses": lambda hud: hud.display_cache.misses,
+        })
+
     def set_unique_key(self, key):
         """
         set the unique key to disambiguate when records are updated
@@ -78,7 +465,67 @@ class CursesHud:
         """
         set the key used to sort records after insertion
         """
-        self.sort_key = key
+        self.set_sort_orders([[(key, False)]])
+
+    def set_sort_orders(self, orders):
+        """
+        set the sort orders the user can switch between, each a list of
+        (column, descending) pairs. The first is used straight away.
+        """
+        self.sort_orders = [list(order) for order in orders]
+        self.sort_order_index = 0
+        self._set_sort_order(self.sort_orders[0])
+
+    def set_sort_value(self, key, func):
+        """
+        set callback converting raw record values keyed by `key` to the
+        value records are sorted on (records where it returns None are sorted
+        last)
+        """
+        self.sorted_records.set_sort_value(key, func)
+        self._filter_records()
+        self.dirty = True
+
+    def _set_sort_order(self, order):
+        """
+        re-sort records by `order`, keeping the selected record selected
+        """
+        selected = None
+        if self.records:
+            selected = self.records[self.selectpos][self.unique_key]
+
+        self.sorted_records.set_order(order)
+        self._filter_records()
+
+        if selected is not None:
+            self._select_key(selected)
+
+        self.dirty = True
+
+    def _select_key(self, key):
+        """
+        select record with unique `key` (if it's displayed), scrolling it to
+        the middle of the screen if it's out of view
+        """
+        pos = self.sorted_records.index(key)
+        if pos is None:
+            return
+
+        if self.search_matches is not None:
+            if key not in self.search_matches:
+                return
+
+            # position among the records that are displayed
+            pos = sum(map(
+                self.search_matches.__contains__,
+                self.sorted_records.keys[:pos]
+            ))
+
+        self.selectpos = pos
+
+        rows = self._visible_rows()
+        if not self.scrollpos <= pos < self.scrollpos + rows:
+            self.scrollpos = max(pos - rows // 2, 0)
 
     def set_extra_info(self, key):
         """
@@ -87,8 +534,117 @@ class CursesHud:
         """
         if key in self.columns:
             self.columns.remove(key)
+            self._forget_width(key)
+            self.scroll_columns = None
+
+        # records may not have arrived yet, so remember the key either way
+        if key not in self.extra_info_keys:
             self.extra_info_keys += [key]
 
+    def set_pinned_columns(self, columns):
+        """
+        set columns that are always shown at the left of the display, while
+        the others scroll sideways with the left and right arrow keys
+        """
+        self.pinned_columns = list(columns)
+        self.scroll_columns = None
+        self.dirty = True
+
+    def set_action(self, key, func, prompt=None):
+        """
+        call `func` with the selected record when character `key` is
+        pressed. With a `prompt`, the user types some text first (in the
+        title bar, Enter to finish, Escape to cancel) which is passed to
+        `func` after the record.
+        """
+        self.actions[key] = (func, prompt)
+
+    def set_detail_provider(self, func):
+        """
+        set function called with the selected record, returning a list of
+        lines to show in the bottom panel below its extra info fields. It's
+        called every time the panel is drawn, so should be quick.
+        """
+        self.detail_provider = func
+        self.dirty = True
+
+    def set_bottom_panel_height(self, height):
+        """
+        set number of screen lines used by the bottom panel (including its
+        top border)
+        """
+        self.bottom_panel_height = height
+
+        # keep the selection on screen
+        rows = self._visible_rows()
+        if self.selectpos >= self.scrollpos + rows:
+            self.scrollpos = max(self.selectpos - rows + 1, 0)
+
+        self._invalidate()
+        self.dirty = True
+
+    def set_title(self, title):
+        """
+        set text shown at the left of the title bar
+        """
+        self.title = title
+        self.dirty = True
+
+    def set_status(self, status):
+        """
+        set text shown at the right of the title bar (for modal info, or
+        progress). Safe to call from other threads, followed by wakeup().
+        """
+        self.status = status
+        self.dirty = True
+
+    def set_end_cb(self, func):
+        """
+        set callback for when the user scrolls near the last record
+        """
+        self.end_cb = func
+
+    def set_search_fields(self, text_fields=None, predicate_fields=()):
+        """
+        set the fields searched for words (every field if None), and the
+        fields that can be matched with "field:value" search terms
+        """
+        self.search_text_fields = text_fields
+        self.search_predicate_fields = predicate_fields
+
+        # rebuilt with the new fields when next needed
+        self.search_index = None
+        if self.search_query:
+            self.set_search(self.search_query)
+
+    def set_search(self, query):
+        """
+        only display records matching `query` (all records if empty)
+        """
+        self.search_query = query
+
+        if query:
+            self._build_search_index()
+
+        self.selectpos = 0
+        self.scrollpos = 0
+        self._filter_records()
+        self.dirty = True
+
+    def _build_search_index(self):
+        """
+        index every record for searching, if that hasn't been done yet.
+        Records are indexed as they change from then on.
+        """
+        if self.search_index is not None:
+            return
+
+        self.search_index = SearchIndex(
+            self.search_text_fields, self.search_predicate_fields
+        )
+        for key, record in self.record_index.items():
+            self.search_index.add(key, record)
+
     def set_translation(self, key, func):
         """
         Set callback which translates raw record values keyed by `key` by
@@ -97,90 +653,401 @@ class CursesHud:
         """
         self.translations[key] = func
 
-    def _get_column_widths(self):
+        # display strings and widths change with translation, rebuild them
+        # when needed
+        self.display_cache.invalidate_column(key)
+        self._forget_width(key)
+
+    def _display_string(self, key, column, value):
+        """
+        returns display string for raw `value` in `column` of record with
+        unique key `key`
+        """
+        translate = self.translations.get(column, str)
+
+        return self.display_cache.get(key, column, value, translate)
+
+    def _value_width(self, column, value):
+        """
+        returns display width of raw record `value` in `column`. Doesn't go
+        through the display cache, as every value is measured but only
+        the rows on screen are drawn.
+        """
+        return len(str(self.translations.get(column, str)(value)))
+
+    def _add_widths(self, key, record):
         """
-        returns a dict keyed by column name, values are column widths
+        widen columns for a newly added record, where it has the widest
+        value so far
         """
-        column_widths = {}
+        for column, widest in self.column_widest.items():
+            if column not in record:
+                continue
+
+            width = self._value_width(column, record[column])
+            longest = self.column_max[column]
 
-        # Calculate widths for columns
-        # TODO: cache these values if records don't change between renders
-        for column in self.columns:
-            record_max_width = 0
+            # Once the widest values have gone no other record is wider, so
+            # one as wide (replacing a record, say) is the widest again
+            if width > longest:
+                self.column_max[column] = width
+                self.column_widest[column] = {key}
+                self.remeasure.discard(column)
+            elif width == longest:
+                widest.add(key)
+                self.remeasure.discard(column)
 
-            for record in self.records:
-                if column in record:
-                    r_value = record[column]
-                    if column in self.translations:
-                        r_value = self.translations[column](r_value)
-                    else:
-                        r_value = str(r_value)
-                    
-                    record_max_width = max(record_max_width, len(r_value))
+    def _remove_widths(self, key):
+        """
+        take a record that is being replaced or removed out of the column
+        widths. Columns where it was the last record with the widest value
+        are measured again when next needed.
+        """
+        for column, widest in self.column_widest.items():
+            if key in widest:
+                widest.discard(key)
+                if not widest:
+                    self.remeasure.add(column)
 
-            record_max_width += 3
+    def _forget_width(self, column):
+        """
+        drop the width of `column`, so it's measured again when needed
+        """
+        self.column_max.pop(column, None)
+        self.column_widest.pop(column, None)
+        self.remeasure.discard(column)
 
-            # len(column) + 3:
-            #   len(column): space for column header
-            #   +2: left border + space
-            #   +1: space on right of header
-            column_width = max(record_max_width, len(column) + 3)
+    def _measure_column(self, column):
+        """
+        find the widest value in `column` from all records
+        """
+        longest = 0
+        widest = set()
 
-            column_widths[column] = column_width
+        for key, record in self.record_index.items():
+            if column not in record:
+                continue
 
-        # Shrink columns until all fits on screen
-        # TODO: handling when there's too many columns to render happily
-        if sum(column_widths.values()) >= curses.COLS:
-            while sum(column_widths.values()) >= curses.COLS:
-                key_largest = max(column_widths, key=column_widths.get)
-                column_widths[key_largest] -= 1
+            width = self._value_width(column, record[column])
+            if width > longest:
+                longest = width
+                widest = {key}
+            elif width == longest:
+                widest.add(key)
 
-        return column_widths
+        self.column_max[column] = longest
+        self.column_widest[column] = widest
+        self.remeasure.discard(column)
+
+    def _column_width(self, column):
+        """
+        returns natural width of `column`, wide enough for its heading and
+        its widest value
+        """
+        if column not in self.column_max or column in self.remeasure:
+            self._measure_column(column)
+
+        # len(column) + 3:
+        #   len(column): space for column header
+        #   +2: left border + space
+        #   +1: space on right of header
+        return max(self.column_max[column], len(column)) + 3
+
+    def _truncate(self, string, width):
+        """
+        returns `string` cut down (suffixed by "...") to fit in a column of
+        `width` screen columns
+        """
+        if len(string) < (width - 2):
+            return string
+
+        return string[:width - 6] + "..."
+
+    def _visible_rows(self):
+        """
+        returns number of records that fit in the centre pane
+        """
+        # 1 line title bar, 3 lines of headings, then the bottom panel
+        return max(curses.LINES - 4 - self.bottom_panel_height, 0)
+
+    def _get_layout(self):
+        """
+        returns list of (column, first screen column, width) for displayed
+        columns: pinned columns, then as many of the others as fit on screen
+        at their natural widths, starting from column_offset. Only columns
+        that are displayed are looked at.
+        """
+        if self.scroll_columns is None:
+            pinned = set(self.pinned_columns)
+            self.shown_pinned = [
+                c for c in self.pinned_columns if c in self.columns
+            ]
+            self.scroll_columns = [c for c in self.columns if c not in pinned]
+
+        self.column_offset = max(
+            min(self.column_offset, len(self.scroll_columns) - 1), 0
+        )
+
+        # leave room for the right hand border
+        available = curses.COLS - 1
+
+        # pinned columns can take up to half the screen when there are other
+        # columns to show
+        pinned_space = available
+        if self.scroll_columns:
+            pinned_space = max(available // 2, MIN_COLUMN_WIDTH)
+
+        layout = []
+        col_start = 0
+
+        for column in self.shown_pinned:
+            width = self._column_width(column)
+            if col_start + width > pinned_space:
+                width = pinned_space - col_start
+                if width < MIN_COLUMN_WIDTH:
+                    break
+
+            layout.append((column, col_start, width))
+            col_start += width
+
+        shown = 0
+        self.more_columns = False
+
+        for n in range(self.column_offset, len(self.scroll_columns)):
+            column = self.scroll_columns[n]
+            width = self._column_width(column)
+
+            if col_start + width > available:
+                # A column too wide for the rest of the screen is cut down,
+                # unless it's a sliver or there are other columns showing
+                self.more_columns = True
+                width = available - col_start
+                if shown or width < MIN_COLUMN_WIDTH:
+                    break
+
+            layout.append((column, col_start, width))
+            col_start += width
+            shown += 1
+
+            if self.more_columns:
+                break
+
+        # If the terminal has got wider, bring back columns from the left
+        # rather than leave space at the right
+        if not self.more_columns and self.column_offset:
+            space = available - col_start
+            offset = self.column_offset
+            while offset and \
+                    self._column_width(self.scroll_columns[offset - 1]) <= space:
+                offset -= 1
+                space -= self._column_width(self.scroll_columns[offset])
+
+            if offset != self.column_offset:
+                self.column_offset = offset
+                return self._get_layout()
+
+        self.scroll_shown = shown
+        self.layout = layout
+
+        return layout
+
+    def _draw_line(self, y, text, attr=curses.A_NORMAL):
+        """
+        draw `text` across the full width of screen line `y`, unless the
+        line already shows exactly that
+        """
+        if self.drawn.get(y) == (text, attr):
+            return
+
+        self.drawn[y] = (text, attr)
+
+        # writing to the bottom right corner would move the cursor off
+        # screen, which curses treats as an error
+        width = curses.COLS
+        if y == curses.LINES - 1:
+            width -= 1
+
+        self.screen.addstr(y, 0, text[:width].ljust(width), attr)
+
+    def _invalidate(self):
+        """
+        forget what has been drawn, so that everything is redrawn next render
+        (call after clearing the screen)
+        """
+        self.drawn = {}
+        self.drawn_scrollpos = None
 
     def _render_title(self):
         """
         rendering of title bar on first line (space to display modal info,
         and even keybinding hints)
         """
-        title = "{title bar placeholder}"
-        title_bar = title + (" " * (curses.COLS - len(title)))
-        self.screen.addstr(0,0, title_bar, curses.A_REVERSE)
-
-    def _render_headers(self, start_line=1):
+        title = self.title
+
+        # text being typed for an action replaces everything else
+        if self.prompt is not None:
+            title += "  " + self.prompt[0] + self.prompt_text + "_"
+            self._draw_line(0, title, curses.A_REVERSE)
+            return
+
+        # search being typed or applied follows the title
+        if self.search_editing or self.search_query:
+            title += "  /" + self.search_query
+            if self.search_editing:
+                title += "_"
+            if self.search_matches is not None:
+                title += "  ({} matches)".format(len(self.records))
+
+        # show which columns are in view when they don't all fit
+        if self.column_offset or self.more_columns:
+            title += "  columns {}{}-{} of {}{}".format(
+                "◀ " if self.column_offset else "",
+                self.column_offset + 1,
+                self.column_offset + self.scroll_shown,
+                len(self.scroll_columns),
+                " ▶" if self.more_columns else ""
+            )
+
+        # show the sort order when there's a choice of them
+        if len(self.sort_orders) > 1:
+            title += "  sort: " + " ".join(
+                column + ("↓" if descending else "")
+                for column, descending in self.sorted_records.order
+            )
+
+        # status is shown at the right hand end of the title bar
+        space = curses.COLS - len(title) - len(self.status) - 1
+        title_bar = title + (" " * max(space, 1)) + self.status
+        self._draw_line(0, title_bar, curses.A_REVERSE)
+
+    def _render_headers(self, layout, start_line=1):
         """
         rendering of headers (3 lines tall, 2 lines header, 1 line bottom
         border.
         """
-        pass
+        top = []
+        names = []
+        bottom = []
 
-    def render(self):
-        # Render title bar (placeholder for now)
-        self._render_title()
+        for column, col_start, col_width in layout:
+            top.append("│".ljust(col_width))
+            names.append(("│ " + self._truncate(column, col_width)).ljust(col_width))
+            bottom.append("┴" + ("─" * (col_width - 1)))
 
-        # TODO: need to apply translation to raw values
-        # TODO: break this out into separate function, main panel as well
-        # Render bottom panel first
-        self.screen.addstr(curses.LINES - self.bottom_panel_height, 0, "─" * curses.COLS)
-        for i in range(curses.LINES - self.bottom_panel_height + 1, curses.LINES):
-            self.screen.addstr(i, 0, " " * (curses.COLS - 1))
+        # add left and right edge of column headings
+        top.append("│")
+        names.append("│")
+        bottom.append("┘")
+        bottom = "└" + "".join(bottom)[1:]
+
+        self._draw_line(start_line, "".join(top))
+        self._draw_line(start_line + 1, "".join(names))
+        self._draw_line(start_line + 2, bottom)
+
+    def _render_bottom_panel(self):
+        """
+        rendering of bottom panel, showing extra_info_keys fields of the
+        selected record
+        """
+        panel_start = curses.LINES - self.bottom_panel_height
+        self._draw_line(panel_start, "─" * curses.COLS)
+
+        if self.show_stats:
+            lines = stats.summary_lines(curses.COLS - 1)
+            for i in range(1, self.bottom_panel_height):
+                text = lines[i - 1] if i - 1 < len(lines) else ""
+                self._draw_line(panel_start + i, text)
+            return
 
         active_index = self.selectpos
-        active_record = self.records[active_index]
+        active_record = {}
+        if self.records:
+            active_record = self.records[active_index]
 
-        col_acc = 0
-        line_acc = 0
+        lines = [""]
         for field in self.extra_info_keys:
             if field not in active_record:
                 continue
 
-            st = "{}: {}, ".format(field, active_record[field])
-            if col_acc + len(st) >= curses.COLS:
-                col_acc = 0
-                line_acc += 1
+            # only one record is shown here, so translations aren't cached
+            translate = self.translations.get(field, str)
+            st = "{}: {}, ".format(field, translate(active_record[field]))
+            if len(lines[-1]) + len(st) >= curses.COLS:
+                lines.append("")
+
+            lines[-1] += st
+
+        if self.detail_provider is not None and active_record:
+            if not lines[-1]:
+                lines.pop()
+            lines += self.detail_provider(active_record) or []
+
+        for i in range(1, self.bottom_panel_height):
+            text = lines[i - 1] if i - 1 < len(lines) else ""
+            self._draw_line(panel_start + i, text)
+
+    def _format_row(self, record, layout):
+        """
+        returns screen line displaying `record` using column `layout`
+        """
+        key = record[self.unique_key]
+        parts = []
+        pos = 0
+
+        for column, col_start, col_width in layout:
+            if column not in record:
+                continue
+
+            value = self._display_string(key, column, record[column])
+            string = self._truncate(value, col_width)
+
+            parts.append(" " * (col_start + 2 - pos))
+            parts.append(string)
+            pos = col_start + 2 + len(string)
+
+        return "".join(parts)
+
+    def _scroll_rows(self, first_line, rows):
+        """
+        if the centre pane has scrolled by one record since the last render,
+        scroll the lines already on screen rather than redrawing all of them
+        """
+        if self.drawn_scrollpos is None:
+            return
+
+        shift = self.scrollpos - self.drawn_scrollpos
+        if abs(shift) != 1 or rows < 2:
+            return
+
+        last_line = first_line + rows - 1
+
+        self.screen.scrollok(True)
+        self.screen.setscrreg(first_line, last_line)
+        self.screen.scroll(shift)
+        self.screen.setscrreg(0, curses.LINES - 1)
+        self.screen.scrollok(False)
+
+        # move what we know about drawn lines along with the screen contents
+        moved = {}
+        for y in range(first_line, last_line + 1):
+            if first_line <= y + shift <= last_line:
+                moved[y] = self.drawn.get(y + shift)
+            else:
+                moved[y] = None
+
+        self.drawn.update(moved)
+
+    def render(self):
+        start = time.perf_counter()
+
+        # Columns in view are worked out first, the title bar shows them
+        layout = self._get_layout()
 
-            self.screen.addstr(curses.LINES - self.bottom_panel_height + 1 + line_acc, col_acc, st)
-            col_acc += len(st)
+        # Render title bar
+        self._render_title()
 
+        # Render bottom panel first
+        self._render_bottom_panel()
 
         #----------------------------------------------------------------------
 
@@ -188,112 +1055,93 @@ class CursesHud:
 
         h_start = 1
 
-        column_widths = self._get_column_widths()
-        sum_column_widths = sum([column_widths[c] for c in column_widths])
-
-        # utility function to get first screen column for heading/field
-        # based on column name/key
-        def column_start(column_name):
-            name_index = self.columns.index(column_name)
-            col_start = \
-                sum([column_widths[c] for c in self.columns[0:name_index]])
-
-            return col_start
-
-        # In case columns change between renders, clearing the first row
-        # will ensure that no leftover garbage is only partially drawn over
-        self.screen.addstr(h_start,0, " " * curses.COLS)
-        self.screen.addstr(h_start + 1,0, " " * curses.COLS)
-        
-        # draw column headings
-        for n, column in enumerate(self.columns):
-
-            col_start = column_start(column)
-            col_width = column_widths[column]
-            self.screen.addstr(h_start, col_start, "│")
-            self.screen.addstr(h_start + 1, col_start, "│")
-            string = column
-            truncated = string if len(string) < (column_widths[column] - 2) else string[:column_widths[column] - 6] + "..."
-            self.screen.addstr(h_start + 1, col_start + 2, truncated)
-            self.screen.addstr(h_start + 2, col_start, "┴" + ("─" * (col_width - 1)) )
-
-            # Debug: show column widths with marker
-            #self.screen.addstr(2 + (n % 2), col_start, "x" * col_width)
-        # add left and right edge of column headings
-        self.screen.addstr(h_start + 2, 0, "└")
-        self.screen.addstr(h_start, sum_column_widths, "│")
-        self.screen.addstr(h_start + 1, sum_column_widths, "│")
-        self.screen.addstr(h_start + 2, sum_column_widths, "┘")
-
-        # display records
-        slice_start = self.scrollpos
-        slice_end = self.scrollpos + curses.LINES - 3 - self.bottom_panel_height
-        record_slice = self.records[slice_start:slice_end]
-        for nr, record in enumerate(record_slice):
-            attr = 0
-
-            if nr + slice_start == self.selectpos:
+        self._render_headers(layout, h_start)
+
+        # display records, redrawing only lines that have changed
+        rows = self._visible_rows()
+        first_line = h_start + 3
+
+        self._scroll_rows(first_line, rows)
+        self.drawn_scrollpos = self.scrollpos
+
+        for nr in range(rows):
+            index = self.scrollpos + nr
+
+            if index >= len(self.records):
+                self._draw_line(first_line + nr, "")
+                continue
+
+            if index == self.selectpos:
                 attr = curses.A_REVERSE
             else:
                 attr = curses.A_NORMAL
-            self.screen.addstr(h_start + 3 +nr, 0, " " * curses.COLS, attr)
 
-            for n, column in enumerate(self.columns):
-                if column not in record:
-                    continue
+            text = self._format_row(self.records[index], layout)
+            self._draw_line(first_line + nr, text, attr)
 
-                col_start = column_start(column)
+        # draw latest changes to screen in a single update
+        self.screen.noutrefresh()
+        curses.doupdate()
 
-                value = record[column]
-                if column in self.translations:
-                    value = self.translations[column](value)
+        if self.first_paint is None and self.records:
+            self.first_paint = time.monotonic()
 
-                string = str(value)
-                truncated = string if len(string) < (column_widths[column] - 2) else string[:column_widths[column] - 6] + "..."
-                self.screen.addstr(h_start + 3 + nr, col_start + 2, truncated, attr)
-
-        # draw latest changes to screen
-        self.screen.refresh()
+        stats.add_time("render", time.perf_counter() - start)
 
     def add_column(self, name):
         """
         Add a column to the HUD
         """
         self.columns += [name]
+        self.scroll_columns = None
     
     def add_record(self, records):
         """
         add records to the display, will add columns as needed. `record` is
-        a dictionary, or a list of dictionaries.
+        a dictionary, or a list of dictionaries. A record with the unique
+        key of one already displayed replaces it, without comparing the two.
         """
         if type(records) is not list:
             records = [records]
 
+        if not records:
+            return
+
+        start = time.perf_counter()
+
         # automatically set unique key if none is set by this point
         if self.unique_key is None:
             self.unique_key = list(records[0].keys())[0]
 
         # verify that all unique keys are unique for this record set
-        unique_keys = []
+        unique_keys = set()
         for record in records:
             if record[self.unique_key] not in unique_keys:
-                unique_keys += [record[self.unique_key]]
+                unique_keys.add(record[self.unique_key])
             else:
                 raise Exception("duplicate records with same unique key")
 
+        changed = []
+
         for record in records:
-            # If record already exists, skip it
-            if record in self.records:
+            key = record[self.unique_key]
+
+            # Records are only passed in when they've changed (TaskWrapper
+            # has already compared them to build its TaskDelta), so only the
+            # very same object is skipped
+            existing = self.record_index.get(key)
+            if existing is record:
                 continue
 
             # If an existing record has the same unique key, then the record
             # has been updated, and we will replace it
-            replaced = False
-            for n, check in enumerate(self.records):
-                if check[self.unique_key] == record[self.unique_key]:
-                    self.records[n] = record
-                    replaced = True
-                    break
+            if existing is not None:
+                self._remove_widths(key)
+            self.record_index[key] = record
+            changed.append((key, record))
+
+            if self.search_index is not None:
+                self.search_index.add(key, record)
 
             # TODO: need hook to remove columns when no records in the database
             #       have those keys
@@ -302,54 +1150,370 @@ class CursesHud:
                 if (k not in self.columns) and (k not in self.extra_info_keys):
                     self.add_column(k)
 
-            if replaced:
-                # Old record updated, any new columns added above
-                continue
+            self._add_widths(key, record)
+
+        if changed:
+            self.sorted_records.update(changed)
+            self._update_record_list()
+            self.dirty = True
+
+        stats.add_time("add_record", time.perf_counter() - start)
+
+    def remove_record(self, keys):
+        """
+        remove records from the display. `keys` is a unique key value, or a
+        list of unique key values. Keys that aren't displayed are ignored.
+        """
+        if type(keys) is not list:
+            keys = [keys]
+
+        start = time.perf_counter()
+        changed = False
+
+        for key in keys:
+            if self.record_index.pop(key, None) is not None:
+                self._remove_widths(key)
+                self.display_cache.invalidate_record(key, self.columns)
+                self.sorted_records.remove(key)
+                changed = True
+
+                if self.search_index is not None:
+                    self.search_index.remove(key)
+
+        if changed:
+            self._update_record_list()
+            self.dirty = True
+
+        stats.add_time("remove_record", time.perf_counter() - start)
+
+    def _update_record_list(self):
+        """
+        update the displayed records after records have changed
+        """
+        self._filter_records()
+
+    def _filter_records(self):
+        """
+        rebuild the list of displayed records from the record list, keeping
+        only those matching the search
+        """
+        self.search_matches = None
+        if self.search_query and self.search_index is not None:
+            self.search_matches = self.search_index.search(self.search_query)
+
+        matches = self.search_matches
+        if matches is None:
+            self.records = self.sorted_records.records
+        else:
+            # runs once per keystroke while searching, so keep the loop in C
+            self.records = list(compress(
+                self.sorted_records.records,
+                map(matches.__contains__, self.sorted_records.keys)
+            ))
+
+        # keep the selection on screen if records were removed
+        self.selectpos = max(min(self.selectpos, len(self.records) - 1), 0)
+        self.scrollpos = min(self.scrollpos, self.selectpos)
+
+    def _check_end(self):
+        """
+        call end_cb if the selection is within a screen of the last record.
+        Only called as the user scrolls, so a search whose matches don't
+        fill the screen doesn't page in all of the history by itself.
+        """
+        if self.end_cb is not None and \
+                len(self.records) - self.selectpos <= self._visible_rows():
+            self.end_cb()
+
+    def wakeup(self):
+        """
+        wake up the main loop so that it redraws the display. Safe to call
+        from any thread (or a signal handler).
+        """
+        try:
+            os.write(self.wakeup_w, b"\0")
+        except BlockingIOError:
+            # pipe is full, so main loop has plenty of wakeups pending
+            pass
+
+    def post_update(self, records=None, remove_keys=None):
+        """
+        queue records to be added (or replaced) and unique keys of records
+        to be removed, and wake up the main loop to apply them. Unlike
+        add_record() and remove_record(), safe to call from any thread; it
+        never waits for the display.
+        """
+        self.update_queue.put((records or [], remove_keys or []))
+        self.wakeup()
+
+    def _apply_updates(self, budget):
+        """
+        apply queued updates from post_update() for up to `budget` seconds,
+        so that the display stays responsive while large updates arrive.
+        Returns True if there are still updates waiting.
+        """
+        deadline = time.monotonic() + budget
+
+        while time.monotonic() < deadline:
+            try:
+                records, remove_keys = self.update_queue.get_nowait()
+            except queue.Empty:
+                return False
+
+            self.add_record(records)
+            self.remove_record(remove_keys)
+
+        return not self.update_queue.empty()
+
+    def _on_sigwinch(self, signum, frame):
+        """
+        signal handler for terminal resizes
+        """
+        self.resized = True
+        self.wakeup()
+
+    def _handle_resize(self):
+        """
+        resize curses to the new terminal size
+        """
+        self.resized = False
+
+        size = os.get_terminal_size(sys.__stdout__.fileno())
+        curses.resizeterm(size.lines, size.columns)
+
+        # must be called so that curses.LINES, curses.COLS will change
+        curses.update_lines_cols()
+
+        # in case old data won't be redrawn after resize
+        self.screen.clear()
+        self._invalidate()
+        self.dirty = True
+
+    def _handle_key(self, c):
+        """
+        handle a single keypress from the user
+        """
+        if self.prompt is not None:
+            self._handle_prompt_key(c)
+            self.dirty = True
+            return
+
+        if self.search_editing and self._handle_search_key(c):
+            self.dirty = True
+            return
+
+        if 0 <= c < 256 and chr(c) in self.actions and self.records:
+            # Act on the selected record, once text has been typed if the
+            # action asks for some
+            func, prompt = self.actions[chr(c)]
+            record = self.records[self.selectpos]
+
+            if prompt is None:
+                func(record)
             else:
-                # This is a completely new record with new unique key
-                self.records += [record]
+                self.prompt = (prompt, func, record[self.unique_key])
+                self.prompt_text = ""
+
+            self.dirty = True
+            return
+
+        if c == ord("/"):
+            # Start typing a search, carrying on from the current one. The
+            # index is built now, so typing the first character doesn't lag
+            self.search_editing = True
+            self._build_search_index()
+
+        if c == 27 and self.search_query:
+            # Escape clears the search
+            self.set_search("")
+
+        if c == ord("o") and self.sort_orders:
+            # Switch to the next sort order
+            self.sort_order_index = \
+                (self.sort_order_index + 1) % len(self.sort_orders)
+            self._set_sort_order(self.sort_orders[self.sort_order_index])
+
+        if c == ord("O") and self.sort_orders:
+            # Reverse the current sort order
+            self._set_sort_order([
+                (column, not descending)
+                for column, descending in self.sorted_records.order
+            ])
+
+        if c == ord("p"):
+            # Toggle the performance stats in the bottom panel
+            self.show_stats = not self.show_stats
+
+        if c == curses.KEY_RIGHT and self.more_columns:
+            # Scroll columns one to the left, bringing in the next one
+            self.column_offset += 1
+
+        if c == curses.KEY_LEFT:
+            # Scroll columns back one to the right
+            self.column_offset = max(self.column_offset - 1, 0)
+
+        if c == curses.KEY_RESIZE:
+            # Terminal has been resized
+            curses.update_lines_cols()
+            self.screen.clear()
+            self._invalidate()
+
+        if c == curses.KEY_UP:
+            # Move up as far as the 0th record
+            self.selectpos = max(self.selectpos - 1, 0)
+            if self.selectpos < self.scrollpos:
+                # Handle scrolling if we were at the first record on screen
+                self.scrollpos -= 1
+
+        if c == curses.KEY_DOWN:
+            # Move down as far as the Nth record
+            self.selectpos = min(self.selectpos + 1, len(self.records) - 1)
+            if self.selectpos >= (self.scrollpos + self._visible_rows()):
+                # Handle scrolling if we were at the last record on screen
+                self.scrollpos += 1
+
+            # Ask for more records if the end is coming up
+            self._check_end()
+
+        self.dirty = True
+
+    def _handle_search_key(self, c):
+        """
+        handle a keypress while a search is being typed, returns False if
+        the key isn't part of the search (so arrow keys still work)
+        """
+        if c in (curses.KEY_ENTER, 10, 13):
+            # Keep the search, stop typing
+            self.search_editing = False
+        elif c == 27:
+            # Abandon the search
+            self.search_editing = False
+            self.set_search("")
+        elif c in (curses.KEY_BACKSPACE, 127, 8):
+            self.set_search(self.search_query[:-1])
+        else:
+            char = self._typed_char(c)
+            if char is None:
+                return False
+            if char:
+                self.set_search(self.search_query + char)
+
+        return True
+
+    def _handle_prompt_key(self, c):
+        """
+        handle a keypress while text for an action is being typed
+        """
+        if c in (curses.KEY_ENTER, 10, 13):
+            # Run the action on the record it was started on, as it is now
+            prompt, func, key = self.prompt
+            self.prompt = None
+
+            record = self.record_index.get(key)
+            if record is not None:
+                func(record, self.prompt_text)
+        elif c == 27:
+            self.prompt = None
+        elif c in (curses.KEY_BACKSPACE, 127, 8):
+            self.prompt_text = self.prompt_text[:-1]
+        else:
+            self.prompt_text += self._typed_char(c) or ""
+
+    def _typed_char(self, c):
+        """
+        returns character typed as key `c`, "" if it's part of a multibyte
+        character, or None if `c` isn't a character
+        """
+        if 32 <= c < 127:
+            return chr(c)
+
+        if not 128 <= c < 256:
+            return None
 
-        # Finally, sort records by appropriate key
-        if self.sort_key is not None:
-            self.records.sort(key=lambda R: R[self.sort_key])
+        # getch() returns UTF-8 characters a byte at a time
+        self.typed_bytes += bytes([c])
+        try:
+            char = self.typed_bytes.decode("utf-8")
+        except UnicodeDecodeError:
+            if len(self.typed_bytes) >= 4:
+                self.typed_bytes = b""
+            return ""
+
+        self.typed_bytes = b""
+        return char
 
     def mainloop(self):
         """
         Called after HUD has been set up. Handles rendering and user input.
+
+        Sleeps until there is user input, a call to wakeup(), or a terminal
+        resize, and only redraws when something has changed (at most
+        max_fps times per second). Records and the display are only touched
+        from this thread, other threads hand over changes with post_update().
         """
         # Disable cursor display by default
         curses.curs_set(0)
 
-        # Display initial state
-        self.render()
+        # Escape is used to cancel searches, so don't wait long to tell it
+        # apart from the start of an escape sequence
+        if hasattr(curses, "set_escdelay"):
+            curses.set_escdelay(25)
 
-        while True:
-            # Render before fetching input
-            self.render()
-
-            # note: call is non-blocking, per __init__ calling nodelay(True)
-            c = self.screen.getch()
-
-            if c == curses.KEY_RESIZE:
-                # Terminal has been resized
-
-                # must be called so that curses.LINES, curses.COLS will change
-                curses.update_lines_cols()
-
-                # in case old data won't be redrawn after resize
-                self.screen.clear()
-
-            if c == curses.KEY_UP:
-                # Move up as far as the 0th record
-                self.selectpos = max(self.selectpos - 1, 0)
-                if self.selectpos < self.scrollpos:
-                    # Handle scrolling if we were at the first record on screen
-                    self.scrollpos -= 1
-                    
-            if c == curses.KEY_DOWN:
-                # Move down as far as the Nth record
-                self.selectpos = min(self.selectpos + 1, len(self.records) - 1)
-                if self.selectpos >= (self.scrollpos + curses.LINES - 2 - self.bottom_panel_height) :
-                    # Handle scrolling if we were at the last record on screen
-                    self.scrollpos += 1
+        # Redraw on terminal resize without waiting for a keypress
+        signal.signal(signal.SIGWINCH, self._on_sigwinch)
+
+        stdin_fd = sys.__stdin__.fileno()
+        last_render = 0
 
+        while True:
+            timeout = None
+
+            # Apply updates from other threads, leaving time in the frame
+            # for rendering and input. Don't sleep if some are left over.
+            if self._apply_updates(0.5 / self.max_fps):
+                timeout = 0
+
+            if self.dirty:
+                # Render unless that would exceed the frame rate cap
+                now = time.monotonic()
+                next_render = last_render + 1.0 / self.max_fps
+                if now >= next_render:
+                    self.dirty = False
+                    last_render = now
+                    self.render()
+                elif timeout is None:
+                    timeout = next_render - now
+
+            # Keep the stats overlay current while it's shown
+            if self.show_stats:
+                if timeout is None or timeout > 1.0:
+                    timeout = 1.0
+                if time.monotonic() - last_render >= 1.0:
+                    self.dirty = True
+                    timeout = 0
+
+            # Wait for user input or a wakeup
+            readable, _, _ = select.select(
+                [stdin_fd, self.wakeup_r], [], [], timeout
+            )
+
+            if self.wakeup_r in readable:
+                # Drain the pipe, a single redraw handles every wakeup
+                try:
+                    while os.read(self.wakeup_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                self.dirty = True
+
+            if self.resized:
+                self._handle_resize()
+
+            # note: call is non-blocking, per __init__ calling nodelay(True).
+            # curses may buffer several keypresses per read, so keep going
+            # until it has none left
+            while True:
+                c = self.screen.getch()
+                if c == -1:
+                    break
+                self._handle_key(c)
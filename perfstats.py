@@ -0,0 +1,242 @@
+""" ---------------------------------------------------------------------------
+
+    perfstats.py - Performance counters shared by TaskHUD components
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import json
+import os
+import resource
+import signal
+import threading
+import time
+import weakref
+
+class PerfStats:
+    """
+    Collects timings of named operations (export, parse, render...) and
+    gauges (record counts, memory...) so that slow sessions can be looked
+    into. Safe to update from any thread.
+
+    Gauges are registered as functions, and only called when the stats are
+    read, so they cost nothing on hot paths. Gauges of an object (a HUD, a
+    TaskWrapper...) are registered with register_gauges(), which only keeps
+    a weak reference to it, and names them after that object so several
+    objects of the same kind can be told apart.
+    """
+    def __init__(self):
+        # re-entrant, as dump() may run in a signal handler on a thread that
+        # is already updating the stats
+        self.lock = threading.RLock()
+
+        # name -> [count, total seconds, longest, most recent]
+        self.timings = {}
+
+        # name -> function returning current value
+        self.gauges = {}
+
+        # prefix -> weak reference to the object it reports on, and
+        # name -> (prefix, function taking that object) for its gauges
+        self.owners = {}
+        self.owner_gauges = {}
+
+        self.started = time.time()
+
+    def add_time(self, name, seconds):
+        """
+        record that operation `name` took `seconds`
+        """
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = [0, 0.0, 0.0, 0.0]
+
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+            timing[3] = seconds
+
+    def timer(self, name):
+        """
+        returns context manager timing the code it wraps as operation `name`
+        """
+        return _Timer(self, name)
+
+    def register_gauge(self, name, func):
+        """
+        report the value returned by `func` as `name`
+        """
+        with self.lock:
+            self.gauges[name] = func
+
+    def register_gauges(self, prefix, owner, gauges):
+        """
+        report gauges of `owner` while it exists. `gauges` maps names to
+        functions taking `owner` and returning the current value. They are
+        reported as "<prefix>.<name>", with a number added to `prefix` if
+        another object is already using it. Returns the prefix used.
+        """
+        with self.lock:
+            self._drop_dead_owners()
+
+            used = prefix
+            n = 2
+            while used in self.owners:
+                used = "{}{}".format(prefix, n)
+                n += 1
+
+            self.owners[used] = weakref.ref(owner)
+            for name, func in gauges.items():
+                self.owner_gauges["{}.{}".format(used, name)] = (used, func)
+
+        return used
+
+    def unregister_gauges(self, prefix):
+        """
+        stop reporting gauges registered by register_gauges() as `prefix`
+        """
+        with self.lock:
+            self.owners.pop(prefix, None)
+            for name in [n for n, (p, func) in self.owner_gauges.items()
+                         if p == prefix]:
+                del self.owner_gauges[name]
+
+    def _drop_dead_owners(self):
+        for prefix, ref in list(self.owners.items()):
+            if ref() is None:
+                self.unregister_gauges(prefix)
+
+    def _gauge_values(self):
+        values = {}
+
+        with self.lock:
+            self._drop_dead_owners()
+            gauges = list(self.gauges.items())
+            for name, (prefix, func) in self.owner_gauges.items():
+                owner = self.owners[prefix]()
+                if owner is not None:
+                    gauges.append((name, lambda f=func, o=owner: f(o)))
+
+        for name, func in gauges:
+            try:
+                values[name] = func()
+            except Exception as e:
+                # gauges must never break whatever is reading them
+                values[name] = "error: {}".format(e)
+
+        values["rss_kb"] = rss_kb()
+        values["max_rss_kb"] = \
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        return values
+
+    def snapshot(self):
+        """
+        returns dict of all stats, suitable for JSON
+        """
+        with self.lock:
+            timings = {
+                name: {
+                    "count": count,
+                    "total_ms": total * 1000,
+                    "mean_ms": total * 1000 / count,
+                    "max_ms": longest * 1000,
+                    "last_ms": last * 1000,
+                }
+                for name, (count, total, longest, last)
+                in self.timings.items()
+            }
+
+        return {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "uptime_s": time.time() - self.started,
+            "timings": timings,
+            "gauges": self._gauge_values(),
+        }
+
+    def summary_lines(self, width):
+        """
+        returns list of lines (at most `width` wide) summarising the stats,
+        for display
+        """
+        items = []
+
+        with self.lock:
+            for name, (count, total, longest, last) in self.timings.items():
+                items.append("{} {:.1f}ms (max {:.1f}, n={})".format(
+                    name, last * 1000, longest * 1000, count
+                ))
+
+        for name, value in self._gauge_values().items():
+            if name.endswith("_kb") and isinstance(value, int):
+                items.append("{} {:.1f}MB".format(name[:-3], value / 1024))
+            else:
+                items.append("{} {}".format(name, value))
+
+        lines = [""]
+        for item in items:
+            if lines[-1] and len(lines[-1]) + len(item) + 2 > width:
+                lines.append("")
+            lines[-1] += ("  " if lines[-1] else "") + item
+
+        return lines
+
+    def dump(self, path):
+        """
+        write snapshot() to `path` as JSON (replacing the file atomically)
+        """
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2, default=str)
+        os.replace(tmp_path, path)
+
+    def dump_on_signal(self, path, signum=signal.SIGUSR1):
+        """
+        write stats to `path` whenever the process receives `signum` (must
+        be called from the main thread)
+        """
+        def handler(signum, frame):
+            try:
+                self.dump(path)
+            except OSError:
+                pass
+
+        signal.signal(signum, handler)
+
+class _Timer:
+    """
+    context manager used by PerfStats.timer()
+    """
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+
+def rss_kb():
+    """
+    returns resident memory of this process in KB (peak, where the current
+    value isn't available)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# Stats for the whole process, updated by TaskWrapper and CursesHud
+stats = PerfStats()
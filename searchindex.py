@@ -0,0 +1,273 @@
+""" ---------------------------------------------------------------------------
+
+    searchindex.py - Inverted index used by CursesHud to filter records
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import re
+from bisect import bisect_left
+
+# words that text is split into for indexing (and that queries are split
+# into for matching)
+WORD_RE = re.compile(r"\w+")
+
+# sorts after any character that can appear in an indexed term, used to find
+# the end of a range of terms sharing a prefix
+PREFIX_END = "\U0010ffff"
+
+class PrefixIndex:
+    """
+    Maps terms to the set of record keys containing them. Terms are also
+    kept in a sorted list, so every term starting with a prefix can be found
+    with a binary search. New terms are collected and sorted into the list
+    in one go the next time it's needed, as inserting each one would copy
+    the list every time. Terms no record has any more are left in place
+    (with an empty set of keys) and cleared out in the same way, once
+    there are enough of them to be worth a pass over the list.
+    """
+    def __init__(self):
+        # term -> set of record keys
+        self.postings = {}
+
+        # terms in postings, sorted, and terms added since it was sorted
+        self.terms = []
+        self.new_terms = []
+
+        # number of terms in postings with no keys
+        self.empty = 0
+
+    def _merge(self):
+        """
+        sort new terms into the list of terms, and drop terms with no keys
+        if there are enough of them
+        """
+        if self.empty > max(len(self.terms) // 8, 64):
+            postings = self.postings
+            self.terms = [t for t in self.terms if postings[t]]
+            self.new_terms = [t for t in self.new_terms if postings[t]]
+            for term in [t for t, keys in postings.items() if not keys]:
+                del postings[term]
+            self.empty = 0
+
+        if self.new_terms:
+            self.new_terms.sort()
+            # two sorted runs, which sort() merges in linear time
+            self.terms += self.new_terms
+            self.terms.sort()
+            self.new_terms = []
+
+    def add(self, term, key):
+        keys = self.postings.get(term)
+        if keys is None:
+            keys = self.postings[term] = set()
+            self.new_terms.append(term)
+        elif not keys:
+            self.empty -= 1
+
+        keys.add(key)
+
+    def discard(self, term, key):
+        keys = self.postings.get(term)
+        if not keys or key not in keys:
+            return
+
+        keys.discard(key)
+        if not keys:
+            self.empty += 1
+
+    def prefix(self, prefix):
+        """
+        returns set of keys for records with a term starting with `prefix`
+        """
+        self._merge()
+
+        start = bisect_left(self.terms, prefix)
+        end = bisect_left(self.terms, prefix + PREFIX_END, start)
+
+        if end - start == 1:
+            return self.postings[self.terms[start]]
+
+        matches = set()
+        for term in self.terms[start:end]:
+            matches |= self.postings[term]
+
+        return matches
+
+class SearchIndex:
+    """
+    Inverted index over records, kept up to date as records are added and
+    removed, so that a search doesn't need to look at every record.
+
+    Words in `text_fields` (every field, if None) are indexed for free text
+    search. Values of `predicate_fields` are indexed whole, for "field:value"
+    predicates. Matching is by prefix and ignores case, so results can be
+    shown while a query is being typed.
+    """
+    def __init__(self, text_fields=None, predicate_fields=()):
+        self.text_fields = text_fields
+        self.predicate_fields = set(predicate_fields)
+
+        # words from text fields
+        self.words = PrefixIndex()
+
+        # field name -> PrefixIndex of values in that field
+        self.values = {field: PrefixIndex() for field in self.predicate_fields}
+
+        # record key -> (set of words, set of (field, value)) indexed for
+        # it, so the record can be updated or taken out of the index again
+        self.entries = {}
+
+        # query condition -> set of matching keys, for conditions looked up
+        # since the index last changed (typing and deleting characters keeps
+        # revisiting the same prefixes)
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _text(self, value, out):
+        """
+        appends strings found in `value` to list `out`, looking inside lists
+        and dicts (such as TaskWarrior annotations, where only the
+        description is text, the rest being timestamps)
+        """
+        if type(value) is str:
+            out.append(value)
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                self._text(v, out)
+        elif isinstance(value, dict):
+            if "description" in value:
+                self._text(value["description"], out)
+            else:
+                for v in value.values():
+                    self._text(v, out)
+        elif value is not None:
+            out.append(str(value))
+
+    def add(self, key, record):
+        """
+        index `record` under its unique `key`, replacing anything indexed for
+        that key before. Only words and values that differ from the ones
+        indexed before are changed.
+        """
+        fields = self.text_fields
+        if fields is None:
+            fields = record.keys()
+
+        text = []
+        for field in fields:
+            value = record.get(field)
+            if type(value) is str:
+                text.append(value)
+            elif value is not None:
+                self._text(value, text)
+
+        words = set(WORD_RE.findall(" ".join(text).lower()))
+
+        values = set()
+        for field in self.predicate_fields:
+            value = record.get(field)
+            if value is None:
+                continue
+
+            if not isinstance(value, (list, tuple)):
+                value = [value]
+
+            for v in value:
+                if not isinstance(v, dict):
+                    values.add((field, str(v).lower()))
+
+        old_words, old_values = self.entries.get(key, ((), ()))
+        if words == old_words and values == old_values:
+            return
+
+        for word in old_words:
+            if word not in words:
+                self.words.discard(word, key)
+        for field, value in old_values:
+            if (field, value) not in values:
+                self.values[field].discard(value, key)
+
+        add = self.words.add
+        for word in words:
+            if word not in old_words:
+                add(word, key)
+        for field, value in values:
+            if (field, value) not in old_values:
+                self.values[field].add(value, key)
+
+        self.entries[key] = (words, values)
+        self.cache.clear()
+
+    def remove(self, key):
+        """
+        take record with unique `key` out of the index
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        words, values = entry
+        for word in words:
+            self.words.discard(word, key)
+        for field, value in values:
+            self.values[field].discard(value, key)
+
+        self.cache.clear()
+
+    def parse_query(self, query):
+        """
+        returns list of (field, prefix) conditions in `query`, field being
+        None for free text words
+        """
+        conditions = []
+
+        for term in query.lower().split():
+            field, sep, value = term.partition(":")
+            if sep and field in self.predicate_fields:
+                # an empty value ("project:") doesn't narrow anything down
+                if value:
+                    conditions.append((field, value))
+                continue
+
+            for word in WORD_RE.findall(term):
+                conditions.append((None, word))
+
+        return conditions
+
+    def _lookup(self, condition):
+        matches = self.cache.get(condition)
+        if matches is None:
+            field, prefix = condition
+            if field is None:
+                matches = self.words.prefix(prefix)
+            else:
+                matches = self.values[field].prefix(prefix)
+            self.cache[condition] = matches
+
+        return matches
+
+    def search(self, query):
+        """
+        returns set of keys for records matching every condition in `query`,
+        or None if the query has no conditions (everything matches)
+        """
+        conditions = self.parse_query(query)
+        if not conditions:
+            return None
+
+        # intersect smallest sets first, so the work done shrinks quickly
+        found = sorted((self._lookup(c) for c in conditions), key=len)
+
+        matches = set(found[0])
+        for keys in found[1:]:
+            if not matches:
+                break
+            matches &= keys
+
+        return matches
@@ -0,0 +1,154 @@
+""" ---------------------------------------------------------------------------
+
+    taskactions.py - Changes made to tasks from TaskHUD, and their expected
+                     results
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import time
+
+from taskstore import TASK_FIELDS, TaskRecord
+
+# TaskWarrior commands TaskHUD can run on tasks
+WRITE_COMMANDS = {"done", "start", "stop", "modify", "annotate"}
+
+# rc overrides for commands run by TaskHUD. Confirmation and output are
+# turned off, as nobody will see them. Garbage collection and recurrence are
+# skipped as they rewrite and renumber the data files; the next interactive
+# `task` command catches up on both.
+WRITE_OVERRIDES = [
+    "rc.confirmation=off", "rc.bulk=0", "rc.verbose=nothing", "rc.gc=off",
+    "rc.recurrence=off",
+]
+
+# Attributes `task modify` sets with "name:value", that can be predicted
+# from the value typed (dates like "tomorrow" are left to TaskWarrior)
+MODIFY_ATTRIBUTES = ("project", "priority", "recur")
+
+def export_date(epoch=None):
+    """
+    returns seconds since epoch (default now) as a TaskWarrior export date
+    """
+    return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(epoch))
+
+def _modify_attribute(name, record):
+    """
+    returns attribute `name` (or a unique abbreviation of it, as TaskWarrior
+    allows) refers to, None if it isn't one whose result can be predicted,
+    or False if it isn't an attribute at all
+    """
+    udas = tuple(k for k in record.keys() if k not in TASK_FIELDS)
+    names = TASK_FIELDS + udas
+
+    if name not in names:
+        matches = [n for n in names if len(name) >= 3 and n.startswith(name)]
+        if len(matches) != 1:
+            return False
+        name = matches[0]
+
+    if name in MODIFY_ATTRIBUTES or name in udas:
+        return name
+
+    return None
+
+def predict_action(record, command, args=(), now=None):
+    """
+    returns TaskRecord with the change `task <uuid> <command> <args>` is
+    expected to make to `record`. Only needs to be close, TaskWarrior's
+    version of the task replaces it once the command has run.
+    """
+    data = record.to_dict()
+    now = export_date(now)
+
+    if command == "done":
+        # finished tasks lose their id, and sort after pending ones
+        data["status"] = "completed"
+        data["end"] = now
+        data["id"] = 0
+        data.pop("start", None)
+
+    elif command == "start":
+        data["start"] = now
+
+    elif command == "stop":
+        data.pop("start", None)
+
+    elif command == "annotate":
+        data["annotations"] = list(data.get("annotations", ())) + [
+            {"entry": now, "description": " ".join(args)}
+        ]
+
+    elif command == "modify":
+        words = []
+
+        for arg in args:
+            name, sep, value = arg.partition(":")
+            attribute = _modify_attribute(name, record) if sep else False
+
+            if arg.startswith("+") and len(arg) > 1:
+                tags = list(data.get("tags", ()))
+                if arg[1:] not in tags:
+                    data["tags"] = tags + [arg[1:]]
+            elif arg.startswith("-") and len(arg) > 1:
+                tags = [t for t in data.get("tags", ()) if t != arg[1:]]
+                if tags:
+                    data["tags"] = tags
+                else:
+                    data.pop("tags", None)
+            elif attribute is None:
+                # an attribute, but not one that can be predicted
+                pass
+            elif attribute:
+                if value:
+                    data[attribute] = value
+                else:
+                    data.pop(attribute, None)
+            else:
+                words.append(arg)
+
+        # other words replace the description
+        if words:
+            data["description"] = " ".join(words)
+
+    else:
+        raise ValueError("unknown command {}".format(command))
+
+    data["modified"] = now
+
+    return TaskRecord(data)
+
+def command_args(uuids, command, args=()):
+    """
+    returns arguments (after the task command) that run `command` on tasks
+    with `uuids`
+    """
+    if command == "annotate":
+        # everything after "--" is annotation text, even "name:value"
+        args = ["--"] + list(args)
+
+    return WRITE_OVERRIDES + list(uuids) + [command] + list(args)
+
+def batch_actions(actions):
+    """
+    returns list of (uuids, command, args, merged) with consecutive
+    `actions` (each (uuids, command, args)) making the same change merged,
+    so they can be run as a single TaskWarrior command. `merged` lists the
+    actions each batch covers.
+    """
+    batches = []
+
+    for action in actions:
+        uuids, command, args = action
+
+        if batches and batches[-1][1:3] == (command, args):
+            batch = batches[-1]
+            batch[0].extend(uuid for uuid in uuids if uuid not in batch[0])
+            batch[3].append(action)
+        else:
+            batches.append((list(uuids), command, args, [action]))
+
+    return batches
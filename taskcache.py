@@ -0,0 +1,111 @@
+""" ---------------------------------------------------------------------------
+
+    taskcache.py - On-disk snapshot of the local task database
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import hashlib
+import marshal
+import os
+import tempfile
+
+from taskstore import TaskRecord
+
+# Bump whenever the snapshot layout (or TaskRecord.pack()) changes, old
+# snapshots are then ignored
+SNAPSHOT_VERSION = 1
+
+# first bytes of every snapshot file
+SNAPSHOT_MAGIC = b"TASKHUD-SNAPSHOT\n"
+
+def default_cache_dir():
+    """
+    returns directory snapshots are kept in, following XDG conventions
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") \
+        or os.path.expanduser("~/.cache")
+
+    return os.path.join(cache_home, "taskhud")
+
+class SnapshotCache:
+    """
+    Saves the local task database to a file, so that the next start up can
+    display tasks before TaskWarrior has exported anything.
+
+    Snapshots are stored with marshal, which loads quickly and keeps shared
+    (interned) strings shared. Each snapshot records the modification times
+    and sizes of the TaskWarrior data files it was made from, so a loaded
+    snapshot can be checked for being up to date. Snapshots made with a
+    different `config` (filter settings etc.) or snapshot version, and files
+    that can't be read, are ignored.
+    """
+    def __init__(self, task_path, config, cache_dir=None):
+        """
+        task_path: TaskWarrior data directory
+        config: tuple of settings that change what gets loaded
+        cache_dir: directory to keep snapshots in (default_cache_dir())
+        """
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+
+        self.config = config
+
+        # One snapshot per data directory and config
+        key = repr((os.path.realpath(task_path), config)).encode("utf-8")
+        name = "snapshot-{}.cache".format(hashlib.sha1(key).hexdigest()[:16])
+        self.path = os.path.join(cache_dir, name)
+
+    def load(self):
+        """
+        returns (stamps, state, records) from the snapshot file, or None if
+        there isn't a usable snapshot
+        """
+        try:
+            with open(self.path, "rb") as f:
+                if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                    return None
+                snapshot = marshal.load(f)
+
+            if snapshot["version"] != SNAPSHOT_VERSION:
+                return None
+            if snapshot["config"] != self.config:
+                return None
+
+            records = [TaskRecord.unpack(r) for r in snapshot["records"]]
+
+            return (snapshot["stamps"], snapshot["state"], records)
+        except (OSError, EOFError, ValueError, TypeError, KeyError,
+                IndexError, StopIteration):
+            # missing, corrupt or from an incompatible version
+            return None
+
+    def save(self, stamps, state, records):
+        """
+        write snapshot of `records` (made when data files had `stamps`),
+        along with dict of TaskWrapper `state`. Replaces the old snapshot
+        atomically, so a crash can't leave a half written file behind.
+        """
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "config": self.config,
+            "stamps": stamps,
+            "state": state,
+            "records": [record.pack() for record in records],
+        }
+
+        cache_dir = os.path.dirname(self.path)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(SNAPSHOT_MAGIC)
+                marshal.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
@@ -0,0 +1,640 @@
+""" ---------------------------------------------------------------------------
+
+    taskdaemon.py - Shares one TaskWrapper between TaskHUD instances over a
+                    Unix domain socket
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import collections
+import errno
+import hashlib
+import marshal
+import os
+import select
+import socket
+import stat
+import struct
+import tempfile
+import threading
+
+from perfstats import stats
+from taskstore import TASK_FIELDS, TaskRecord, TaskStore
+from taskwrapper import TaskDelta, TaskWarriorError
+
+# Bump whenever messages change, clients and daemons from different versions
+# then don't talk to each other. TASK_FIELDS is sent along with it, as
+# records are sent as TaskRecord.pack() tuples.
+PROTOCOL_VERSION = 1
+
+# Every message is a marshalled tuple, preceded by its length
+FRAME_HEADER = struct.Struct("!I")
+
+# records per message when sending the database to a new client
+SNAPSHOT_CHUNK = 2000
+
+# struct ucred returned by SO_PEERCRED (pid, uid, gid)
+PEER_CREDS = struct.Struct("3i")
+
+# seconds a client waits for the daemon to say hello
+CONNECT_TIMEOUT = 2.0
+
+def default_socket_path(task_path="~/.task"):
+    """
+    returns path of the socket the daemon for TaskWarrior data directory
+    `task_path` listens on. Kept in $XDG_RUNTIME_DIR where there is one, as
+    it's private to the user, otherwise in a private directory under /tmp.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        socket_dir = os.path.join(runtime_dir, "taskhud")
+    else:
+        socket_dir = os.path.join(
+            tempfile.gettempdir(), "taskhud-{}".format(os.getuid())
+        )
+
+    # One daemon per data directory
+    key = os.path.realpath(os.path.expanduser(task_path)).encode("utf-8")
+    name = "daemon-{}.sock".format(hashlib.sha1(key).hexdigest()[:16])
+
+    return os.path.join(socket_dir, name)
+
+def check_private_dir(path):
+    """
+    raises OSError unless `path` is a directory (not a link to one) owned by
+    the user, that nobody else can get into
+    """
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() \
+            or st.st_mode & 0o077:
+        raise OSError(
+            errno.EPERM, "socket directory isn't private to the user", path
+        )
+
+def peer_uid(sock):
+    """
+    returns uid of the process at the other end of Unix domain socket
+    `sock`, or None where the platform can't tell
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+
+    creds = sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, PEER_CREDS.size
+    )
+    pid, uid, gid = PEER_CREDS.unpack(creds)
+    return uid
+
+def check_peer(sock, path):
+    """
+    raises OSError unless the other end of `sock`, connected to the socket
+    at `path`, runs as the same user. Where the peer's credentials aren't
+    available, the socket and its directory have to belong to the user.
+    """
+    uid = peer_uid(sock)
+    if uid is None:
+        check_private_dir(os.path.dirname(path))
+        uid = os.lstat(path).st_uid
+
+    if uid != os.getuid():
+        raise OSError(
+            errno.EPERM, "TaskHUD socket belongs to another user", path
+        )
+
+def encode_message(message):
+    """
+    returns `message` (tuple of plain values) framed for sending
+    """
+    data = marshal.dumps(message)
+    return FRAME_HEADER.pack(len(data)) + data
+
+def read_message(f):
+    """
+    returns next message from binary file `f`, or None at end of file
+    """
+    header = f.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+
+    size, = FRAME_HEADER.unpack(header)
+    data = f.read(size)
+    if len(data) < size:
+        return None
+
+    return marshal.loads(data)
+
+def delta_message(delta):
+    """
+    returns message describing TaskDelta `delta`
+    """
+    return (
+        "delta",
+        [record.pack() for record in delta.added],
+        [record.pack() for record in delta.modified],
+        list(delta.deleted),
+    )
+
+class DaemonClient:
+    """
+    Connection to a single HUD, with messages waiting to be sent to it
+    """
+    def __init__(self, sock):
+        self.sock = sock
+
+        # bytes being sent, and what's queued up after them: framed messages
+        # (bytes), or lists of records to send as part of a snapshot, which
+        # are only packed when the client is ready for them
+        self.out = b""
+        self.queue = collections.deque()
+
+        # bytes received that don't yet make up a whole message
+        self.inbuf = b""
+
+    def has_output(self):
+        return bool(self.out or self.queue)
+
+    def fill(self):
+        """
+        move the next queued message into the output buffer
+        """
+        item = self.queue.popleft()
+        if type(item) is list:
+            item = encode_message(
+                ("delta", [record.pack() for record in item], [], [])
+            )
+        self.out = item
+
+class TaskDaemon:
+    """
+    Runs a TaskWrapper on behalf of any number of HUDs, so that changes are
+    exported once rather than once per HUD.
+
+    HUDs connect to the Unix domain socket at `path` (see RemoteTaskWrapper)
+    and are sent the whole database, followed by every TaskDelta as it
+    happens. Messages are marshalled tuples. marshal isn't safe with data
+    from anyone else, so the socket lives in a directory private to the
+    user, and both ends check the other runs as the same user (see
+    check_peer()) before decoding anything:
+
+        ("hello", PROTOCOL_VERSION, TASK_FIELDS)
+        ("delta", added, modified, deleted)   records as TaskRecord.pack()
+        ("loaded", loaded_from_cache)         initial load has finished
+        ("error", message)                    an update failed
+
+    HUDs send ("history",) to have the next page of history loaded, which
+    is then sent to every HUD, and ("action", uuids, command, args) to have
+    TaskWrapper.queue_action() change tasks.
+    """
+    def __init__(self, task_wrapper, path=None):
+        self.task_wrapper = task_wrapper
+        self.path = path or default_socket_path(task_wrapper.task_path)
+
+        # held while publishing changes, so every client sees them in the
+        # same order
+        self.lock = threading.Lock()
+
+        # the daemon's view of the database, built from the deltas it has
+        # published, so new clients get a snapshot consistent with the
+        # deltas that follow it
+        self.records = {}
+
+        # set once the initial load has finished
+        self.loaded = False
+
+        # connected clients, keyed by socket
+        self.clients = {}
+
+        # pipe used to wake up the serving loop when there's output queued
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+
+        self.listener = None
+
+        # set by close(), stops serve()
+        self.closed = False
+
+        task_wrapper.change_cb = self.publish
+        task_wrapper.load_cb = self._on_loaded
+        task_wrapper.error_cb = self._on_error
+
+        self.stats_prefix = stats.register_gauges("daemon", self, {
+            "clients": lambda daemon: len(daemon.clients),
+        })
+
+    def _broadcast(self, data):
+        """
+        queue framed message `data` for every client (call with lock held)
+        """
+        for client in self.clients.values():
+            client.queue.append(data)
+
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            os.write(self.wakeup_w, b"\0")
+        except BlockingIOError:
+            # pipe is full, so a wakeup is pending anyway
+            pass
+
+    def publish(self, delta):
+        """
+        send TaskDelta `delta` to every client (TaskWrapper's change_cb)
+        """
+        # packed once, whatever the number of clients
+        data = encode_message(delta_message(delta))
+
+        with self.lock:
+            for record in delta.added:
+                self.records[record["uuid"]] = record
+            for record in delta.modified:
+                self.records[record["uuid"]] = record
+            for uuid in delta.deleted:
+                self.records.pop(uuid, None)
+
+            self._broadcast(data)
+
+    def _on_loaded(self):
+        with self.lock:
+            self.loaded = True
+            self._broadcast(encode_message(
+                ("loaded", self.task_wrapper.loaded_from_cache)
+            ))
+
+    def _on_error(self, e):
+        with self.lock:
+            self._broadcast(encode_message(("error", str(e))))
+
+    def listen(self):
+        """
+        create the socket, replacing one left behind by a daemon that has
+        gone away. Raises OSError if another daemon is already running.
+        """
+        # the directory may have been made by someone else first
+        socket_dir = os.path.dirname(self.path)
+        os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+        check_private_dir(socket_dir)
+
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                raise OSError(
+                    errno.EADDRINUSE,
+                    "TaskHUD daemon already running", self.path
+                )
+            finally:
+                probe.close()
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.listener.listen(16)
+        self.listener.setblocking(False)
+
+    def _accept(self):
+        sock, _ = self.listener.accept()
+        try:
+            check_peer(sock, self.path)
+        except OSError:
+            sock.close()
+            return
+
+        sock.setblocking(False)
+        client = DaemonClient(sock)
+
+        client.queue.append(encode_message(
+            ("hello", PROTOCOL_VERSION, TASK_FIELDS)
+        ))
+
+        # Take the snapshot and start queueing deltas for the client in one
+        # step, so that it sees every change exactly once
+        with self.lock:
+            records = list(self.records.values())
+            for n in range(0, len(records), SNAPSHOT_CHUNK):
+                client.queue.append(records[n:n + SNAPSHOT_CHUNK])
+
+            if self.loaded:
+                client.queue.append(encode_message(
+                    ("loaded", self.task_wrapper.loaded_from_cache)
+                ))
+
+            self.clients[sock] = client
+
+    def _drop(self, client):
+        with self.lock:
+            self.clients.pop(client.sock, None)
+        client.sock.close()
+
+    def _read(self, client):
+        """
+        handle requests from `client`
+        """
+        try:
+            data = client.sock.recv(4096)
+        except OSError:
+            data = b""
+
+        if not data:
+            self._drop(client)
+            return
+
+        client.inbuf += data
+
+        while len(client.inbuf) >= FRAME_HEADER.size:
+            size, = FRAME_HEADER.unpack_from(client.inbuf)
+            end = FRAME_HEADER.size + size
+            if len(client.inbuf) < end:
+                break
+
+            try:
+                message = marshal.loads(client.inbuf[FRAME_HEADER.size:end])
+            except (EOFError, ValueError, TypeError):
+                self._drop(client)
+                return
+            client.inbuf = client.inbuf[end:]
+
+            self.handle_request(client, message)
+
+    def handle_request(self, client, message):
+        """
+        act on `message` received from `client`
+        """
+        if message[0] == "history":
+            self.task_wrapper.request_history()
+
+        elif message[0] == "action":
+            uuids, command, args = message[1:]
+            try:
+                self.task_wrapper.queue_action(uuids, command, args)
+            except ValueError as e:
+                with self.lock:
+                    client.queue.append(encode_message(("error", str(e))))
+                self._wakeup()
+
+    def _write(self, client):
+        """
+        send as much queued output to `client` as it will take
+        """
+        with self.lock:
+            if not client.out and client.queue:
+                client.fill()
+
+        try:
+            sent = client.sock.send(client.out)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._drop(client)
+            return
+
+        client.out = client.out[sent:]
+
+    def serve(self):
+        """
+        start the TaskWrapper, and serve clients until interrupted
+        """
+        if self.listener is None:
+            self.listen()
+
+        self.task_wrapper.start()
+
+        try:
+            while not self.closed:
+                with self.lock:
+                    clients = list(self.clients.values())
+
+                writers = [c.sock for c in clients if c.has_output()]
+                readable, writable, _ = select.select(
+                    [self.listener, self.wakeup_r] + [c.sock for c in clients],
+                    writers, []
+                )
+
+                # close() may have been called from another thread
+                if self.closed:
+                    break
+
+                if self.wakeup_r in readable:
+                    try:
+                        while os.read(self.wakeup_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+
+                if self.listener in readable:
+                    try:
+                        self._accept()
+                    except BlockingIOError:
+                        pass
+
+                for client in clients:
+                    if client.sock in readable:
+                        self._read(client)
+                    if client.sock in writable and client.sock.fileno() != -1:
+                        self._write(client)
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        stop listening, and disconnect clients
+        """
+        self.closed = True
+        self._wakeup()
+        stats.unregister_gauges(self.stats_prefix)
+
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+        with self.lock:
+            for client in self.clients.values():
+                # shut down first, so clients see the connection close even
+                # while serve() is still waiting on the socket
+                try:
+                    client.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                client.sock.close()
+            self.clients = {}
+
+class RemoteTaskWrapper:
+    """
+    Stands in for TaskWrapper in a HUD, getting the database and changes
+    to it from a TaskDaemon rather than running TaskWarrior itself. Has the
+    same callbacks (change_cb, load_cb, error_cb) and task_db as TaskWrapper.
+
+    Use connect() to make one, which returns None when there's no daemon to
+    connect to, so the HUD can run its own TaskWrapper instead. If the
+    connection is lost later on, disconnect_cb is called (if set) so the HUD
+    can do the same, otherwise error_cb is.
+    """
+    def __init__(self, sock, change_cb=None, error_cb=None, load_cb=None,
+                 task_path="~/.task", disconnect_cb=None):
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+
+        # TaskWarrior data directory the daemon serves
+        self.task_path = task_path
+
+        # TaskWarrior's undo.data, for reading task history directly
+        self.undo_path = os.path.join(
+            os.path.expanduser(task_path), "undo.data"
+        )
+
+        # guards writes to the socket, which are made from the HUD thread
+        self.send_lock = threading.Lock()
+
+        self.change_cb = change_cb
+        self.error_cb = error_cb
+        self.last_error = None
+        self.load_cb = load_cb
+        self.loaded = threading.Event()
+        self.loaded_from_cache = False
+        self.disconnect_cb = disconnect_cb
+
+        # the daemon only reports loading once its first export has
+        # finished, see TaskWrapper
+        self.last_export_cancelled = False
+
+        # local copy of the daemon's database
+        self.task_db = TaskStore()
+
+        # thread reading messages from the daemon, spawned by start()
+        self.t = None
+
+        self.stats_prefix = stats.register_gauges("remote", self, {
+            "tasks": lambda remote: len(remote.task_db),
+            "task_db_kb": lambda remote: remote.task_db.memory_usage() // 1024,
+        })
+
+    @classmethod
+    def connect(cls, path=None, task_path="~/.task", **kwargs):
+        """
+        returns RemoteTaskWrapper connected to the daemon listening at `path`
+        (default_socket_path() for `task_path`), or None if there's no
+        daemon, it's from an incompatible version, or it isn't run by the
+        user
+        """
+        if path is None:
+            path = default_socket_path(task_path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(path)
+            check_peer(sock, path)
+
+            wrapper = cls(sock, task_path=task_path, **kwargs)
+            hello = read_message(wrapper.rfile)
+            sock.settimeout(None)
+        except (OSError, EOFError, ValueError, TypeError):
+            sock.close()
+            return None
+
+        if hello != ("hello", PROTOCOL_VERSION, TASK_FIELDS):
+            sock.close()
+            return None
+
+        return wrapper
+
+    def start(self):
+        """
+        start receiving the database and changes from the daemon
+        """
+        self.t = threading.Thread(target=self.receive_thread)
+        self.t.daemon = True
+        self.t.start()
+
+    def _send(self, message):
+        try:
+            with self.send_lock:
+                self.sock.sendall(encode_message(message))
+        except OSError as e:
+            self._report_error(e)
+
+    def request_history(self):
+        """
+        ask the daemon to load the next page of history
+        """
+        self._send(("history",))
+
+    def queue_action(self, uuids, command, args=()):
+        """
+        have the daemon run `task <uuids> <command> <args>`, see
+        TaskWrapper.queue_action()
+        """
+        self._send(("action", list(uuids), command, list(args)))
+
+    def _report_error(self, e):
+        self.last_error = e
+        if self.error_cb is not None and callable(self.error_cb):
+            self.error_cb(e)
+
+    def _apply(self, added, modified, deleted):
+        """
+        apply a delta from the daemon to the local database, returns the
+        TaskDelta to pass on
+        """
+        delta = TaskDelta(
+            [TaskRecord.unpack(r) for r in added],
+            [TaskRecord.unpack(r) for r in modified],
+            deleted
+        )
+
+        for record in delta.added:
+            self.task_db.set(record)
+        for record in delta.modified:
+            self.task_db.set(record)
+        for uuid in delta.deleted:
+            self.task_db.remove(uuid)
+
+        return delta
+
+    def receive_thread(self):
+        """
+        apply messages from the daemon until the connection closes
+        """
+        while True:
+            try:
+                message = read_message(self.rfile)
+            except (OSError, EOFError, ValueError, TypeError):
+                message = None
+
+            if message is None:
+                if self.disconnect_cb is not None \
+                        and callable(self.disconnect_cb):
+                    self.disconnect_cb()
+                else:
+                    self._report_error(
+                        TaskWarriorError("lost connection to TaskHUD daemon")
+                    )
+                return
+
+            kind = message[0]
+
+            if kind == "delta":
+                delta = self._apply(*message[1:])
+                if delta and self.change_cb is not None \
+                        and callable(self.change_cb):
+                    self.change_cb(delta)
+
+            elif kind == "loaded":
+                self.loaded_from_cache = message[1]
+                self.loaded.set()
+                if self.load_cb is not None and callable(self.load_cb):
+                    self.load_cb()
+
+            elif kind == "error":
+                self._report_error(TaskWarriorError(message[1]))
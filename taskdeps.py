@@ -0,0 +1,350 @@
+""" ---------------------------------------------------------------------------
+
+    taskdeps.py - Index of dependencies between tasks
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import threading
+
+# Statuses of tasks that still have to be done, and so hold up tasks that
+# depend on them
+OPEN_STATUSES = {"pending", "waiting"}
+
+def task_depends(record):
+    """
+    returns tuple of uuids `record` depends on (TaskWarrior exports these as
+    a list, older versions as a comma separated string)
+    """
+    depends = record.get("depends")
+    if not depends:
+        return ()
+    if type(depends) is str:
+        return tuple(depends.split(","))
+    return tuple(depends)
+
+class DependencyTree:
+    """
+    Tree view of one connected group of dependent tasks, built once and kept
+    until dependencies within the group change.
+
+    rows  - list of (uuid, depth), each task listed once below the first
+            task found depending on it. Roots are tasks nothing depends on.
+    index - uuid -> position in rows
+    order - uuids in topological order (dependencies after the tasks that
+            depend on them, tasks in a cycle in no particular order)
+    cycle - set of uuids of tasks in a dependency cycle
+    """
+    def __init__(self, rows, order, cycle):
+        self.rows = rows
+        self.index = {uuid: n for n, (uuid, depth) in enumerate(rows)}
+        self.order = order
+        self.cycle = cycle
+
+    def __len__(self):
+        return len(self.rows)
+
+class DependencyGraph:
+    """
+    Dependencies between tasks, updated from TaskDeltas.
+
+    Counts of unfinished dependencies and dependents are kept for every
+    task, so blocked() and blocking() are simple lookups. Trees (and
+    topological order) are worked out per connected group of tasks the
+    first time they're asked for, and kept until a task in the group gains
+    or loses a dependency. Tasks finishing or reopening don't change trees.
+
+    Tasks that are depended on but haven't been loaded count as finished.
+    Safe to update and read from different threads.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+
+        # uuid -> tuple of uuids the task depends on, and the reverse
+        self.depends = {}
+        self.dependents = {}
+
+        # uuids of tasks that are loaded and unfinished
+        self.open = set()
+
+        # uuid -> number of unfinished tasks it depends on / that depend on
+        # it (missing when 0)
+        self.open_depends = {}
+        self.open_dependents = {}
+
+        # uuid -> DependencyTree containing it, for tasks whose tree has
+        # been built (and is still valid)
+        self.trees = {}
+
+    def update(self, delta):
+        """
+        apply TaskDelta `delta`
+        """
+        with self.lock:
+            for record in delta.added:
+                self.set(record)
+            for record in delta.modified:
+                self.set(record)
+            for uuid in delta.deleted:
+                self.remove(uuid)
+
+    def set(self, record):
+        """
+        add or update the dependencies of task `record`
+        """
+        self._set(
+            record["uuid"], task_depends(record),
+            record.get("status") in OPEN_STATUSES
+        )
+
+    def remove(self, uuid):
+        """
+        forget about the task with `uuid` (tasks depending on it keep their
+        dependency, it just no longer holds them up)
+        """
+        self._set(uuid, (), False)
+
+    def _count(self, counts, uuid, change):
+        n = counts.get(uuid, 0) + change
+        if n:
+            counts[uuid] = n
+        else:
+            del counts[uuid]
+
+    def _set(self, uuid, depends, is_open):
+        with self.lock:
+            old_depends = self.depends.get(uuid, ())
+            was_open = uuid in self.open
+
+            if old_depends == depends and was_open == is_open:
+                return
+
+            if old_depends != depends:
+                # Trees containing the task or any of its old or new
+                # dependencies are out of date
+                for other in (uuid,) + old_depends + depends:
+                    self._invalidate(other)
+
+                self._unlink(uuid, old_depends, was_open)
+
+            if was_open != is_open:
+                # tasks depending on this one are now held up by one more or
+                # one fewer unfinished task
+                change = 1 if is_open else -1
+                for dependent in self.dependents.get(uuid, ()):
+                    self._count(self.open_depends, dependent, change)
+
+                if is_open:
+                    self.open.add(uuid)
+                else:
+                    self.open.discard(uuid)
+
+            if old_depends != depends:
+                self._link(uuid, depends, is_open)
+            elif was_open != is_open:
+                # the task now does or doesn't hold up its dependencies
+                change = 1 if is_open else -1
+                for dependency in depends:
+                    self._count(self.open_dependents, dependency, change)
+
+    def _unlink(self, uuid, depends, is_open):
+        """
+        remove dependencies of `uuid` from the graph
+        """
+        for dependency in depends:
+            dependents = self.dependents[dependency]
+            dependents.discard(uuid)
+            if not dependents:
+                del self.dependents[dependency]
+
+            if dependency in self.open:
+                self._count(self.open_depends, uuid, -1)
+            if is_open:
+                self._count(self.open_dependents, dependency, -1)
+
+        self.depends.pop(uuid, None)
+
+    def _link(self, uuid, depends, is_open):
+        """
+        add dependencies of `uuid` to the graph
+        """
+        if not depends:
+            return
+
+        self.depends[uuid] = depends
+
+        for dependency in depends:
+            self.dependents.setdefault(dependency, set()).add(uuid)
+
+            if dependency in self.open:
+                self._count(self.open_depends, uuid, 1)
+            if is_open:
+                self._count(self.open_dependents, dependency, 1)
+
+    def _invalidate(self, uuid):
+        """
+        drop the tree containing `uuid`, if one has been built
+        """
+        tree = self.trees.get(uuid)
+        if tree is None:
+            return
+
+        for member, depth in tree.rows:
+            self.trees.pop(member, None)
+
+    def blocked(self, uuid):
+        """
+        returns True if the task with `uuid` depends on unfinished tasks
+        """
+        return uuid in self.open_depends
+
+    def blocking(self, uuid):
+        """
+        returns True if the task with `uuid` is unfinished, and unfinished
+        tasks depend on it
+        """
+        return uuid in self.open_dependents and uuid in self.open
+
+    def has_dependencies(self, uuid):
+        """
+        returns True if the task with `uuid` depends on, or is depended on
+        by, any task
+        """
+        return uuid in self.depends or uuid in self.dependents
+
+    def tree(self, uuid):
+        """
+        returns DependencyTree for the tasks connected to `uuid` through
+        dependencies, or None if there aren't any
+        """
+        with self.lock:
+            tree = self.trees.get(uuid)
+            if tree is not None:
+                return tree
+
+            if not self.has_dependencies(uuid):
+                return None
+
+            tree = self._build_tree(self._connected(uuid))
+            for member, depth in tree.rows:
+                self.trees[member] = tree
+
+            return tree
+
+    def forest(self, uuids):
+        """
+        returns list of DependencyTrees containing any of `uuids` (tasks in
+        a project, say), each listed once
+        """
+        trees = []
+        seen = set()
+
+        with self.lock:
+            for uuid in uuids:
+                tree = self.tree(uuid)
+                if tree is not None and id(tree) not in seen:
+                    seen.add(id(tree))
+                    trees.append(tree)
+
+        return trees
+
+    def _connected(self, uuid):
+        """
+        returns set of tasks connected to `uuid` by dependencies in either
+        direction
+        """
+        members = {uuid}
+        todo = [uuid]
+
+        while todo:
+            node = todo.pop()
+            for other in self.depends.get(node, ()):
+                if other not in members:
+                    members.add(other)
+                    todo.append(other)
+            for other in self.dependents.get(node, ()):
+                if other not in members:
+                    members.add(other)
+                    todo.append(other)
+
+        return members
+
+    def _build_tree(self, members):
+        """
+        returns DependencyTree of connected tasks `members`, walking
+        dependencies depth first from the tasks nothing depends on
+        """
+        roots = sorted(m for m in members if m not in self.dependents)
+
+        rows = []
+        postorder = []
+        cycle = set()
+
+        # uuid -> order the walk reached it in, and the earliest reached
+        # task it leads back to through tasks not yet assigned to a group
+        # (Tarjan's algorithm: tasks that lead back to each other form a
+        # cycle, which a task can be part of without being on the walk's
+        # stack when the cycle closes)
+        reached = {}
+        low = {}
+
+        # reached tasks not yet assigned to a group, most recent last
+        pending = []
+        pending_set = set()
+
+        # tasks in a cycle with nothing outside depending on them can't be
+        # reached from a root, so walks also start from any left over
+        for start in roots + sorted(members):
+            if start in reached:
+                continue
+
+            reached[start] = low[start] = len(reached)
+            pending.append(start)
+            pending_set.add(start)
+            rows.append((start, 0))
+            stack = [(start, iter(self.depends.get(start, ())))]
+
+            while stack:
+                node, children = stack[-1]
+
+                for child in children:
+                    if child not in reached:
+                        reached[child] = low[child] = len(reached)
+                        pending.append(child)
+                        pending_set.add(child)
+                        rows.append((child, len(stack)))
+                        stack.append(
+                            (child, iter(self.depends.get(child, ())))
+                        )
+                        break
+
+                    if child in pending_set:
+                        # child leads back to node
+                        low[node] = min(low[node], reached[child])
+                else:
+                    postorder.append(node)
+                    stack.pop()
+                    if stack:
+                        parent = stack[-1][0]
+                        low[parent] = min(low[parent], low[node])
+
+                    if low[node] != reached[node]:
+                        continue
+
+                    # node and the tasks pending after it form a group
+                    group = []
+                    while True:
+                        member = pending.pop()
+                        pending_set.discard(member)
+                        group.append(member)
+                        if member == node:
+                            break
+
+                    if len(group) > 1 or node in self.depends.get(node, ()):
+                        cycle.update(group)
+
+        postorder.reverse()
+        return DependencyTree(rows, postorder, cycle)
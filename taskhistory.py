@@ -0,0 +1,323 @@
+""" ---------------------------------------------------------------------------
+
+    taskhistory.py - Index of task changes recorded in TaskWarrior's
+                     undo.data
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import json
+import mmap
+import os
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+# A transaction in undo.data, as written by TaskWarrior:
+#
+#   time <seconds since epoch>
+#   old [<task before the change>]      (missing when the task was added)
+#   new [<task after the change>]
+#   ---
+#
+# Only the start of each transaction and the uuid of the task are needed for
+# the index, the rest is parsed when a task's history is asked for
+TRANSACTION_RE = re.compile(
+    rb'^time \d+\n(?:old [^\n]*\n)?new [^\n]*(?:\[| )uuid:"([^"\n]*)"',
+    re.MULTILINE
+)
+
+# A field of a task in undo.data (FF4 format)
+FF4_FIELD_RE = re.compile(r'(\w+):"((?:[^"\\]|\\.)*)"')
+
+# Fields that change with every transaction, not worth listing as changes
+IGNORED_FIELDS = {"modified", "uuid"}
+
+# Fields holding seconds since epoch
+DATE_FIELDS = {
+    "due", "scheduled", "wait", "until", "start", "end", "entry", "modified"
+}
+
+def parse_ff4(line):
+    """
+    returns dict of fields from a task in FF4 format ("[name:"value" ...]")
+    """
+    fields = {}
+
+    for name, value in FF4_FIELD_RE.findall(line):
+        value = value.replace("&open;", "[").replace("&close;", "]")
+        if "\\" in value:
+            try:
+                value = json.loads('"' + value + '"')
+            except ValueError:
+                pass
+        fields[name] = value
+
+    return fields
+
+def format_time(epoch):
+    """
+    returns seconds since epoch (a string or int) as local time for display
+    """
+    try:
+        return time.strftime("%Y-%m-%d %H:%M", time.localtime(int(epoch)))
+    except (ValueError, OverflowError):
+        return str(epoch)
+
+def _display_value(name, value):
+    if name in DATE_FIELDS:
+        return format_time(value)
+    return value
+
+def describe_changes(old, new):
+    """
+    returns list of strings describing how task fields `old` (None for a new
+    task) changed to `new`
+    """
+    if old is None:
+        return ["created: " + new.get("description", "")]
+
+    changes = []
+
+    for name in sorted(set(old) | set(new)):
+        if name in IGNORED_FIELDS:
+            continue
+
+        before = old.get(name)
+        after = new.get(name)
+        if before == after:
+            continue
+
+        if name.startswith("annotation_"):
+            if after is None:
+                changes.append("unannotated: " + before)
+            else:
+                changes.append("annotated: " + after)
+        elif name == "tags":
+            before = set(before.split(",")) if before else set()
+            after = set(after.split(",")) if after else set()
+            changes.append("tags " + " ".join(
+                ["+" + t for t in sorted(after - before)]
+                + ["-" + t for t in sorted(before - after)]
+            ))
+        elif after is None:
+            changes.append("{} removed".format(name))
+        elif before is None:
+            changes.append("{}: {}".format(name, _display_value(name, after)))
+        else:
+            changes.append("{}: {} → {}".format(
+                name, _display_value(name, before),
+                _display_value(name, after)
+            ))
+
+    return changes
+
+class HistoryIndex:
+    """
+    Finds the transactions in undo.data for each task without reading the
+    whole file each time.
+
+    The file is memory mapped, and scanned once for the start of every
+    transaction, which are kept per uuid. As TaskWarrior appends to the file
+    only the new part is scanned. If it shrinks (`task undo`) or is
+    replaced, the index is built again. Scanning runs in a background thread
+    started by start(), and until the index has been built history() returns
+    None.
+
+    history() parses just the transactions for one task, and keeps the
+    results for recently asked for tasks. It only reads the index as it
+    stands, and wakes the background thread to check for changes to the
+    file, so it's cheap enough to call on every redraw.
+    """
+    def __init__(self, path, cache_size=64):
+        self.path = path
+
+        # held while the index is being brought up to date, and while it's
+        # being read or changed
+        self.refresh_lock = threading.Lock()
+        self.lock = threading.Lock()
+
+        # uuid -> array of offsets of the transactions for that task
+        self.offsets = {}
+
+        # mapping of undo.data, bytes of it that have been indexed, the last
+        # few of those bytes, and (device, inode) of the file mapped
+        self.map = None
+        self.size = 0
+        self.tail = b""
+        self.file_id = None
+
+        # set once the index has been built, and to have the background
+        # thread check the file for changes
+        self.ready = threading.Event()
+        self.refresh_event = threading.Event()
+
+        # uuid -> (number of transactions, history), most recent last
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+        self.t = None
+
+    def start(self, changed_cb=None):
+        """
+        build the index in a background thread, and keep it up to date
+        there, calling `changed_cb` (if set) once it's built and whenever
+        it changes
+        """
+        def run():
+            while True:
+                if self.refresh() and changed_cb is not None:
+                    changed_cb()
+
+                self.refresh_event.wait()
+                self.refresh_event.clear()
+
+        self.t = threading.Thread(target=run)
+        self.t.daemon = True
+        self.t.start()
+
+    def refresh(self):
+        """
+        index transactions added to undo.data since the last refresh,
+        rebuilding the index if the file has shrunk or been replaced.
+        Returns True if the index changed.
+        """
+        with self.refresh_lock:
+            return self._refresh()
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            st = None
+
+        if st is None or st.st_size == 0:
+            changed = self.size != 0 or not self.ready.is_set()
+            self._replace(None, 0, None, {})
+            self.tail = b""
+            return changed
+
+        file_id = (st.st_dev, st.st_ino)
+        rebuild = file_id != self.file_id or st.st_size < self.size
+
+        if not rebuild and st.st_size == self.size:
+            return False
+
+        with open(self.path, "rb") as f:
+            new_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # `task undo` rewrites the file, which may then have grown again
+        if new_map[self.size - len(self.tail):self.size] != self.tail:
+            rebuild = True
+
+        start = 0 if rebuild else self.size
+
+        # Only index complete transactions, a partly written one is
+        # picked up next time
+        end = new_map.rfind(b"---\n", start) + 4
+        if end < 4:
+            end = start
+
+        found = {}
+        for match in TRANSACTION_RE.finditer(new_map, start, end):
+            uuid = match.group(1).decode("ascii", "replace")
+            offsets = found.get(uuid)
+            if offsets is None:
+                offsets = found[uuid] = array("q")
+            offsets.append(match.start())
+
+        # a partly written transaction alone doesn't change anything
+        changed = rebuild or end > self.size
+
+        if rebuild:
+            self._replace(new_map, end, file_id, found)
+        else:
+            self._extend(new_map, end, found)
+
+        self.tail = new_map[max(end - 256, 0):end]
+        return changed
+
+    def _replace(self, new_map, size, file_id, offsets):
+        with self.lock:
+            old_map = self.map
+            self.map = new_map
+            self.size = size
+            self.file_id = file_id
+            self.offsets = offsets
+            self.cache.clear()
+
+        if old_map is not None:
+            old_map.close()
+        self.ready.set()
+
+    def _extend(self, new_map, size, found):
+        with self.lock:
+            old_map = self.map
+            self.map = new_map
+            self.size = size
+
+            for uuid, offsets in found.items():
+                existing = self.offsets.get(uuid)
+                if existing is None:
+                    self.offsets[uuid] = offsets
+                else:
+                    existing.extend(offsets)
+
+        old_map.close()
+
+    def _read_transaction(self, offset):
+        """
+        returns (time, old fields or None, new fields) for the transaction
+        starting at `offset` (call with lock held)
+        """
+        end = self.map.find(b"\n---\n", offset)
+        lines = self.map[offset:end].decode("utf-8", "replace").split("\n")
+
+        when = lines[0][5:]
+        old = None
+        new = {}
+
+        for line in lines[1:]:
+            if line.startswith("old "):
+                old = parse_ff4(line[4:])
+            elif line.startswith("new "):
+                new = parse_ff4(line[4:])
+
+        return (when, old, new)
+
+    def history(self, uuid):
+        """
+        returns list of (time, changes) for the task with `uuid`, most
+        recent first, where `changes` is a list of strings describing the
+        changes made. Returns None while the index is being built.
+        """
+        # have the background thread check for changes to the file
+        self.refresh_event.set()
+
+        if not self.ready.is_set():
+            return None
+
+        with self.lock:
+            offsets = self.offsets.get(uuid, ())
+
+            cached = self.cache.get(uuid)
+            if cached is not None and cached[0] == len(offsets):
+                self.cache.move_to_end(uuid)
+                return cached[1]
+
+            history = []
+            for offset in offsets:
+                when, old, new = self._read_transaction(offset)
+                history.append((when, describe_changes(old, new)))
+            history.reverse()
+
+            self.cache[uuid] = (len(offsets), history)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return history
@@ -8,9 +8,19 @@
 
 --------------------------------------------------------------------------- """
 
+import argparse
+import os
+import shlex
+import sys
+import tempfile
+import time
 from curses import wrapper
 from cwrapper import CursesHud
 from datetime import datetime, timezone
+from perfstats import stats
+from taskdaemon import RemoteTaskWrapper, TaskDaemon
+from taskdeps import DependencyGraph, task_depends
+from taskhistory import HistoryIndex, format_time
 from taskwrapper import TaskWrapper
 
 # TODO: move to separate module
@@ -50,28 +60,30 @@ def t_urgency(s):
     """
     return "{:>6.2f}".format(s)
 
-def run_gui(screen, task_wrapper):
+def make_hud(screen):
     """
-    Called by curses wrapper. Sets up HUD before running mainloop
+    returns CursesHud drawing on `screen`, set up to display TaskWarrior
+    records
     """
     # HUD object
     hud = CursesHud(screen)
 
     # Use "uuid" as unique key for records
     hud.set_unique_key("uuid")
-    # Use "id" as sort key for displaying records
-    hud.set_sort_key("id")
+    # Completed and deleted tasks have an id of 0, sort them after pending
+    # tasks (most recently finished first)
+    hud.set_sort_value("id", lambda i: i or None)
 
-    # link TaskWrapper callback to update the HUD
-    def update_hud_records():
-        hud.add_record(task_wrapper.task_db)
+    # Sort orders to choose from with "o", sorted by "id" to start with
+    hud.set_sort_orders([
+        [("id", False), ("end", True)],
+        [("urgency", True), ("id", False)],
+        [("due", False), ("urgency", True), ("id", False)],
+        [("project", False), ("urgency", True), ("id", False)],
+    ])
 
-    task_wrapper.change_cb = update_hud_records
-
-    # Add all tasks stored in task_wrapper at startup
-    # TODO: these should be refreshed continuously and asynchronously
-    for task in task_wrapper.task_db:
-        hud.add_record(task)
+    # Keep tasks identifiable while scrolling sideways through columns
+    hud.set_pinned_columns(["id", "description"])
 
     # These keys will be shown in bottom panel (too wide for main display)
     hud.set_extra_info("uuid")
@@ -93,15 +105,253 @@ def run_gui(screen, task_wrapper):
     ## Align urgency scores on decimal place, 2 significant digits
     hud.set_translation("urgency", t_urgency)
 
+    # Searches ("/") match words in these fields, and "field:value" terms
+    # for fields like "project:home" or "status:pending"
+    hud.set_search_fields(
+        ["description", "project", "tags", "annotations"],
+        ["project", "status", "tags", "priority"]
+    )
+
+    hud.set_title("TaskHUD")
+
+    return hud
+
+def run_gui(screen, task_wrapper, start_time=None):
+    """
+    Called by curses wrapper. Sets up HUD, starts loading tasks in the
+    background, then runs mainloop. Returns a summary of startup times once
+    the user exits with Ctrl-C.
+    """
+    if start_time is None:
+        start_time = time.monotonic()
+
+    hud = make_hud(screen)
+    hud.set_status("loading tasks...")
+
+    # when the current TaskWrapper started loading
+    load_start = start_time
+
+    # Dependencies between tasks, kept up to date with each change
+    dependencies = DependencyGraph()
+
+    # link TaskWrapper callback to update the HUD. Records arrive in batches
+    # while loading, each batch is added to the HUD in one go. This runs on
+    # TaskWrapper's thread, so changes are handed to the HUD's main loop
+    # rather than applied here.
+    def update_hud_records(delta):
+        dependencies.update(delta)
+        hud.post_update(delta.added + delta.modified, delta.deleted)
+
+    def load_finished():
+        # A failed load has already been reported by show_error, and an
+        # interrupted one hasn't loaded everything
+        if task_wrapper.last_error is not None \
+                or task_wrapper.last_export_cancelled:
+            hud.wakeup()
+            return
+
+        load_time = (time.monotonic() - load_start) * 1000
+        hud.set_status("{} tasks loaded in {:.0f} ms{}".format(
+            len(task_wrapper.task_db), load_time,
+            " (cached)" if task_wrapper.loaded_from_cache else ""
+        ) + (" via daemon" if isinstance(task_wrapper, RemoteTaskWrapper)
+             else ""))
+        hud.wakeup()
+
+    def show_error(e):
+        hud.set_status("error: {}".format(e))
+        hud.wakeup()
+
+    # If the daemon goes away, carry on with a TaskWrapper of our own. It
+    # starts from the records the HUD already has, so its first export only
+    # passes on what has changed (older history is paged in again).
+    def connection_lost():
+        nonlocal task_wrapper, load_start
+
+        hud.set_status("lost connection to daemon, loading tasks...")
+        hud.wakeup()
+
+        remote = task_wrapper
+        load_start = time.monotonic()
+        try:
+            task_wrapper = TaskWrapper(
+                task_path=remote.task_path, use_cache=False
+            )
+        except Exception as e:
+            show_error(e)
+            return
+
+        task_wrapper.task_db = remote.task_db
+        attach(task_wrapper)
+        task_wrapper.start()
+
+    def attach(wrapper):
+        wrapper.change_cb = update_hud_records
+        wrapper.load_cb = load_finished
+        wrapper.error_cb = show_error
+        if isinstance(wrapper, RemoteTaskWrapper):
+            wrapper.disconnect_cb = connection_lost
+
+    # Actions on the selected task. Changes show straight away, and are
+    # sent to TaskWarrior in the background
+    def done(record):
+        task_wrapper.queue_action([record["uuid"]], "done")
+        hud.set_status("task {} marked done, `task undo` reverts it".format(
+            record.get("id") or record["uuid"][:8]
+        ))
+
+    def start_stop(record):
+        command = "stop" if "start" in record else "start"
+        task_wrapper.queue_action([record["uuid"]], command)
+
+    def modify(record, text):
+        try:
+            args = shlex.split(text)
+        except ValueError as e:
+            hud.set_status("modify: {}".format(e))
+            return
+        if args:
+            task_wrapper.queue_action([record["uuid"]], "modify", args)
+
+    def annotate(record, text):
+        if text.strip():
+            task_wrapper.queue_action([record["uuid"]], "annotate", [text])
+
+    hud.set_action("d", done)
+    hud.set_action("s", start_stop)
+    hud.set_action("m", modify, "modify: ")
+    hud.set_action("a", annotate, "annotate: ")
+
+    # Tasks are referred to by id (or uuid, once finished) and description
+    # when listing dependencies
+    def task_name(uuid):
+        record = hud.record_index.get(uuid)
+        if record is None:
+            return uuid[:8]
+
+        return "{} {}".format(record.get("id") or uuid[:8],
+                              record.get("description", ""))
+
+    hud.set_translation("depends", lambda depends: ", ".join(
+        task_name(uuid) for uuid in task_depends({"depends": depends})
+    ))
+
+    # The bottom panel shows where the selected task sits in the tree of
+    # tasks depending on each other (tasks nothing depends on at the root),
+    # then its change history from an index of undo.data built in the
+    # background
+    history_index = HistoryIndex(task_wrapper.undo_path)
+
+    def task_dependencies(uuid):
+        tree = dependencies.tree(uuid)
+        if tree is None:
+            return []
+
+        flags = [
+            name for name, flag in (
+                ("blocked", dependencies.blocked(uuid)),
+                ("blocking", dependencies.blocking(uuid)),
+                ("in a cycle", uuid in tree.cycle),
+            ) if flag
+        ]
+        lines = ["dependencies: {}, {} tasks in tree".format(
+            ", ".join(flags) or "nothing open", len(tree)
+        )]
+
+        # a few rows of the tree either side of the selected task
+        position = tree.index[uuid]
+        start = max(min(position - 2, len(tree) - 5), 0)
+
+        for other, depth in tree.rows[start:start + 5]:
+            lines.append("{} {}{}{}".format(
+                "▸" if other == uuid else " ", "  " * depth, task_name(other),
+                " [blocked]" if dependencies.blocked(other) else ""
+            ))
+
+        return lines
+
+    def task_history(record):
+        history = history_index.history(record["uuid"])
+        if history is None:
+            return ["loading history..."]
+
+        return [
+            "{}  {}".format(format_time(when), ", ".join(changes))
+            for when, changes in history
+        ]
+
+    hud.set_detail_provider(
+        lambda record: task_dependencies(record["uuid"]) + task_history(record)
+    )
+    hud.set_bottom_panel_height(11)
+    history_index.start(hud.wakeup)
+
+    # Older completed/deleted tasks are loaded when the user scrolls down
+    # towards the end of the list
+    hud.set_end_cb(lambda: task_wrapper.request_history())
+    attach(task_wrapper)
+
+    # Load tasks in the background, HUD is drawn straight away
+    task_wrapper.start()
+
     # Run the HUD's main loop
-    hud.mainloop()
+    try:
+        hud.mainloop()
+    except KeyboardInterrupt:
+        pass
 
-if __name__ == "__main__":
-    # Entry point
+    if hud.first_paint is None:
+        return "no tasks were displayed"
+
+    return "time to first paint: {:.0f} ms".format(
+        (hud.first_paint - start_time) * 1000
+    )
 
-    # Start up TaskWarrior monitoring thread
-    task_wrapper = TaskWrapper()
+def main():
+    parser = argparse.ArgumentParser(description="TaskWarrior HUD")
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="run headless, sharing one task database with every TaskHUD "
+             "started while it runs"
+    )
+    parser.add_argument(
+        "--no-daemon", action="store_true",
+        help="load tasks in this process, even if a daemon is running"
+    )
+    parser.add_argument("--socket", help="path of the daemon's socket")
+    args = parser.parse_args()
 
-    # Start ncurses, and pass screen object to function that sets up HUD
-    wrapper(run_gui, task_wrapper)
+    start_time = time.monotonic()
 
+    # Performance stats are written as JSON on SIGUSR1 (and on exit, if a
+    # path has been set with $TASKHUD_STATS), for looking into slow sessions
+    stats_path = os.environ.get("TASKHUD_STATS")
+    stats.dump_on_signal(stats_path or os.path.join(
+        tempfile.gettempdir(), "taskhud-stats-{}.json".format(os.getpid())
+    ))
+
+    if args.daemon:
+        daemon = TaskDaemon(TaskWrapper(), args.socket)
+        try:
+            daemon.serve()
+        except KeyboardInterrupt:
+            pass
+    else:
+        # Use the daemon's database if one is running, otherwise the
+        # TaskWarrior monitoring thread is started by run_gui, once the HUD
+        # can show that tasks are loading
+        task_wrapper = None
+        if not args.no_daemon:
+            task_wrapper = RemoteTaskWrapper.connect(args.socket)
+        if task_wrapper is None:
+            task_wrapper = TaskWrapper()
+
+        # Start ncurses, and pass screen object to function that sets up HUD
+        report = wrapper(run_gui, task_wrapper, start_time)
+        print(report, file=sys.stderr)
+
+    if stats_path:
+        stats.dump(stats_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+""" ---------------------------------------------------------------------------
+
+    taskstore.py - Compact storage for TaskWarrior records
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import sys
+
+# Fields TaskWarrior itself defines, in the order they're shown. Each gets a
+# slot in TaskRecord, anything else (UDAs) goes into an overflow tuple.
+TASK_FIELDS = (
+    "id", "description", "project", "status", "priority", "tags", "due",
+    "scheduled", "wait", "until", "start", "end", "entry", "modified",
+    "recur", "mask", "imask", "parent", "depends", "annotations", "uuid",
+    "urgency",
+)
+
+# Fields whose values repeat across many tasks, so are worth interning
+INTERNED_FIELDS = {"status", "project", "priority", "recur"}
+
+# Date fields, stored as integers (YYYYMMDDhhmmss) rather than the
+# 16 character strings TaskWarrior exports ("YYYYMMDDThhmmssZ")
+DATE_FIELDS = {
+    "due", "scheduled", "wait", "until", "start", "end", "entry", "modified"
+}
+
+# UDA string values up to this length are interned, longer values are
+# unlikely to be repeated
+INTERN_MAX_LENGTH = 32
+
+_TASK_FIELD_SET = set(TASK_FIELDS)
+
+# tuples of UDA names, so that tasks with the same set of UDAs share one
+_uda_shapes = {}
+
+def pack_date(value):
+    """
+    returns TaskWarrior date string `value` as an integer, or unchanged if it
+    isn't in the expected format
+    """
+    if type(value) is str and len(value) == 16 and value[8] == "T" \
+            and value[15] == "Z":
+        try:
+            return int(value[:8] + value[9:15])
+        except ValueError:
+            pass
+
+    return value
+
+def unpack_date(value):
+    """
+    reverses pack_date()
+    """
+    if type(value) is int:
+        return "%08dT%06dZ" % divmod(value, 1000000)
+
+    return value
+
+class TaskRecord:
+    """
+    Read-only record for a single task, behaving like the dict produced by
+    `task export` but storing known fields in slots rather than a per-task
+    dict. Repeated values (status, project, tags...) are interned so every
+    task shares one copy, dates are packed into integers, and lists are
+    stored as tuples. UDAs are kept as a tuple of values, alongside a tuple of
+    their names that is shared with every task having the same UDAs.
+
+    Records are never modified after creation, so they can be shared between
+    threads and between TaskWrapper and CursesHud. Use replace() to get a
+    modified copy.
+    """
+    __slots__ = TASK_FIELDS + ("uda_keys", "uda_values")
+
+    def __init__(self, data):
+        """
+        data: dict of fields, as produced by `task export`
+        """
+        uda_keys = []
+        uda_values = []
+
+        for k, v in data.items():
+            if k in _TASK_FIELD_SET:
+                if k in INTERNED_FIELDS and type(v) is str:
+                    v = sys.intern(v)
+                elif k in DATE_FIELDS:
+                    v = pack_date(v)
+                elif k == "tags":
+                    v = tuple(sys.intern(tag) for tag in v)
+                elif type(v) is list:
+                    v = tuple(v)
+
+                setattr(self, k, v)
+            else:
+                if type(v) is str and len(v) <= INTERN_MAX_LENGTH:
+                    v = sys.intern(v)
+                elif type(v) is list:
+                    v = tuple(v)
+
+                uda_keys.append(k)
+                uda_values.append(v)
+
+        uda_keys = tuple(uda_keys)
+        self.uda_keys = _uda_shapes.setdefault(uda_keys, uda_keys)
+        self.uda_values = tuple(uda_values)
+
+    def __getitem__(self, key):
+        if key in _TASK_FIELD_SET:
+            try:
+                value = getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+
+            if key in DATE_FIELDS:
+                return unpack_date(value)
+            return value
+
+        try:
+            return self.uda_values[self.uda_keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in _TASK_FIELD_SET:
+            return hasattr(self, key)
+
+        return key in self.uda_keys
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """
+        returns list of fields set for this task
+        """
+        return [k for k in TASK_FIELDS if hasattr(self, k)] \
+            + list(self.uda_keys)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def to_dict(self):
+        """
+        returns fields of this task as a dict
+        """
+        return dict(self.items())
+
+    def replace(self, **changes):
+        """
+        returns a copy of this task with fields in `changes` set
+        """
+        data = self.to_dict()
+        data.update(changes)
+
+        return TaskRecord(data)
+
+    def pack(self):
+        """
+        returns contents of this task as a tuple of plain values (for
+        serialising), reversed by TaskRecord.unpack()
+        """
+        mask = 0
+        values = []
+        for n, k in enumerate(TASK_FIELDS):
+            try:
+                values.append(getattr(self, k))
+            except AttributeError:
+                continue
+            mask |= 1 << n
+
+        return (mask, tuple(values), self.uda_keys, self.uda_values)
+
+    @classmethod
+    def unpack(cls, packed):
+        """
+        returns TaskRecord from the result of pack()
+        """
+        mask, values, uda_keys, uda_values = packed
+
+        record = cls.__new__(cls)
+        values = iter(values)
+        for n, k in enumerate(TASK_FIELDS):
+            if mask & (1 << n):
+                setattr(record, k, next(values))
+
+        record.uda_keys = _uda_shapes.setdefault(uda_keys, uda_keys)
+        record.uda_values = uda_values
+
+        return record
+
+    def __eq__(self, other):
+        if isinstance(other, TaskRecord):
+            return self.items() == other.items()
+        if isinstance(other, dict):
+            return TaskRecord(other).items() == self.items()
+
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "TaskRecord({!r})".format(self.to_dict())
+
+class TaskStore:
+    """
+    Collection of TaskRecords keyed by uuid. TaskWrapper keeps its local
+    database in one, and hands the same TaskRecord objects on to the HUD.
+    """
+    def __init__(self, records=()):
+        """
+        records: iterable of TaskRecords (or dicts, which are converted)
+        """
+        # uuid -> TaskRecord
+        self.records = {}
+
+        # result of memory_usage(), until records change
+        self.usage = None
+
+        for record in records:
+            self.set(record)
+
+    def set(self, record):
+        """
+        add or replace a record, returns the stored TaskRecord
+        """
+        if not isinstance(record, TaskRecord):
+            record = TaskRecord(record)
+
+        self.records[record["uuid"]] = record
+        self.usage = None
+        return record
+
+    def remove(self, uuid):
+        """
+        remove the record for `uuid` if there is one
+        """
+        if self.records.pop(uuid, None) is not None:
+            self.usage = None
+
+    def get(self, uuid, default=None):
+        return self.records.get(uuid, default)
+
+    def __contains__(self, uuid):
+        return uuid in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def values(self):
+        return self.records.values()
+
+    def items(self):
+        return self.records.items()
+
+    def memory_usage(self):
+        """
+        returns approximate number of bytes used by stored records. Objects
+        shared between records (interned strings etc.) are only counted once.
+        The result is kept until records change, as it's reported as a
+        perfstats gauge.
+        """
+        if self.usage is not None:
+            return self.usage
+
+        seen = set()
+
+        def size(obj):
+            if id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+
+            total = sys.getsizeof(obj)
+            if type(obj) in (tuple, list):
+                total += sum(size(o) for o in obj)
+            elif type(obj) is dict:
+                total += sum(size(k) + size(v) for k, v in obj.items())
+
+            return total
+
+        total = sys.getsizeof(self.records)
+        for uuid, record in list(self.records.items()):
+            total += size(uuid) + size(record) + size(record.uda_keys) \
+                + size(record.uda_values)
+            for k in TASK_FIELDS:
+                value = getattr(record, k, None)
+                if value is not None:
+                    total += size(value)
+
+        self.usage = total
+        return total
+
+    def memory_report(self):
+        """
+        returns summary of memory used, scaled per 10k tasks
+        """
+        usage = self.memory_usage()
+        per_10k = usage * 10000 / max(len(self.records), 1)
+
+        return "{} tasks, {:.1f} MB ({:.1f} MB per 10k tasks)".format(
+            len(self.records), usage / 2**20, per_10k / 2**20
+        )
@@ -0,0 +1,225 @@
+""" ---------------------------------------------------------------------------
+
+    taskwatch.py - File watchers used by TaskWrapper to detect changes
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+# TaskWarrior files where changes indicate an update
+TASK_DATA_FILES = ["pending.data", "backlog.data", "completed.data", "undo.data"]
+
+def file_stamp(path):
+    """
+    returns (mtime, size) for file at `path`, or None if it doesn't exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    # size is included to catch writes that land inside one mtime tick
+    return (st.st_mtime_ns, st.st_size)
+
+def file_stamps(data_path, filenames=TASK_DATA_FILES):
+    """
+    returns dict of file name -> file_stamp() for TaskWarrior data files
+    """
+    return {
+        name: file_stamp(os.path.join(data_path, name)) for name in filenames
+    }
+
+class PollingWatcher:
+    """
+    Watches TaskWarrior data files by checking their modification times every
+    `interval` seconds. Works everywhere, but wakes up constantly and can lag
+    behind changes by up to one interval.
+    """
+    def __init__(self, data_path, filenames=TASK_DATA_FILES, interval=0.25):
+        # directory containing TaskWarrior data files
+        self.data_path = data_path
+
+        # names of files (relative to data_path) to check
+        self.filenames = list(filenames)
+
+        # seconds to sleep between checks
+        self.interval = interval
+
+        # (mtime, size) for each file at the last check, None if missing
+        self.stamps = {name: self._stamp(name) for name in self.filenames}
+
+    def _stamp(self, name):
+        """
+        returns (mtime, size) for a data file, or None if it doesn't exist
+        """
+        return file_stamp(os.path.join(self.data_path, name))
+
+    def changed_files(self):
+        """
+        returns set of file names that changed since the last check
+        """
+        changed = set()
+
+        for name in self.filenames:
+            stamp = self._stamp(name)
+            if stamp != self.stamps[name]:
+                self.stamps[name] = stamp
+                changed.add(name)
+
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        blocks until a data file changes (or `timeout` seconds pass), returns
+        set of changed file names (empty on timeout)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            changed = self.changed_files()
+            if changed:
+                return changed
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+
+            time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """
+    Watches the TaskWarrior data directory using Linux inotify, so that the
+    watcher thread sleeps until TaskWarrior actually writes to one of its data
+    files. Raises OSError if inotify is unavailable.
+    """
+    # inotify event masks (from <sys/inotify.h>)
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_NONBLOCK    = 0o4000
+    IN_CLOEXEC     = 0o2000000
+
+    # struct inotify_event header: wd, mask, cookie, len
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, data_path, filenames=TASK_DATA_FILES):
+        # directory containing TaskWarrior data files
+        self.data_path = data_path
+
+        # names of files (relative to data_path) that we report changes for
+        self.filenames = set(filenames)
+
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, "libc not found")
+
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify not supported")
+
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        # Watch the directory rather than the files, so that files which are
+        # created later, or replaced by a rename, are still picked up.
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE \
+            | self.IN_DELETE
+        wd = libc.inotify_add_watch(
+            self.fd, os.fsencode(self.data_path), mask
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, os.strerror(err))
+
+    def _read_events(self):
+        """
+        returns set of watched file names named by pending inotify events
+        """
+        changed = set()
+
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            if not buf:
+                break
+
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = \
+                    self.EVENT_HEADER.unpack_from(buf, offset)
+                offset += self.EVENT_HEADER.size
+
+                name = buf[offset:offset + length].rstrip(b"\0")
+                offset += length
+
+                if mask & self.IN_Q_OVERFLOW:
+                    # Events were dropped, assume everything changed
+                    changed |= self.filenames
+                    continue
+
+                name = os.fsdecode(name)
+                if name in self.filenames:
+                    changed.add(name)
+
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        blocks until a data file changes (or `timeout` seconds pass), returns
+        set of changed file names (empty on timeout)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return set()
+
+            changed = self._read_events()
+            if changed:
+                return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def make_watcher(data_path, backend="auto", interval=0.25):
+    """
+    returns a watcher for the TaskWarrior data directory. `backend` is one of
+    "inotify", "poll" or "auto" (inotify where available, otherwise polling
+    every `interval` seconds)
+    """
+    if backend in ("auto", "inotify"):
+        try:
+            return InotifyWatcher(data_path)
+        except OSError:
+            if backend == "inotify":
+                raise
+
+    if backend not in ("auto", "inotify", "poll"):
+        raise ValueError("unknown watcher backend {}".format(backend))
+
+    return PollingWatcher(data_path, interval=interval)
@@ -8,19 +8,131 @@
 
 --------------------------------------------------------------------------- """
 
+import codecs
 import json
 import os
+import re
 import subprocess
 import threading
 import time
 
+from perfstats import stats
+from taskactions import (
+    WRITE_COMMANDS, batch_actions, command_args, predict_action
+)
+from taskcache import SnapshotCache
+from taskstore import TaskRecord, TaskStore
+from taskwatch import file_stamps, make_watcher
+
+# pulls uuid and status out of a pending.data line without a full parse
+PENDING_LINE_RE = re.compile(r'(?:^\[| )(uuid|status):"([^"]*)"')
+
+# bytes to read from `task export` at a time
+EXPORT_READ_SIZE = 64 * 1024
+
+# most tasks an incremental update exports by uuid, more than this and a
+# full export is run instead
+INCREMENTAL_EXPORT_LIMIT = 500
+
+class TaskWarriorError(Exception):
+    """
+    Raised when TaskWarrior fails, or its output can't be understood
+    """
+    pass
+
+class ExportCancelled(Exception):
+    """
+    Raised when a full export is cancelled because newer changes have made
+    its result out of date
+    """
+    pass
+
+class TaskDelta:
+    """
+    Changes made to the local task database by a single update.
+
+    added    - list of TaskRecords that weren't in the database before
+    modified - list of TaskRecords replacing an existing record (same uuid)
+    deleted  - list of uuids for records that no longer exist
+    """
+    def __init__(self, added=None, modified=None, deleted=None):
+        self.added = added if added is not None else []
+        self.modified = modified if modified is not None else []
+        self.deleted = deleted if deleted is not None else []
+
+    def __bool__(self):
+        return bool(self.added or self.modified or self.deleted)
+
+    def __repr__(self):
+        return "TaskDelta(added={}, modified={}, deleted={})".format(
+            len(self.added), len(self.modified), len(self.deleted)
+        )
+
 class TaskWrapper:
     """
-    Wrapper for TaskWarrior. Spawns a thread, and calls change_cb whenever
-    updates are made to TaskWarrior (either externally, or through TaskHUD
-    application).
+    Wrapper for TaskWarrior. Once start() is called, spawns a thread that
+    loads the task database, and calls change_cb with a TaskDelta as records
+    are loaded and whenever updates are made to TaskWarrior (either
+    externally, or through TaskHUD application). load_cb is called once the
+    initial load has finished.
+
+    `watcher` selects how data files are monitored: "inotify", "poll" or
+    "auto" (inotify on Linux, polling every `poll_interval` seconds elsewhere).
+
+    With `sync` set to "incremental", the tasks that changed are found from
+    the tail of backlog.data and only those are exported (task IDs of the
+    rest are read from pending.data), rather than running a full `task
+    export`. A full export still runs at startup, whenever the data files
+    are rewritten in a way the tail can't explain, and as a consistency
+    check at most every `full_sync_interval` seconds after incremental
+    updates have been applied. With `sync` set to "full", every change runs
+    a full export.
+
+    `task_filter` is a list of TaskWarrior filter arguments applied to every
+    export, and `fields` (if set) lists the only fields kept from each task.
+
+    With `history` set to "lazy", only pending, waiting and recurring tasks
+    (plus any completed or deleted while TaskHUD is running) are loaded up
+    front. Older completed and deleted tasks are loaded a page at a time,
+    newest first, by load_history_page() or request_history(). With
+    `history` set to "eager", everything is loaded at startup.
+
+    A single TaskWarrior command writes several data files, so changes are
+    collected until none have arrived for `debounce` seconds (or for at most
+    `max_debounce` seconds) and then handled by one update. A full export
+    that is still running when more changes arrive is cancelled and started
+    again, unless the previous export was also cancelled. Only one export
+    runs at a time. exports_started, exports_cancelled and changes_coalesced
+    count how often this happens.
+
+    With `use_cache` set, the local database is saved to a snapshot file (in
+    `cache_dir`) after each full export and loaded at startup, so tasks can
+    be shown before TaskWarrior has exported anything. If the data files
+    haven't changed since the snapshot was made, the startup export is
+    skipped (loaded_from_cache is set) and the next consistency check
+    confirms the snapshot. Otherwise the export runs as usual, and only
+    differences from the snapshot are passed to change_cb.
+
+    If an update fails in the monitoring thread, the local database is left
+    as it was (any records from the failed export already passed to
+    change_cb are taken back with another delta), and error_cb (if set) is
+    called with the TaskWarriorError.
+
+    queue_action() changes tasks (done, start, stop, modify, annotate). The
+    expected result is passed to change_cb straight away, while a writer
+    thread runs the commands. Actions queued while a command runs are sent
+    together, consecutive actions making the same change becoming a single
+    command. Until the change reaches the local database through the usual
+    updates, the expected version of a task is passed on in place of
+    TaskWarrior's. If a command fails, TaskWarrior's version is passed on
+    again and error_cb is called.
     """
-    def __init__(self, task_cmd="task", task_path="~/.task", change_cb=None):
+    def __init__(self, task_cmd="task", task_path="~/.task", change_cb=None,
+                 watcher="auto", poll_interval=0.25, sync="incremental",
+                 full_sync_interval=300, error_cb=None, load_cb=None,
+                 task_filter=None, fields=None, history="lazy",
+                 history_page_size=500, debounce=0.05, max_debounce=1.0,
+                 use_cache=True, cache_dir=None):
         # name of TaskWarrior executable in users PATH
         self.task_cmd = task_cmd
 
@@ -30,13 +142,107 @@ class TaskWrapper:
         # callback for when TaskWarrior database gets updated
         self.change_cb = change_cb
 
+        # callback for when an update fails, and the most recent failure
+        self.error_cb = error_cb
+        self.last_error = None
+
+        # callback for when the initial load has finished, and event set at
+        # the same time
+        self.load_cb = load_cb
+        self.loaded = threading.Event()
+
+        # number of records passed to change_cb in the first batch of an
+        # export (small, so something can be displayed quickly), and in
+        # each batch after that
+        self.first_batch_size = 100
+        self.batch_size = 2000
+
+        # "incremental" or "full", see class docstring
+        if sync not in ("incremental", "full"):
+            raise ValueError("unknown sync mode {}".format(sync))
+        self.sync = sync
+
+        # seconds between consistency checks (full exports) in incremental
+        # mode, only counted while there are unchecked incremental updates
+        self.full_sync_interval = full_sync_interval
+
+        # TaskWarrior filter arguments applied to every export
+        self.task_filter = list(task_filter) if task_filter else []
+
+        # fields kept from each task (None keeps everything). uuid is always
+        # kept, as records are keyed by it
+        self.fields = None
+        if fields is not None:
+            self.fields = set(fields) | {"uuid"}
+
+        # "lazy" or "eager", see class docstring
+        if history not in ("lazy", "eager"):
+            raise ValueError("unknown history mode {}".format(history))
+        self.history = history
+
+        # completed/deleted tasks that ended at or after this time (seconds
+        # since epoch) are loaded. Set when the first export runs, and moved
+        # back as pages of history are loaded
+        self.history_cursor = None
+        self.history_page_size = history_page_size
+
+        # seconds of history covered by the next page, adjusted to keep
+        # pages close to history_page_size
+        self.history_window = 30 * 24 * 60 * 60
+
+        # set when there is no more history to load
+        self.history_exhausted = history == "eager"
+
+        # thread loading a page of history in the background
+        self.history_thread = None
+
+        # held while the local database is being updated, so that history
+        # pages and updates from the monitoring thread don't overlap
+        self.update_lock = threading.RLock()
+
+        # seconds to wait for changes to stop arriving before updating, and
+        # the longest an update can be put off by a stream of changes
+        self.debounce = debounce
+        self.max_debounce = max_debounce
+
+        # Changes seen by the watcher thread and not yet handled by the sync
+        # thread. generation counts batches of changes from the watcher,
+        # synced_generation is the last one handled. change_event is set
+        # while there are changes waiting.
+        self.change_lock = threading.Lock()
+        self.change_event = threading.Event()
+        self.pending_files = set()
+        self.generation = 0
+        self.synced_generation = 0
+
+        # set until a full export has completed, incremental updates need
+        # a complete database to start from
+        self.needs_full_sync = True
+
+        # cancellable export in progress (if any), and whether it has been
+        # cancelled
+        self.export_proc = None
+        self.export_cancelled = False
+
+        # True if the last full export was cancelled, so the next one is
+        # allowed to finish
+        self.last_export_cancelled = False
+
+        # counters for exports started and cancelled, and for batches of
+        # changes that were merged into another update
+        self.exports_started = 0
+        self.exports_cancelled = 0
+        self.changes_coalesced = 0
+
         # paths to TaskWarrior files where changes indicate an update
         backlog_path = self.task_path + "/backlog.data"
         pending_path = self.task_path + "/pending.data"
+        undo_path = self.task_path + "/undo.data"
 
         # store full paths to these files
         self.backlog_path = os.path.expanduser(backlog_path)
         self.pending_path = os.path.expanduser(pending_path)
+        self.undo_path = os.path.expanduser(undo_path)
 
         # if files can't be found, raise an exception
         if not os.path.isfile(self.backlog_path):
@@ -44,79 +250,956 @@ class TaskWrapper:
         if not os.path.isfile(self.pending_path):
             raise Exception("couldn't find {}".format(self.pending_path))
 
-        # store the last update time for these files at initialization
-        self.backlog_mtime = os.path.getmtime(self.backlog_path)
-        self.pending_mtime = os.path.getmtime(self.pending_path)
+        # watches TaskWarrior data files for changes. Uses inotify where
+        # available, falling back to checking timestamps every
+        # `poll_interval` seconds
+        self.watcher = make_watcher(
+            os.path.dirname(self.pending_path), watcher, poll_interval
+        )
+
+        # byte offset in backlog.data up to which changes have been applied
+        self.backlog_offset = 0
+
+        # size of undo.data when changes were last applied (if it shrinks,
+        # `task undo` was used, and the backlog can't describe the change)
+        self.undo_size = 0
+
+        # time of last full export, and whether incremental updates have been
+        # applied since then
+        self.last_full_sync = 0
+        self.unchecked_updates = False
 
-        # local database of records from TaskWarrior
-        self.task_db = []
+        # local database of records from TaskWarrior, keyed by uuid
+        self.task_db = TaskStore()
 
-        # update the local task database
-        self.update_task_db()
+        # snapshot of the local database kept between runs (None if
+        # disabled). Snapshots are only reused with the same filter, fields
+        # and history settings
+        self.snapshot_cache = None
+        if use_cache:
+            self.snapshot_cache = SnapshotCache(
+                os.path.dirname(self.pending_path),
+                (
+                    tuple(self.task_filter),
+                    tuple(sorted(self.fields)) if self.fields else None,
+                    self.history,
+                ),
+                cache_dir
+            )
+
+        # set if the startup export was skipped, as the snapshot was up to
+        # date
+        self.loaded_from_cache = False
+
+        # monitoring threads, spawned by start(). t watches data files,
+        # sync_t updates the local database
+        self.t = None
+        self.sync_t = None
+
+        # actions waiting for the writer thread, as (uuids, command, args),
+        # and event set while there are some
+        self.write_lock = threading.RLock()
+        self.write_event = threading.Event()
+        self.write_queue = []
+        self.write_t = None
+
+        # uuid -> [expected record, number of actions still to be run,
+        # update_serial when the last one finished] for tasks changed by
+        # queue_action() that haven't been seen in an update since
+        self.pending_writes = {}
+
+        # incremented as each update starts, so an update can tell whether
+        # it started after a write finished (and so includes its result)
+        self.update_serial = 0
+
+        # report database size and counters with other performance stats
+        self.stats_prefix = stats.register_gauges("taskwrapper", self, {
+            "tasks": lambda tw: len(tw.task_db),
+            "task_db_kb": lambda tw: tw.task_db.memory_usage() // 1024,
+            "exports": lambda tw: tw.exports_started,
+            "exports_cancelled": lambda tw: tw.exports_cancelled,
+            "changes_coalesced": lambda tw: tw.changes_coalesced,
+        })
+
+    def start(self):
+        """
+        load the local task database and monitor TaskWarrior for changes in
+        a background thread
+        """
+        # spawn monitoring threads as daemons (so that they close
+        # automatically when TaskHUD application is closed)
+        self.sync_t = threading.Thread(target=self.sync_thread)
+        self.sync_t.setDaemon(True)
+        self.sync_t.start()
 
-        # spawn monitoring thread as daemon (so that it closes automatically
-        # when TaskHUD application is closed)
         self.t = threading.Thread(target=self.watch_thread)
         self.t.setDaemon(True)
         self.t.start()
 
-    def task_db_changed(self):
+    def _file_size(self, path):
         """
-        returns True if task database has changed since last check
+        returns size of file at `path`, or 0 if it doesn't exist
         """
-        # Assume no changes have occured
-        changed = False
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
 
-        # Check modification timestamps for TaskWarrior files
-        new_backlog_mtime = os.path.getmtime(self.backlog_path)
-        new_pending_mtime = os.path.getmtime(self.pending_path)
+    def _notify(self, delta):
+        """
+        passes `delta` to change callback if there is one and it's callable
+        """
+        if not delta:
+            return
 
-        if self.backlog_mtime != new_backlog_mtime:
-            # Backlog was modified
-            self.backlog_mtime = new_backlog_mtime
-            changed = True
+        # Tasks with actions in flight are shown as they are expected to end
+        # up. Held while calling change_cb, so deltas from different threads
+        # can't overtake each other.
+        with self.write_lock:
+            if self.pending_writes:
+                delta = TaskDelta(
+                    [self._expected(record) for record in delta.added],
+                    [self._expected(record) for record in delta.modified],
+                    delta.deleted
+                )
 
-        if self.pending_mtime != new_pending_mtime:
-            # Pending tasks were modified
-            self.pending_mtime = new_pending_mtime
-            changed = True
-
-        return changed
+            # Call the change callback if available and callable
+            if self.change_cb is not None:
+                if callable(self.change_cb):
+                    self.change_cb(delta)
 
+    def _expected(self, record):
+        """
+        returns the expected version of `record`, if an action is changing
+        it
+        """
+        pending = self.pending_writes.get(record["uuid"])
+        return record if pending is None else pending[0]
 
-    def update_task_db(self):
+    def _export(self, args, cancellable=False):
         """
-        calls TaskWarrior to update local task database
+        runs `task <args> export`, yielding lists of TaskRecords as they are
+        parsed from its output (the first batch is kept small, so that it
+        arrives quickly). Raises TaskWarriorError if TaskWarrior fails or
+        produces output that can't be parsed. If `cancellable`, newer changes
+        may cancel the export, raising ExportCancelled.
         """
-        # Call TaskWarrior and have it export all records (JSON)
+        # The filter goes before the command, as TaskWarrior documents it
+        # (`task <filter> export`). Arguments after `export` are taken as a
+        # report name by newer TaskWarrior versions, so the original
+        # `task export .` form can't carry a filter.
+        start = time.perf_counter()
         task_proc = subprocess.Popen(
-            [self.task_cmd, "export", "."], stdout=subprocess.PIPE
+            [self.task_cmd] + args + ["export"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self.exports_started += 1
+
+        # time spent parsing output, as opposed to waiting for TaskWarrior,
+        # and time spent by the caller on each batch (which isn't part of
+        # the export)
+        parse_time = 0.0
+        consumer_time = 0.0
+
+        if cancellable:
+            with self.change_lock:
+                self.export_cancelled = False
+                self.export_proc = task_proc
+
+        # Collect stderr on another thread, so that TaskWarrior can't block
+        # writing to it while we're waiting on stdout
+        err_chunks = []
+        err_thread = threading.Thread(
+            target=lambda: err_chunks.append(task_proc.stderr.read())
+        )
+        err_thread.daemon = True
+        err_thread.start()
+
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder("utf-8")()
+        buf = ""
+        batch = []
+        batch_size = self.first_batch_size
+        count = 0
+
+        try:
+            while True:
+                chunk = task_proc.stdout.read1(EXPORT_READ_SIZE)
+                parse_start = time.perf_counter()
+                buf += utf8.decode(chunk, final=not chunk)
+
+                # Parse every complete record in the buffer. Export output is
+                # a JSON array, but the brackets and commas between records
+                # are simply skipped so each record can be decoded alone.
+                pos = 0
+                while True:
+                    while pos < len(buf) and buf[pos] in " \t\r\n,[]":
+                        pos += 1
+                    if pos == len(buf):
+                        break
+
+                    try:
+                        record, pos = decoder.raw_decode(buf, pos)
+                    except ValueError:
+                        if not chunk and cancellable \
+                                and self.export_cancelled:
+                            # killed partway through a record
+                            raise ExportCancelled()
+                        if not chunk:
+                            raise TaskWarriorError(
+                                "couldn't parse output of task export"
+                            )
+                        # incomplete record, wait for more output
+                        break
+
+                    batch.append(self._make_record(record))
+                    count += 1
+
+                    if len(batch) >= batch_size:
+                        parse_time += time.perf_counter() - parse_start
+                        yield_start = time.perf_counter()
+                        yield batch
+                        parse_start = time.perf_counter()
+                        consumer_time += parse_start - yield_start
+                        batch = []
+                        batch_size = self.batch_size
+
+                buf = buf[pos:]
+                parse_time += time.perf_counter() - parse_start
+
+                if not chunk:
+                    break
+
+            if batch:
+                yield_start = time.perf_counter()
+                yield batch
+                consumer_time += time.perf_counter() - yield_start
+        finally:
+            if cancellable:
+                with self.change_lock:
+                    self.export_proc = None
+
+            # stop TaskWarrior if we're bailing out early
+            if task_proc.poll() is None:
+                task_proc.kill()
+            task_proc.stdout.close()
+
+            exit_code = task_proc.wait()
+            err_thread.join()
+            task_proc.stderr.close()
+
+            stats.add_time(
+                "export", time.perf_counter() - start - consumer_time
+            )
+            stats.add_time("parse", parse_time)
+
+        if cancellable and self.export_cancelled:
+            raise ExportCancelled()
+
+        err = b"".join(err_chunks).decode("utf-8", "replace").strip()
+
+        # TaskWarrior exits with 1 when a filter matches nothing
+        if exit_code == 1 and count == 0 and not err:
+            return
+
+        if exit_code != 0:
+            raise TaskWarriorError(
+                "task export failed with exit code {}: {}".format(
+                    exit_code, err
+                )
+            )
+
+    def _make_record(self, data):
+        """
+        returns TaskRecord for a task exported by TaskWarrior, keeping only
+        the fields asked for
+        """
+        if self.fields is not None:
+            data = {k: v for k, v in data.items() if k in self.fields}
+
+        return TaskRecord(data)
+
+    def _count(self, args):
+        """
+        returns number of tasks matching filter `args`
+        """
+        task_proc = subprocess.run(
+            [self.task_cmd] + args + ["count"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
         )
 
-        (output, err) = task_proc.communicate()
-        exit_code = task_proc.wait()
+        try:
+            return int(task_proc.stdout.decode("utf-8").strip() or 0)
+        except ValueError:
+            raise TaskWarriorError("task count failed: {}".format(
+                task_proc.stderr.decode("utf-8", "replace").strip()
+            ))
+
+    def _user_filter(self):
+        """
+        returns task_filter in parentheses (or nothing if it's empty), so it
+        can be combined with other filter arguments. TaskWarrior's implicit
+        "and" between arguments binds tighter than "or", so a filter such
+        as `project:a or project:b` would otherwise only apply the rest of
+        the filter to project:b.
+        """
+        if not self.task_filter:
+            return []
 
-        # TODO: handle errors and exit codes
+        return ["("] + self.task_filter + [")"]
+
+    def _history_filter(self):
+        """
+        returns filter arguments for completed and deleted tasks
+        """
+        return ["(", "status:completed", "or", "status:deleted", ")"]
+
+    def _export_filter(self):
+        """
+        returns filter arguments for a full export
+        """
+        if self.history == "eager":
+            return self._user_filter() + ["."]
+
+        if self.history_cursor is None:
+            self.history_cursor = int(time.time())
+
+        # `end` is only set for completed and deleted tasks
+        return self._user_filter() + [
+            "(", "status:pending", "or", "status:waiting",
+            "or", "status:recurring",
+            "or", "end.after:{}".format(self.history_cursor - 1), ")"
+        ]
+
+    def _in_scope(self, record):
+        """
+        returns True if `record` should be in the local database, given the
+        history loaded so far (task_filter isn't checked)
+        """
+        if self.history == "eager":
+            return True
+
+        if record.get("status") not in ("completed", "deleted"):
+            return True
+
+        if self.history_cursor is None or "end" not in record:
+            return False
+
+        cursor = time.strftime(
+            "%Y%m%dT%H%M%SZ", time.gmtime(self.history_cursor)
+        )
+        return record["end"] >= cursor
+
+    def update_task_db(self):
+        """
+        calls TaskWarrior to update local task database. Changes are passed to
+        change_cb in batches as the export is read, followed by a final delta
+        for records that have been deleted.
+        """
+        with self.update_lock, stats.timer("full_update"):
+            serial = self._start_update()
+            self._update_task_db()
+            self._settle_writes(serial)
+
+    def _update_task_db(self):
+        # Note file positions before exporting. Anything written after this
+        # point will be applied again by the next incremental update, which
+        # is harmless as applying a record twice gives the same result.
+        backlog_offset = self._file_size(self.backlog_path)
+        undo_size = self._file_size(self.undo_path)
+        stamps = file_stamps(os.path.dirname(self.pending_path))
+
+        # Call TaskWarrior and have it export all records (JSON), working out
+        # what changed compared to the local database as records arrive
+        new_db = TaskStore()
+
+        try:
+            for batch in self._export(self._export_filter(), cancellable=True):
+                delta = TaskDelta()
+
+                for record in batch:
+                    old = self.task_db.get(record["uuid"])
+                    if old is None:
+                        delta.added.append(record)
+                    elif old != record:
+                        delta.modified.append(record)
+
+                    new_db.set(record)
+
+                self._notify(delta)
+        except ExportCancelled:
+            # Records already passed to change_cb are kept, so that the next
+            # export's deltas are worked out against what was passed on
+            for record in new_db.values():
+                self.task_db.set(record)
+            self.needs_full_sync = True
+            self.last_export_cancelled = True
+            raise
+        except (TaskWarriorError, OSError):
+            # The database is left as it was, so take back the records
+            # already passed to change_cb
+            self._notify(self._revert_delta(new_db))
+            raise
+
+        delta = TaskDelta()
+        for uuid in self.task_db:
+            if uuid not in new_db:
+                delta.deleted.append(uuid)
 
-        # Convert to a list of JSON
-        task_json = json.loads(output)
         # Store locally
-        self.task_db = task_json
+        self.task_db = new_db
+        self.backlog_offset = backlog_offset
+        self.undo_size = undo_size
+        self.last_full_sync = time.monotonic()
+        self.unchecked_updates = False
+        self.needs_full_sync = False
+        self.last_export_cancelled = False
+
+        self._notify(delta)
+        self._save_snapshot(stamps)
+
+    def _revert_delta(self, records):
+        """
+        returns TaskDelta undoing changes passed on for TaskStore `records`,
+        going back to what is in the local database
+        """
+        delta = TaskDelta()
+
+        for uuid, record in records.items():
+            old = self.task_db.get(uuid)
+            if old is None:
+                delta.deleted.append(uuid)
+            elif old != record:
+                delta.modified.append(old)
 
-        # Call the change callback if available and callable
-        if self.change_cb is not None:
-            if callable(self.change_cb):
-                self.change_cb()
+        return delta
+
+    def _state(self):
+        """
+        returns dict of sync state saved alongside a snapshot
+        """
+        return {
+            "backlog_offset": self.backlog_offset,
+            "undo_size": self.undo_size,
+            "history_cursor": self.history_cursor,
+            "history_window": self.history_window,
+            "history_exhausted": self.history_exhausted,
+        }
+
+    def _save_snapshot(self, stamps):
+        """
+        save local database to the snapshot cache, `stamps` being the state
+        of the data files before the export that produced it
+        """
+        if self.snapshot_cache is None:
+            return
+
+        try:
+            self.snapshot_cache.save(
+                stamps, self._state(), self.task_db.values()
+            )
+        except OSError:
+            # the cache only speeds up startup, carry on without it
+            pass
+
+    def load_snapshot(self):
+        """
+        loads the local database from the snapshot cache, passing its records
+        to change_cb. Returns True if the snapshot is up to date with the
+        data files (so no export is needed), False if it's missing or needs
+        a full export to bring it up to date.
+        """
+        if self.snapshot_cache is None:
+            return False
+
+        with self.update_lock:
+            snapshot = self.snapshot_cache.load()
+            if snapshot is None:
+                return False
+
+            stamps, state, records = snapshot
+
+            # History bounds decide which tasks the export covers, so they
+            # are restored even for an out of date snapshot. Its records
+            # then only differ from the export where tasks really changed.
+            self.history_cursor = state["history_cursor"]
+            self.history_window = state["history_window"]
+            self.history_exhausted = state["history_exhausted"]
+
+            self.task_db = TaskStore(records)
+            self._notify(TaskDelta(added=records))
+
+            if stamps != file_stamps(os.path.dirname(self.pending_path)):
+                return False
+
+            self.backlog_offset = state["backlog_offset"]
+            self.undo_size = state["undo_size"]
+            self.needs_full_sync = False
+
+            # time based fields (urgency, waiting tasks) may have moved on,
+            # so have the next consistency check confirm the snapshot
+            self.last_full_sync = time.monotonic()
+            self.unchecked_updates = True
+            self.loaded_from_cache = True
+
+        return True
+
+    def load_history_page(self):
+        """
+        loads the next page of completed and deleted tasks (working back in
+        time from the oldest loaded so far), returns number of tasks loaded
+        """
+        with self.update_lock:
+            if self.history_exhausted:
+                return 0
+
+            if self.history_cursor is None:
+                self.history_cursor = int(time.time())
+
+            history_filter = self._user_filter() + self._history_filter()
+
+            # number of tasks older than the history loaded so far
+            remaining = self._count(history_filter + [
+                "end.before:{}".format(self.history_cursor)
+            ])
+
+            delta = TaskDelta()
+
+            while remaining > 0 and len(delta.added) < self.history_page_size:
+                start = self.history_cursor - self.history_window
+
+                page = []
+                for batch in self._export(history_filter + [
+                    "end.after:{}".format(start - 1),
+                    "end.before:{}".format(self.history_cursor)
+                ]):
+                    page += batch
+
+                for record in page:
+                    if record["uuid"] not in self.task_db:
+                        self.task_db.set(record)
+                        delta.added.append(record)
+
+                self.history_cursor = start
+                remaining -= len(page)
+
+                # aim for windows holding about a page of tasks
+                if len(page) < self.history_page_size // 2:
+                    self.history_window *= 2
+                elif len(page) > self.history_page_size * 2:
+                    self.history_window = max(self.history_window // 2, 1)
+
+            if remaining <= 0:
+                self.history_exhausted = True
+
+        self._notify(delta)
+        return len(delta.added)
+
+    def request_history(self):
+        """
+        start loading the next page of history in the background, unless
+        it's already being loaded or there is none left
+        """
+        if self.history_exhausted:
+            return
+
+        if self.history_thread is not None and self.history_thread.is_alive():
+            return
+
+        def load():
+            try:
+                self.load_history_page()
+            except (TaskWarriorError, OSError) as e:
+                self._report_error(e)
+
+        self.history_thread = threading.Thread(target=load)
+        self.history_thread.daemon = True
+        self.history_thread.start()
+
+    def _read_backlog(self):
+        """
+        returns list of records appended to backlog.data since the last
+        update, or None if the backlog can't be used (it was truncated by
+        `task sync` or contains something unparseable)
+        """
+        with open(self.backlog_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+
+            if size < self.backlog_offset:
+                return None
+
+            f.seek(self.backlog_offset)
+            tail = f.read(size - self.backlog_offset)
+
+        # Only consume complete lines, a partially written line will be
+        # picked up on the next change
+        end = tail.rfind(b"\n") + 1
+        records = []
+
+        for line in tail[:end].splitlines():
+            line = line.strip()
+
+            # first line of the backlog is a sync key rather than a record
+            if not line.startswith(b"{"):
+                continue
+
+            try:
+                records.append(json.loads(line.decode("utf-8")))
+            except ValueError:
+                return None
+
+        self.backlog_offset += end
+        return records
+
+    def _read_pending_ids(self):
+        """
+        returns dict of uuid -> id for tasks in pending.data. IDs are
+        assigned by TaskWarrior in the order tasks appear in that file.
+        """
+        ids = {}
+        next_id = 1
+
+        with open(self.pending_path, encoding="utf-8") as f:
+            for line in f:
+                fields = dict(PENDING_LINE_RE.findall(line))
+                if "uuid" not in fields:
+                    continue
+
+                if fields.get("status") in ("completed", "deleted"):
+                    ids[fields["uuid"]] = 0
+                else:
+                    ids[fields["uuid"]] = next_id
+                    next_id += 1
+
+        return ids
+
+    def update_task_db_incremental(self, changed_files):
+        """
+        updates local task database from the files listed in
+        `changed_files`, exporting only the tasks backlog.data says have
+        changed. Falls back to a full export when the files can't describe
+        the change.
+        """
+        with self.update_lock, stats.timer("incremental_update"):
+            serial = self._start_update()
+            self._update_task_db_incremental(changed_files)
+            self._settle_writes(serial)
+
+    def _update_task_db_incremental(self, changed_files):
+        undo_size = self._file_size(self.undo_path)
+        if undo_size < self.undo_size:
+            # `task undo` rewrote undo.data, the backlog only grows
+            return self._update_task_db()
+        self.undo_size = undo_size
+
+        records = self._read_backlog()
+        if records is None:
+            return self._update_task_db()
+
+        changed = {record["uuid"] for record in records}
+        if len(changed) > INCREMENTAL_EXPORT_LIMIT:
+            return self._update_task_db()
+
+        # Backlog records lack urgency (which depends on other fields, and
+        # on other tasks) and id, and only TaskWarrior can check a filter, so
+        # the changed tasks are exported. This also gives new tasks their id.
+        # The uuids have parentheses of their own, as the user's filter may
+        # contain "or".
+        exported = {}
+        if changed:
+            for batch in self._export(
+                self._user_filter() + ["("] + sorted(changed) + [")"]
+            ):
+                for record in batch:
+                    exported[record["uuid"]] = record
+
+        # IDs of other tasks only change when pending.data is rewritten
+        ids = None
+        if "pending.data" in changed_files:
+            ids = self._read_pending_ids()
+
+        delta = TaskDelta()
+
+        for uuid in changed:
+            old = self.task_db.get(uuid)
+            record = exported.get(uuid)
+
+            if record is None or not self._in_scope(record):
+                # task no longer belongs in the local database
+                if old is not None:
+                    self.task_db.remove(uuid)
+                    delta.deleted.append(uuid)
+                continue
+
+            if old is None:
+                delta.added.append(record)
+            elif old != record:
+                delta.modified.append(record)
+
+            self.task_db.set(record)
+
+        # Tasks that weren't modified may still have been renumbered
+        if ids is not None:
+            for uuid, old in self.task_db.items():
+                if uuid in changed:
+                    continue
+
+                new_id = ids.get(uuid, 0)
+                if old.get("id", 0) != new_id:
+                    record = self.task_db.set(old.replace(id=new_id))
+                    delta.modified.append(record)
+
+        if delta:
+            self.unchecked_updates = True
+
+        self._notify(delta)
+
+    def _start_update(self):
+        """
+        returns serial number for an update that is starting
+        """
+        with self.write_lock:
+            self.update_serial += 1
+            return self.update_serial
+
+    def _settle_writes(self, serial):
+        """
+        stop standing in for tasks whose actions finished before update
+        `serial` started, passing on TaskWarrior's version of them
+        """
+        delta = TaskDelta()
+
+        with self.write_lock:
+            for uuid, pending in list(self.pending_writes.items()):
+                expected, remaining, finished = pending
+                if remaining or finished >= serial:
+                    continue
+
+                del self.pending_writes[uuid]
+
+                record = self.task_db.get(uuid)
+                if record is None:
+                    delta.deleted.append(uuid)
+                elif record != expected:
+                    delta.modified.append(record)
+
+            self._notify(delta)
+
+    def queue_action(self, uuids, command, args=()):
+        """
+        run `task <uuids> <command> <args>` in the background, where command
+        is one of done, start, stop, modify or annotate. Tasks are passed to
+        change_cb as they are expected to be after the command straight
+        away.
+        """
+        if command not in WRITE_COMMANDS:
+            raise ValueError("unknown command {}".format(command))
+
+        args = tuple(args)
+        delta = TaskDelta()
+
+        with self.write_lock:
+            for uuid in uuids:
+                pending = self.pending_writes.get(uuid)
+                record = self.task_db.get(uuid) if pending is None \
+                    else pending[0]
+                if record is None:
+                    continue
+
+                expected = predict_action(record, command, args)
+                if pending is None:
+                    pending = self.pending_writes[uuid] = [None, 0, 0]
+                pending[0] = expected
+                pending[1] += 1
+                delta.modified.append(expected)
+
+            self.write_queue.append((tuple(uuids), command, args))
+            self.write_event.set()
+
+            if self.write_t is None:
+                self.write_t = threading.Thread(target=self.write_thread)
+                self.write_t.daemon = True
+                self.write_t.start()
+
+            self._notify(delta)
+
+    def _run_action(self, uuids, command, args):
+        """
+        run a TaskWarrior command changing tasks, raises TaskWarriorError if
+        it fails
+        """
+        with stats.timer("write"):
+            task_proc = subprocess.run(
+                [self.task_cmd] + command_args(uuids, command, args),
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE
+            )
+
+        if task_proc.returncode != 0:
+            raise TaskWarriorError("task {} failed: {}".format(
+                command, task_proc.stderr.decode("utf-8", "replace").strip()
+            ))
+
+    def write_thread(self):
+        """
+        Run actions queued by queue_action(), sending everything queued
+        while the last command ran as one batch.
+        """
+        while True:
+            self.write_event.wait()
+
+            with self.write_lock:
+                actions = self.write_queue
+                self.write_queue = []
+                self.write_event.clear()
+
+            for uuids, command, args, merged in batch_actions(actions):
+                error = None
+                try:
+                    self._run_action(uuids, command, args)
+                except (TaskWarriorError, OSError) as e:
+                    error = e
+
+                delta = TaskDelta()
+
+                with self.write_lock:
+                    for action in merged:
+                        for uuid in action[0]:
+                            pending = self.pending_writes.get(uuid)
+                            if pending is None:
+                                continue
+
+                            pending[1] -= 1
+                            pending[2] = self.update_serial
+
+                            # If it failed, go back to TaskWarrior's version
+                            # once nothing else is expected of the task
+                            if error is not None and not pending[1]:
+                                del self.pending_writes[uuid]
+                                record = self.task_db.get(uuid)
+                                if record is not None:
+                                    delta.modified.append(record)
+
+                    self._notify(delta)
+
+                if error is not None:
+                    self._report_error(error)
+
+    def _report_error(self, e):
+        """
+        record a failed update, and pass it on to error_cb
+        """
+        self.last_error = e
+        if self.error_cb is not None and callable(self.error_cb):
+            self.error_cb(e)
 
     def watch_thread(self):
         """
-        Keep checking file timestamps, and update local database if files
-        ever change.
+        Wait for TaskWarrior data files to change, and pass changes on to
+        the sync thread.
         """
         while True:
-            if self.task_db_changed():
-                self.update_task_db()
+            changed = self.watcher.wait()
+            if not changed:
+                continue
+
+            with self.change_lock:
+                self.pending_files |= changed
+                self.generation += 1
+
+                # A running full export is now out of date, so stop it (it
+                # will be run again once changes settle). If the last one was
+                # cancelled, let this one finish so that a constant stream
+                # of changes can't hold up updates forever.
+                if self.export_proc is not None \
+                        and not self.export_cancelled \
+                        and not self.last_export_cancelled:
+                    self.export_cancelled = True
+                    self.exports_cancelled += 1
+                    self.export_proc.kill()
 
-            # TODO: make interval user-configurable
-            time.sleep(0.25)
+            self.change_event.set()
+
+    def _wait_for_changes(self):
+        """
+        wait until changes arrive and then stop arriving for `debounce`
+        seconds, or until a consistency check is due. Returns set of changed
+        file names (empty if there were no changes).
+        """
+        timeout = None
+        if self.unchecked_updates:
+            # wake up in time for the next consistency check
+            timeout = max(
+                self.last_full_sync + self.full_sync_interval
+                    - time.monotonic(),
+                0
+            )
+
+        if self.change_event.wait(timeout):
+            # Give TaskWarrior a moment to finish writing all of its files
+            deadline = time.monotonic() + self.max_debounce
+            while time.monotonic() < deadline:
+                generation = self.generation
+                time.sleep(self.debounce)
+                if self.generation == generation:
+                    break
+
+        with self.change_lock:
+            self.change_event.clear()
+
+            changed = self.pending_files
+            self.pending_files = set()
+
+            if self.generation - self.synced_generation > 1:
+                self.changes_coalesced += \
+                    self.generation - self.synced_generation - 1
+            self.synced_generation = self.generation
+
+        return changed
+
+    def sync_thread(self):
+        """
+        Load local database, then update it whenever the watcher thread sees
+        TaskWarrior data files change.
+        """
+        try:
+            if not self.load_snapshot():
+                try:
+                    self.update_task_db()
+                except ExportCancelled:
+                    # Changes arrived while loading. The export run once
+                    # they settle can't be cancelled, and load_cb waits for
+                    # it so the database it sees is complete.
+                    self._wait_for_changes()
+                    self.update_task_db()
+        except ExportCancelled:
+            pass
+        except (TaskWarriorError, OSError) as e:
+            self._report_error(e)
+
+        self.loaded.set()
+        if self.load_cb is not None and callable(self.load_cb):
+            self.load_cb()
+
+        while True:
+            changed = self._wait_for_changes()
 
+            try:
+                if self.needs_full_sync and (changed or self.unchecked_updates):
+                    self.update_task_db()
+                elif self.unchecked_updates and time.monotonic() >= \
+                        self.last_full_sync + self.full_sync_interval:
+                    self.update_task_db()
+                elif changed and self.sync == "incremental":
+                    self.update_task_db_incremental(changed)
+                elif changed:
+                    self.update_task_db()
+            except ExportCancelled:
+                # newer changes are waiting, and will start another export
+                pass
+            except (TaskWarriorError, OSError) as e:
+                # keep the database we have, and try again on next change (or
+                # after another interval, if this was a consistency check)
+                self.last_full_sync = time.monotonic()
+                self._report_error(e)
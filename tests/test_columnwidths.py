@@ -0,0 +1,94 @@
+""" ---------------------------------------------------------------------------
+
+    test_columnwidths.py - Tests for CursesHud's column widths, kept up to
+                           date as records change
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import os
+import random
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from headless import HeadlessScreen, headless_curses
+
+class ColumnWidthTest(unittest.TestCase):
+    def setUp(self):
+        self.screen = HeadlessScreen()
+        self.curses = headless_curses(self.screen)
+        self.curses.__enter__()
+
+        from cwrapper import CursesHud
+        self.hud = CursesHud(self.screen)
+        self.hud.set_unique_key("uuid")
+        self.hud.set_translation("count", lambda n: "#" * n)
+
+    def tearDown(self):
+        self.curses.__exit__(None, None, None)
+
+    def expected_width(self, column):
+        widths = [len(str(self.hud.translations.get(column, str)(r[column])))
+                  for r in self.hud.record_index.values() if column in r]
+        return max(widths + [len(column)]) + 3
+
+    def check(self):
+        for column in self.hud.columns:
+            self.assertEqual(self.hud._column_width(column),
+                             self.expected_width(column), column)
+
+    def test_random_changes(self):
+        rng = random.Random(0)
+        self.hud.add_record([{"uuid": "u0", "name": "x", "count": 1}])
+        self.check()
+
+        for step in range(500):
+            key = "u{}".format(rng.randrange(40))
+            if rng.random() < 0.2:
+                self.hud.remove_record(key)
+            else:
+                self.hud.add_record({
+                    "uuid": key,
+                    "name": "x" * rng.randrange(1, 30),
+                    "count": rng.randrange(1, 30),
+                })
+
+            if step % 10 == 0:
+                self.check()
+
+        self.check()
+
+    def test_widest_replaced_by_as_wide(self):
+        self.hud.add_record([
+            {"uuid": "a", "name": "x" * 20},
+            {"uuid": "b", "name": "x" * 5},
+        ])
+        self.check()
+
+        # the widest value is replaced by one just as wide, so the column
+        # doesn't need measuring again
+        self.hud.add_record({"uuid": "a", "name": "y" * 20})
+        self.assertNotIn("name", self.hud.remeasure)
+
+        # but it does once the widest has gone
+        self.hud.add_record({"uuid": "a", "name": "y" * 2})
+        self.assertIn("name", self.hud.remeasure)
+        self.check()
+        self.assertNotIn("name", self.hud.remeasure)
+
+    def test_translation_change(self):
+        self.hud.add_record({"uuid": "a", "count": 8})
+        self.check()
+
+        self.hud.set_translation("count", str)
+        self.check()
+
+if __name__ == "__main__":
+    unittest.main()
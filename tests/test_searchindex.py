@@ -0,0 +1,217 @@
+""" ---------------------------------------------------------------------------
+
+    test_searchindex.py - Tests for SearchIndex and PrefixIndex
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from searchindex import PrefixIndex, SearchIndex
+
+RECORDS = {
+    "a": {"description": "Water the garden", "project": "home",
+          "status": "pending", "tags": ["outside", "next"]},
+    "b": {"description": "Fix the garden gate", "project": "home.garden",
+          "status": "pending", "tags": ["outside"]},
+    "c": {"description": "Write report", "project": "work",
+          "status": "completed",
+          "annotations": [{"entry": "20170216T101500Z",
+                           "description": "ask about the budget"}]},
+    "d": {"description": "Café booking", "project": "work",
+          "status": "deleted", "priority": "H"},
+}
+
+def make_index():
+    index = SearchIndex(
+        ["description", "project", "tags", "annotations"],
+        ["project", "status", "tags", "priority"]
+    )
+    for key, record in RECORDS.items():
+        index.add(key, record)
+    return index
+
+class PrefixIndexTest(unittest.TestCase):
+    def test_against_brute_force(self):
+        rng = random.Random(0)
+        letters = "abcde"
+        index = PrefixIndex()
+        postings = {}
+
+        for step in range(3000):
+            term = "".join(rng.choice(letters)
+                           for _ in range(rng.randint(1, 4)))
+            key = rng.randrange(50)
+
+            if rng.random() < 0.3:
+                index.discard(term, key)
+                postings.get(term, set()).discard(key)
+            else:
+                index.add(term, key)
+                postings.setdefault(term, set()).add(key)
+
+            if step % 50 == 0:
+                prefix = "".join(rng.choice(letters)
+                                 for _ in range(rng.randint(0, 2)))
+                expected = set()
+                for t, keys in postings.items():
+                    if t.startswith(prefix):
+                        expected |= keys
+                self.assertEqual(index.prefix(prefix), expected)
+
+        index.prefix("")
+        self.assertEqual(
+            [t for t in index.terms if index.postings[t]],
+            sorted(t for t, keys in postings.items() if keys)
+        )
+
+    def test_discard_missing(self):
+        index = PrefixIndex()
+        index.add("term", 1)
+        index.discard("other", 1)
+        index.discard("term", 2)
+
+        self.assertEqual(index.prefix("t"), {1})
+
+        # a term nothing has matches nothing, even before it's merged
+        index.add("new", 1)
+        index.discard("new", 1)
+        self.assertEqual(index.prefix("n"), set())
+
+        index.add("new", 2)
+        self.assertEqual(index.prefix("n"), {2})
+        self.assertEqual(index.empty, 0)
+
+    def test_empty_terms_cleared(self):
+        index = PrefixIndex()
+        for n in range(1000):
+            index.add("t{:04d}".format(n), n)
+        index.prefix("")
+
+        # a few emptied terms are left in place
+        for n in range(10):
+            index.discard("t{:04d}".format(n), n)
+        index.prefix("")
+        self.assertEqual(len(index.terms), 1000)
+        self.assertEqual(index.prefix("t000"), set())
+
+        # many are cleared out in one go
+        for n in range(10, 500):
+            index.discard("t{:04d}".format(n), n)
+        self.assertEqual(index.prefix("t0"), set(range(500, 1000)))
+        self.assertEqual(len(index.terms), 500)
+        self.assertEqual(len(index.postings), 500)
+        self.assertEqual(index.empty, 0)
+
+class SearchIndexTest(unittest.TestCase):
+    def test_words(self):
+        index = make_index()
+
+        self.assertEqual(index.search("garden"), {"a", "b"})
+        self.assertEqual(index.search("gar"), {"a", "b"})
+        self.assertEqual(index.search("GARDEN gate"), {"b"})
+        self.assertEqual(index.search("the"), {"a", "b", "c"})
+        self.assertEqual(index.search("café"), {"d"})
+        self.assertEqual(index.search("nothing"), set())
+
+    def test_empty_query(self):
+        index = make_index()
+
+        self.assertIsNone(index.search(""))
+        self.assertIsNone(index.search("   "))
+        self.assertIsNone(index.search("project:"))
+
+    def test_predicates(self):
+        index = make_index()
+
+        self.assertEqual(index.search("project:home"), {"a", "b"})
+        self.assertEqual(index.search("project:home."), {"b"})
+        self.assertEqual(index.search("status:pending garden"), {"a", "b"})
+        self.assertEqual(index.search("tags:next"), {"a"})
+        self.assertEqual(index.search("priority:h"), {"d"})
+
+        # anything else with a colon is searched for as words
+        self.assertEqual(index.search("garden:gate"), {"b"})
+
+    def test_annotations(self):
+        index = make_index()
+
+        self.assertEqual(index.search("budget"), {"c"})
+
+        # annotation timestamps aren't indexed as words
+        self.assertEqual(index.search("20170216"), set())
+
+    def test_add_replaces_and_remove(self):
+        index = make_index()
+
+        index.add("a", dict(RECORDS["a"], description="Mow the lawn"))
+        self.assertEqual(index.search("garden"), {"b"})
+        self.assertEqual(index.search("lawn"), {"a"})
+
+        index.remove("b")
+        index.remove("missing")
+        self.assertEqual(index.search("garden"), set())
+        self.assertEqual(index.search("project:home"), {"a"})
+        self.assertEqual(len(index), 3)
+
+    def test_unchanged_record_not_reindexed(self):
+        index = make_index()
+        index.search("")
+        index.search("garden")
+        terms = index.words.terms
+        cache = dict(index.cache)
+
+        for key, record in RECORDS.items():
+            index.add(key, dict(record))
+
+        self.assertIs(index.words.terms, terms)
+        self.assertEqual(index.words.new_terms, [])
+        self.assertEqual(index.words.empty, 0)
+        self.assertEqual(index.cache, cache)
+
+    def test_changed_words_only(self):
+        index = make_index()
+        index.search("garden")
+
+        index.add("a", dict(RECORDS["a"], description="Water the lawn"))
+        self.assertEqual(index.search("garden"), {"b"})
+        self.assertEqual(index.search("water"), {"a"})
+        self.assertEqual(index.search("lawn"), {"a"})
+        self.assertEqual(index.words.empty, 0)
+
+        index.add("a", dict(RECORDS["a"], project="work"))
+        self.assertEqual(index.search("project:home"), {"b"})
+        self.assertEqual(index.search("project:work"), {"a", "c", "d"})
+
+    def test_cache_cleared_on_change(self):
+        index = make_index()
+
+        self.assertEqual(index.search("wat"), {"a"})
+        index.add("e", {"description": "Water plants"})
+        self.assertEqual(index.search("wat"), {"a", "e"})
+
+    def test_results_are_copies(self):
+        index = make_index()
+
+        # a single matching term returns its postings, which mustn't be
+        # handed out for the caller to change
+        index.search("report").add("x")
+        self.assertEqual(index.search("report"), {"c"})
+
+    def test_all_fields(self):
+        index = SearchIndex()
+        index.add(1, {"description": "one", "estimate": "PT1H", "count": 12})
+
+        self.assertEqual(index.search("pt1h"), {1})
+        self.assertEqual(index.search("12"), {1})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+""" ---------------------------------------------------------------------------
+
+    test_sorting.py - Tests for sort_component() and SortedRecords
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import os
+import random
+import sys
+import unittest
+from functools import cmp_to_key
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cwrapper import SortedRecords, sort_component
+
+def reference_order(records, order, sort_values=None):
+    """
+    returns unique keys of `records` (dict of key -> record) sorted by
+    `order` the slow way: comparing values directly, numbers before strings
+    and missing values last in either direction, ties broken by key
+    """
+    sort_values = sort_values or {}
+
+    def value(key, column):
+        v = records[key].get(column)
+        if v is not None and column in sort_values:
+            v = sort_values[column](v)
+        return v
+
+    def compare(a, b):
+        for column, descending in order:
+            va = value(a, column)
+            vb = value(b, column)
+
+            if va is None or vb is None:
+                if va is None and vb is None:
+                    continue
+                return 1 if va is None else -1
+
+            rank_a = isinstance(va, str)
+            rank_b = isinstance(vb, str)
+            if rank_a != rank_b:
+                return 1 if rank_a else -1
+
+            if va != vb:
+                result = -1 if va < vb else 1
+                return -result if descending else result
+
+        return -1 if a < b else (a > b)
+
+    return sorted(records, key=cmp_to_key(compare))
+
+class SortComponentTest(unittest.TestCase):
+    def test_numbers(self):
+        self.assertLess(sort_component(1), sort_component(2))
+        self.assertLess(sort_component(2, True), sort_component(1, True))
+        self.assertLess(sort_component(1.5), sort_component(2))
+
+    def test_strings_ascending(self):
+        self.assertLess(sort_component("a"), sort_component("b"))
+        self.assertLess(sort_component("ab"), sort_component("abc"))
+
+    def test_strings_descending(self):
+        self.assertLess(sort_component("b", True), sort_component("a", True))
+
+        # a longer string sorts before its own prefix
+        self.assertLess(
+            sort_component("abc", True), sort_component("ab", True)
+        )
+        self.assertLess(sort_component("a", True), sort_component("", True))
+
+    def test_descending_unicode(self):
+        words = ["zebra", "äpfel", "apple", "日本", "Zulu", "", "á"]
+        ascending = sorted(words, key=sort_component)
+        descending = sorted(words, key=lambda w: sort_component(w, True))
+
+        self.assertEqual(ascending, sorted(words))
+        self.assertEqual(descending, sorted(words, reverse=True))
+
+    def test_none_sorts_last(self):
+        for descending in (False, True):
+            missing = sort_component(None, descending)
+            self.assertLess(sort_component(0, descending), missing)
+            self.assertLess(sort_component("z", descending), missing)
+
+    def test_numbers_before_strings(self):
+        self.assertLess(sort_component(10 ** 9), sort_component(""))
+
+    def test_other_types_compared_as_strings(self):
+        self.assertEqual(sort_component(("a", "b")), (1, "('a', 'b')"))
+
+class SortedRecordsTest(unittest.TestCase):
+    def make_records(self, n, seed=0):
+        rng = random.Random(seed)
+        records = {}
+
+        for i in range(n):
+            record = {"uuid": "u{:04d}".format(i)}
+            if rng.random() < 0.8:
+                record["id"] = rng.randint(0, 20)
+            if rng.random() < 0.8:
+                record["project"] = rng.choice(["home", "work", "garden", ""])
+            if rng.random() < 0.7:
+                record["urgency"] = round(rng.uniform(-2, 15), 1)
+            records[record["uuid"]] = record
+
+        return records
+
+    def check(self, sorted_records, records, order, sort_values=None):
+        self.assertEqual(
+            sorted_records.keys, reference_order(records, order, sort_values)
+        )
+        self.assertEqual(
+            sorted_records.records,
+            [records[k] for k in sorted_records.keys]
+        )
+        for n, key in enumerate(sorted_records.keys):
+            self.assertEqual(sorted_records.index(key), n)
+
+    def test_orders(self):
+        records = self.make_records(300)
+
+        for order in (
+            [("id", False)],
+            [("urgency", True), ("id", False)],
+            [("project", False), ("urgency", True)],
+            [("project", True), ("id", True)],
+        ):
+            sorted_records = SortedRecords(order)
+            sorted_records.update(list(records.items()))
+            self.check(sorted_records, records, order)
+
+    def test_small_and_large_batches(self):
+        records = self.make_records(2000, seed=1)
+        order = [("project", True), ("urgency", False)]
+        sorted_records = SortedRecords(order)
+        items = list(records.items())
+
+        # a large batch is merged in by sorting, single records by bisection
+        sorted_records.update(items[:1500])
+        for item in items[1500:]:
+            sorted_records.update([item])
+
+        self.check(sorted_records, records, order)
+
+    def test_replace_and_remove(self):
+        records = self.make_records(500, seed=2)
+        order = [("urgency", True), ("id", False)]
+        sorted_records = SortedRecords(order)
+        sorted_records.update(list(records.items()))
+
+        rng = random.Random(3)
+        for key in rng.sample(list(records), 100):
+            record = dict(records[key], urgency=rng.uniform(-2, 15))
+            records[key] = record
+            sorted_records.update([(key, record)])
+
+        for key in rng.sample(list(records), 100):
+            del records[key]
+            sorted_records.remove(key)
+
+        # missing keys are ignored
+        sorted_records.remove("nonexistent")
+
+        self.check(sorted_records, records, order)
+        self.assertIsNone(sorted_records.index("nonexistent"))
+        self.assertEqual(len(sorted_records), len(records))
+
+    def test_set_order(self):
+        records = self.make_records(300, seed=4)
+        sorted_records = SortedRecords([("id", False)])
+        sorted_records.update(list(records.items()))
+
+        order = [("project", False), ("id", True)]
+        sorted_records.set_order(order)
+        self.check(sorted_records, records, order)
+
+        # and back, using cached sort values
+        sorted_records.set_order([("id", False)])
+        self.check(sorted_records, records, [("id", False)])
+
+    def test_sort_values(self):
+        records = self.make_records(300, seed=5)
+        sort_values = {"id": lambda i: i or None}
+        order = [("id", False)]
+
+        sorted_records = SortedRecords(order)
+        sorted_records.update(list(records.items()))
+        sorted_records.set_sort_value("id", sort_values["id"])
+        sorted_records.set_order(order)
+
+        # id 0 (finished tasks) now sorts with missing ids, at the end
+        self.check(sorted_records, records, order, sort_values)
+
+if __name__ == "__main__":
+    unittest.main()
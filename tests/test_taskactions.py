@@ -0,0 +1,151 @@
+""" ---------------------------------------------------------------------------
+
+    test_taskactions.py - Tests for predicted changes and batched commands
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taskactions import (
+    WRITE_OVERRIDES, batch_actions, command_args, export_date, predict_action
+)
+from taskstore import TaskRecord
+
+# 2017-03-01 12:00:00 UTC
+NOW = 1488369600
+NOW_DATE = "20170301T120000Z"
+
+RECORD = TaskRecord({
+    "id": 4,
+    "uuid": "6a9e1d3c-0000-4000-8000-000000000000",
+    "description": "water the garden",
+    "project": "home",
+    "status": "pending",
+    "tags": ["outside"],
+    "start": "20170301T110000Z",
+    "entry": "20170215T093012Z",
+    "estimate": "PT1H",
+})
+
+def predict(command, args=()):
+    return predict_action(RECORD, command, args, now=NOW)
+
+class PredictActionTest(unittest.TestCase):
+    def test_export_date(self):
+        self.assertEqual(export_date(NOW), NOW_DATE)
+
+    def test_done(self):
+        record = predict("done")
+
+        self.assertEqual(record["status"], "completed")
+        self.assertEqual(record["end"], NOW_DATE)
+        self.assertEqual(record["modified"], NOW_DATE)
+        self.assertNotIn("start", record)
+
+        # finished tasks have id 0, as they do in TaskWarrior's export
+        self.assertEqual(record["id"], 0)
+
+    def test_start_stop(self):
+        self.assertEqual(predict("start")["start"], NOW_DATE)
+        self.assertNotIn("start", predict("stop"))
+
+    def test_annotate(self):
+        record = predict("annotate", ["use", "the", "rain", "butt"])
+
+        self.assertEqual(record["annotations"], (
+            {"entry": NOW_DATE, "description": "use the rain butt"},
+        ))
+
+    def test_modify_tags(self):
+        self.assertEqual(predict("modify", ["+next"])["tags"],
+                         ("outside", "next"))
+        self.assertEqual(predict("modify", ["+outside"])["tags"],
+                         ("outside",))
+        self.assertNotIn("tags", predict("modify", ["-outside"]))
+
+    def test_modify_attributes(self):
+        record = predict("modify", ["project:work", "pri:H"])
+        self.assertEqual(record["project"], "work")
+        self.assertEqual(record["priority"], "H")
+
+        # an empty value removes the attribute
+        self.assertNotIn("project", predict("modify", ["project:"]))
+
+        # UDAs can be set too
+        self.assertEqual(predict("modify", ["estimate:PT2H"])["estimate"],
+                         "PT2H")
+
+    def test_modify_unpredictable(self):
+        # dates are worked out by TaskWarrior
+        record = predict("modify", ["due:tomorrow"])
+        self.assertNotIn("due", record)
+        self.assertEqual(record["description"], "water the garden")
+
+    def test_modify_description(self):
+        record = predict("modify", ["water", "the", "roses", "+next"])
+        self.assertEqual(record["description"], "water the roses")
+        self.assertEqual(record["tags"], ("outside", "next"))
+
+        # words with a colon that isn't an attribute are description too
+        record = predict("modify", ["note:", "tomorrow"])
+        self.assertEqual(record["description"], "note: tomorrow")
+
+    def test_original_unchanged(self):
+        predict("done")
+        self.assertEqual(RECORD["status"], "pending")
+        self.assertEqual(RECORD["id"], 4)
+
+    def test_unknown_command(self):
+        with self.assertRaises(ValueError):
+            predict("delete")
+
+class CommandArgsTest(unittest.TestCase):
+    def test_command_args(self):
+        self.assertEqual(
+            command_args(["u1", "u2"], "modify", ["+next"]),
+            WRITE_OVERRIDES + ["u1", "u2", "modify", "+next"]
+        )
+
+    def test_annotate_text_escaped(self):
+        self.assertEqual(
+            command_args(["u1"], "annotate", ["project:home"]),
+            WRITE_OVERRIDES + ["u1", "annotate", "--", "project:home"]
+        )
+
+class BatchActionsTest(unittest.TestCase):
+    def test_consecutive_merged(self):
+        actions = [
+            (["u1"], "done", ()),
+            (["u2"], "done", ()),
+            (["u1"], "done", ()),
+            (["u3"], "modify", ("+next",)),
+            (["u4"], "modify", ("+next",)),
+            (["u5"], "modify", ("+later",)),
+            (["u6"], "done", ()),
+        ]
+
+        batches = batch_actions(actions)
+
+        self.assertEqual([batch[:3] for batch in batches], [
+            (["u1", "u2"], "done", ()),
+            (["u3", "u4"], "modify", ("+next",)),
+            (["u5"], "modify", ("+later",)),
+            (["u6"], "done", ()),
+        ])
+
+        # every action is covered by exactly one batch, in order
+        self.assertEqual([a for batch in batches for a in batch[3]], actions)
+
+    def test_empty(self):
+        self.assertEqual(batch_actions([]), [])
+
+if __name__ == "__main__":
+    unittest.main()
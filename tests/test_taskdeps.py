@@ -0,0 +1,238 @@
+""" ---------------------------------------------------------------------------
+
+    test_taskdeps.py - Tests for DependencyGraph
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taskdeps import OPEN_STATUSES, DependencyGraph, task_depends
+from taskwrapper import TaskDelta
+
+def task(uuid, depends=(), status="pending"):
+    record = {"uuid": uuid, "status": status}
+    if depends:
+        record["depends"] = list(depends)
+    return record
+
+class BruteForce:
+    """
+    the same answers as DependencyGraph, worked out from scratch each time
+    """
+    def __init__(self, tasks):
+        # uuid -> record
+        self.tasks = tasks
+
+    def is_open(self, uuid):
+        return uuid in self.tasks \
+            and self.tasks[uuid]["status"] in OPEN_STATUSES
+
+    def depends(self, uuid):
+        return task_depends(self.tasks[uuid]) if uuid in self.tasks else ()
+
+    def blocked(self, uuid):
+        return any(self.is_open(d) for d in self.depends(uuid))
+
+    def blocking(self, uuid):
+        return self.is_open(uuid) and any(
+            self.is_open(other) and uuid in self.depends(other)
+            for other in self.tasks
+        )
+
+    def reachable(self, uuid):
+        found = set()
+        todo = list(self.depends(uuid))
+        while todo:
+            node = todo.pop()
+            if node not in found:
+                found.add(node)
+                todo.extend(self.depends(node))
+        return found
+
+    def in_cycle(self, uuid):
+        return uuid in self.reachable(uuid)
+
+    def connected(self, uuid):
+        edges = {}
+        for other in self.tasks:
+            for dependency in self.depends(other):
+                edges.setdefault(other, set()).add(dependency)
+                edges.setdefault(dependency, set()).add(other)
+
+        if uuid not in edges:
+            return None
+
+        found = {uuid}
+        todo = [uuid]
+        while todo:
+            for other in edges[todo.pop()]:
+                if other not in found:
+                    found.add(other)
+                    todo.append(other)
+        return found
+
+class DependencyGraphTest(unittest.TestCase):
+    def check(self, graph, tasks):
+        expected = BruteForce(tasks)
+        uuids = set(tasks)
+        for record in tasks.values():
+            uuids.update(task_depends(record))
+
+        for uuid in sorted(uuids):
+            self.assertEqual(graph.blocked(uuid), expected.blocked(uuid),
+                             uuid)
+            self.assertEqual(graph.blocking(uuid), expected.blocking(uuid),
+                             uuid)
+
+            tree = graph.tree(uuid)
+            members = expected.connected(uuid)
+            if members is None:
+                self.assertIsNone(tree)
+                continue
+
+            # each task in the group listed once
+            self.assertEqual(sorted(u for u, depth in tree.rows),
+                             sorted(members))
+            self.assertEqual(sorted(tree.order), sorted(members))
+            self.assertEqual(tree.index[uuid],
+                             [u for u, depth in tree.rows].index(uuid))
+
+            self.assertEqual(
+                tree.cycle, {m for m in members if expected.in_cycle(m)}
+            )
+
+            # tasks come before their dependencies, unless in a cycle
+            position = {u: n for n, u in enumerate(tree.order)}
+            for member in members - tree.cycle:
+                for dependency in expected.depends(member):
+                    if dependency not in tree.cycle:
+                        self.assertLess(position[member],
+                                        position[dependency])
+
+    def test_task_depends(self):
+        self.assertEqual(task_depends({}), ())
+        self.assertEqual(task_depends({"depends": "a,b"}), ("a", "b"))
+        self.assertEqual(task_depends({"depends": ["a", "b"]}), ("a", "b"))
+
+    def test_chain(self):
+        graph = DependencyGraph()
+        tasks = {
+            "a": task("a", ["b"]),
+            "b": task("b", ["c"]),
+            "c": task("c", status="completed"),
+            "d": task("d"),
+        }
+        graph.update(TaskDelta(added=list(tasks.values())))
+
+        self.assertTrue(graph.blocked("a"))
+        self.assertFalse(graph.blocked("b"))
+        self.assertTrue(graph.blocking("b"))
+        self.assertFalse(graph.blocking("c"))
+        self.assertIsNone(graph.tree("d"))
+        self.assertEqual(graph.tree("c").rows, [("a", 0), ("b", 1), ("c", 2)])
+        self.check(graph, tasks)
+
+    def test_missing_dependency(self):
+        # tasks that haven't been loaded don't hold anything up
+        graph = DependencyGraph()
+        graph.set(task("a", ["missing"]))
+
+        self.assertFalse(graph.blocked("a"))
+        self.assertEqual(len(graph.tree("a")), 2)
+
+    def test_cycles(self):
+        graph = DependencyGraph()
+        tasks = {
+            "c": task("c", ["d", "e"]),
+            "d": task("d", ["c"]),
+            "e": task("e", ["d"]),
+            "f": task("f", ["f"]),
+            "g": task("g", ["c"]),
+        }
+        for record in tasks.values():
+            graph.set(record)
+
+        # e is in the cycle c -> e -> d -> c, though the walk has finished
+        # with d by the time it reaches e
+        self.assertEqual(graph.tree("c").cycle, {"c", "d", "e"})
+        self.assertEqual(graph.tree("f").cycle, {"f"})
+        self.check(graph, tasks)
+
+    def test_tree_cached_and_invalidated(self):
+        graph = DependencyGraph()
+        graph.set(task("a", ["b"]))
+        graph.set(task("c", ["d"]))
+
+        tree = graph.tree("a")
+        self.assertIs(graph.tree("b"), tree)
+        other = graph.tree("c")
+
+        # finishing a task doesn't change the tree
+        graph.set(task("b", status="completed"))
+        self.assertIs(graph.tree("a"), tree)
+
+        # a new dependency does, but only for trees it touches
+        graph.set(task("b", ["e"], status="completed"))
+        self.assertIsNot(graph.tree("a"), tree)
+        self.assertEqual(len(graph.tree("a")), 3)
+        self.assertIs(graph.tree("c"), other)
+
+        # and joining two trees replaces both
+        graph.set(task("e", ["d"]))
+        self.assertIs(graph.tree("a"), graph.tree("c"))
+        self.assertEqual(len(graph.tree("a")), 5)
+
+    def test_forest(self):
+        graph = DependencyGraph()
+        graph.set(task("a", ["b"]))
+        graph.set(task("c", ["d"]))
+
+        forest = graph.forest(["a", "b", "c", "x"])
+        self.assertEqual([len(tree) for tree in forest], [2, 2])
+
+    def test_random_changes(self):
+        rng = random.Random(0)
+        uuids = ["t{:02d}".format(n) for n in range(30)]
+        statuses = ["pending", "waiting", "completed", "deleted"]
+
+        graph = DependencyGraph()
+        tasks = {}
+
+        for step in range(400):
+            uuid = rng.choice(uuids)
+
+            if uuid in tasks and rng.random() < 0.1:
+                del tasks[uuid]
+                graph.update(TaskDelta(deleted=[uuid]))
+            else:
+                record = task(
+                    uuid, rng.sample(uuids, rng.choice([0, 0, 1, 1, 2])),
+                    rng.choice(statuses)
+                )
+                delta = TaskDelta()
+                if uuid in tasks:
+                    delta.modified.append(record)
+                else:
+                    delta.added.append(record)
+                tasks[uuid] = record
+                graph.update(delta)
+
+            # trees are built (and cached) along the way
+            graph.tree(rng.choice(uuids))
+
+            if step % 20 == 0:
+                self.check(graph, tasks)
+
+        self.check(graph, tasks)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+""" ---------------------------------------------------------------------------
+
+    test_taskhistory.py - Tests for HistoryIndex and undo.data parsing
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taskhistory import HistoryIndex, describe_changes, parse_ff4
+
+UUID_A = "6a9e1d3c-0000-4000-8000-00000000000a"
+UUID_B = "6a9e1d3c-0000-4000-8000-00000000000b"
+
+def transaction(when, uuid, old, new):
+    """
+    returns an undo.data transaction changing task `uuid` from fields `old`
+    (None if it was added) to `new`
+    """
+    def ff4(fields):
+        return "[" + " ".join(
+            '{}:"{}"'.format(k, v) for k, v in sorted(
+                dict(fields, uuid=uuid).items()
+            )
+        ) + "]"
+
+    lines = ["time {}".format(when)]
+    if old is not None:
+        lines.append("old " + ff4(old))
+    lines.append("new " + ff4(new))
+
+    return "\n".join(lines) + "\n---\n"
+
+# a task added, then one change to it, with another task in between
+ADD_A = transaction(1488369600, UUID_A, None, {"description": "water"})
+ADD_B = transaction(1488369700, UUID_B, None, {"description": "mow"})
+MODIFY_A = transaction(1488369800, UUID_A, {"description": "water"},
+                       {"description": "water", "project": "home"})
+
+class ParseTest(unittest.TestCase):
+    def test_parse_ff4(self):
+        fields = parse_ff4(
+            '[description:"say \\"hi\\" &open;now&close;" project:"home"]'
+        )
+
+        self.assertEqual(fields, {
+            "description": 'say "hi" [now]', "project": "home"
+        })
+
+    def test_describe_created(self):
+        self.assertEqual(describe_changes(None, {"description": "water"}),
+                         ["created: water"])
+
+    def test_describe_changes(self):
+        old = {"description": "water", "project": "home", "tags": "a,b",
+               "priority": "H", "modified": "1", "uuid": UUID_A}
+        new = {"description": "water", "project": "garden", "tags": "b,c",
+               "status": "pending", "annotation_1488369600": "rain butt",
+               "modified": "2", "uuid": UUID_A}
+
+        self.assertEqual(describe_changes(old, new), [
+            "annotated: rain butt",
+            "priority removed",
+            "project: home → garden",
+            "status: pending",
+            "tags +c -a",
+        ])
+
+class HistoryIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "undo.data")
+        self.index = HistoryIndex(self.path)
+
+    def tearDown(self):
+        if self.index.map is not None:
+            self.index.map.close()
+        self.dir.cleanup()
+
+    def write(self, text, mode="w"):
+        with open(self.path, mode) as f:
+            f.write(text)
+
+    def changes(self, uuid):
+        return [changes for when, changes in self.index.history(uuid)]
+
+    def test_not_ready(self):
+        self.assertIsNone(self.index.history(UUID_A))
+
+    def test_missing_file(self):
+        self.assertTrue(self.index.refresh())
+        self.assertEqual(self.index.history(UUID_A), [])
+        self.assertFalse(self.index.refresh())
+
+    def test_build_and_extend(self):
+        self.write(ADD_A + ADD_B)
+        self.assertTrue(self.index.refresh())
+
+        self.assertEqual(self.changes(UUID_A), [["created: water"]])
+        self.assertEqual(self.changes(UUID_B), [["created: mow"]])
+        self.assertFalse(self.index.refresh())
+
+        self.write(MODIFY_A, "a")
+        self.assertTrue(self.index.refresh())
+
+        # most recent first
+        self.assertEqual(self.index.history(UUID_A)[0][0], "1488369800")
+        self.assertEqual(self.changes(UUID_A),
+                         [["project: home"], ["created: water"]])
+
+    def test_partial_transaction(self):
+        self.write(ADD_A)
+        self.index.refresh()
+
+        # a transaction still being written isn't indexed, or counted as a
+        # change
+        self.write(MODIFY_A[:-10], "a")
+        self.assertFalse(self.index.refresh())
+        self.assertEqual(len(self.changes(UUID_A)), 1)
+
+        self.write(MODIFY_A[-10:], "a")
+        self.assertTrue(self.index.refresh())
+        self.assertEqual(len(self.changes(UUID_A)), 2)
+
+    def test_undo_shrinks_file(self):
+        self.write(ADD_A + ADD_B + MODIFY_A)
+        self.index.refresh()
+        self.assertEqual(len(self.changes(UUID_A)), 2)
+
+        # `task undo` takes the last transaction out
+        self.write(ADD_A + ADD_B)
+        self.assertTrue(self.index.refresh())
+        self.assertEqual(len(self.changes(UUID_A)), 1)
+
+    def test_undo_then_grown(self):
+        self.write(ADD_A + ADD_B)
+        self.index.refresh()
+
+        # undone and a different change made, leaving the file longer than
+        # before but with different contents where the index stopped
+        self.write(ADD_A + MODIFY_A + ADD_B.replace("mow", "mow the lawn"))
+        self.assertTrue(self.index.refresh())
+
+        self.assertEqual(len(self.changes(UUID_A)), 2)
+        self.assertEqual(self.changes(UUID_B), [["created: mow the lawn"]])
+
+    def test_file_replaced(self):
+        self.write(ADD_A)
+        self.index.refresh()
+
+        replacement = self.path + ".new"
+        with open(replacement, "w") as f:
+            f.write(ADD_B + "x" * len(ADD_A))
+        os.replace(replacement, self.path)
+
+        self.assertTrue(self.index.refresh())
+        self.assertEqual(self.changes(UUID_A), [])
+        self.assertEqual(self.changes(UUID_B), [["created: mow"]])
+
+    def test_cache(self):
+        index = HistoryIndex(self.path, cache_size=1)
+        self.index = index
+        self.write(ADD_A + ADD_B)
+        index.refresh()
+
+        first = index.history(UUID_A)
+        self.assertIs(index.history(UUID_A), first)
+
+        index.history(UUID_B)
+        self.assertEqual(list(index.cache), [UUID_B])
+
+        # cached history isn't used once more transactions are indexed
+        self.write(MODIFY_A, "a")
+        index.refresh()
+        self.assertEqual(len(index.history(UUID_A)), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+""" ---------------------------------------------------------------------------
+
+    test_taskstore.py - Tests for TaskRecord and TaskStore
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import marshal
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taskstore import TaskRecord, TaskStore, pack_date, unpack_date
+
+# a task as `task export` produces it
+EXPORTED = {
+    "id": 3,
+    "description": "water the garden",
+    "project": "home",
+    "status": "pending",
+    "tags": ["outside", "next"],
+    "due": "20170301T120000Z",
+    "entry": "20170215T093012Z",
+    "modified": "20170216T101500Z",
+    "annotations": [
+        {"entry": "20170216T101500Z", "description": "use the rain butt"}
+    ],
+    "depends": "6a9e1d3c-0000-4000-8000-000000000001",
+    "uuid": "6a9e1d3c-0000-4000-8000-000000000000",
+    "urgency": 8.3,
+    # UDAs
+    "estimate": "PT1H",
+    "reviewed": "20170210T000000Z",
+    "checklist": ["hose", "can"],
+}
+
+class DateTest(unittest.TestCase):
+    def test_round_trip(self):
+        packed = pack_date("20170301T120000Z")
+        self.assertEqual(packed, 20170301120000)
+        self.assertEqual(unpack_date(packed), "20170301T120000Z")
+
+    def test_other_formats_unchanged(self):
+        for value in ("2017-03-01", "20170301T120000", "2017030xT120000Z",
+                      "", None, 12.5):
+            self.assertEqual(pack_date(value), value)
+            self.assertEqual(unpack_date(value), value)
+
+class TaskRecordTest(unittest.TestCase):
+    def test_behaves_like_dict(self):
+        record = TaskRecord(EXPORTED)
+
+        self.assertEqual(record["description"], "water the garden")
+        self.assertEqual(record["due"], "20170301T120000Z")
+        self.assertEqual(record["estimate"], "PT1H")
+        self.assertEqual(record.get("wait"), None)
+        self.assertEqual(record.get("wait", "never"), "never")
+        self.assertIn("estimate", record)
+        self.assertNotIn("wait", record)
+        self.assertNotIn("other", record)
+        self.assertEqual(set(record), set(EXPORTED))
+        self.assertEqual(len(record), len(EXPORTED))
+
+        with self.assertRaises(KeyError):
+            record["wait"]
+        with self.assertRaises(KeyError):
+            record["other"]
+
+    def test_lists_become_tuples(self):
+        record = TaskRecord(EXPORTED)
+
+        self.assertEqual(record["tags"], ("outside", "next"))
+        self.assertEqual(record["checklist"], ("hose", "can"))
+        self.assertEqual(record, EXPORTED)
+
+    def test_dates_packed(self):
+        record = TaskRecord(EXPORTED)
+
+        self.assertEqual(record.due, 20170301120000)
+        self.assertEqual(record.to_dict()["due"], "20170301T120000Z")
+
+        # UDAs aren't known to be dates, so they're left as they are
+        self.assertEqual(record.uda_values[1], "20170210T000000Z")
+
+    def test_shared_values(self):
+        a = TaskRecord(EXPORTED)
+        b = TaskRecord(dict(EXPORTED, uuid="other"))
+
+        self.assertIs(a.uda_keys, b.uda_keys)
+        self.assertIs(a.project, b.project)
+        self.assertIs(a.tags[0], b.tags[0])
+
+    def test_replace(self):
+        record = TaskRecord(EXPORTED)
+        done = record.replace(status="completed", id=0,
+                              end="20170302T080000Z")
+
+        self.assertEqual(record["status"], "pending")
+        self.assertEqual(done["status"], "completed")
+        self.assertEqual(done["id"], 0)
+        self.assertEqual(done.end, 20170302080000)
+        self.assertEqual(done["estimate"], "PT1H")
+
+    def test_equality(self):
+        record = TaskRecord(EXPORTED)
+
+        self.assertEqual(record, TaskRecord(dict(EXPORTED)))
+        self.assertEqual(record, EXPORTED)
+        self.assertNotEqual(record, dict(EXPORTED, urgency=1.0))
+        self.assertNotEqual(record, TaskRecord(dict(EXPORTED, extra="x")))
+        self.assertNotEqual(record, "not a record")
+
+        with self.assertRaises(TypeError):
+            hash(record)
+
+    def test_pack_unpack(self):
+        for data in (
+            EXPORTED,
+            {"uuid": "u1", "description": "minimal"},
+            {"uuid": "u2", "id": 0, "status": "deleted", "zz": None},
+        ):
+            record = TaskRecord(data)
+            packed = record.pack()
+            unpacked = TaskRecord.unpack(packed)
+
+            self.assertEqual(unpacked, record)
+            self.assertEqual(unpacked.to_dict(), record.to_dict())
+            self.assertEqual(set(unpacked), set(data))
+            self.assertIs(unpacked.uda_keys, record.uda_keys)
+
+    def test_pack_is_marshallable(self):
+        # the snapshot cache and the daemon send packed records with marshal
+        packed = TaskRecord(EXPORTED).pack()
+        unpacked = TaskRecord.unpack(marshal.loads(marshal.dumps(packed)))
+
+        self.assertEqual(unpacked, EXPORTED)
+
+class TaskStoreTest(unittest.TestCase):
+    def test_set_get_remove(self):
+        store = TaskStore([EXPORTED])
+        uuid = EXPORTED["uuid"]
+
+        self.assertIn(uuid, store)
+        self.assertIsInstance(store.get(uuid), TaskRecord)
+        self.assertEqual(list(store), [uuid])
+
+        record = store.set(TaskRecord(EXPORTED).replace(urgency=1.0))
+        self.assertIs(store.get(uuid), record)
+        self.assertEqual(len(store), 1)
+
+        store.remove(uuid)
+        store.remove(uuid)
+        self.assertEqual(len(store), 0)
+        self.assertIsNone(store.get(uuid))
+
+    def test_memory_report(self):
+        store = TaskStore(
+            dict(EXPORTED, uuid="u{}".format(n), id=n) for n in range(100)
+        )
+
+        usage = store.memory_usage()
+        self.assertGreater(usage, 0)
+        self.assertTrue(store.memory_report().startswith("100 tasks, "))
+
+        # kept until records change
+        self.assertEqual(store.usage, usage)
+        store.set(dict(EXPORTED, uuid="u100", description="x" * 1000))
+        self.assertIsNone(store.usage)
+        self.assertGreater(store.memory_usage(), usage + 1000)
+
+        store.remove("missing")
+        self.assertIsNotNone(store.usage)
+        store.remove("u100")
+        self.assertIsNone(store.usage)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+""" ---------------------------------------------------------------------------
+
+    test_taskwrapper.py - Tests for the filters TaskWrapper exports with
+
+    Copyright 2017, John Ferguson
+
+    Licensed under GPLv3, see LICENSE for full details
+
+--------------------------------------------------------------------------- """
+
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from fake_task import UUID_RE, parse_filter
+from taskactions import export_date
+from taskstore import TaskRecord
+from taskwrapper import TaskWrapper
+
+DAY = 24 * 60 * 60
+
+def uuid(name):
+    return "00000000-0000-4000-8000-0000000000" + name
+
+def task(name, project, status="pending", days_ago=None):
+    record = {"uuid": uuid(name), "project": project, "status": status,
+              "description": name}
+    if days_ago is not None:
+        record["end"] = export_date(time.time() - days_ago * DAY)
+    return record
+
+class FilterTest(unittest.TestCase):
+    """
+    runs TaskWrapper against a stand-in for TaskWarrior that evaluates
+    filters with the same precedence ("or" binding looser than the implicit
+    "and" between arguments)
+    """
+    task_filter = ["project:a", "or", "project:b"]
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        for name in ("backlog.data", "pending.data"):
+            open(os.path.join(self.dir.name, name), "w").close()
+
+        self.tasks = [
+            task("a1", "a"),
+            task("a2", "a", "completed", days_ago=100),
+            task("b1", "b"),
+            task("b2", "b", "deleted", days_ago=200),
+            task("c1", "c"),
+            task("c2", "c", "completed", days_ago=100),
+        ]
+
+        self.wrapper = TaskWrapper(
+            task_path=self.dir.name, watcher="poll", use_cache=False,
+            task_filter=self.task_filter
+        )
+        self.wrapper._export = self.export
+        self.wrapper._count = self.count
+        self.exports = []
+
+    def tearDown(self):
+        self.wrapper.watcher.close()
+        self.dir.cleanup()
+
+    def matching(self, args):
+        # TaskWarrior replaces a run of uuids with the uuids joined by "or",
+        # in parentheses, where the run was
+        terms = []
+        for arg in args:
+            if arg == ".":
+                continue
+            if UUID_RE.match(arg) and terms[-1:] == [")"] and \
+                    UUID_RE.match(terms[-2]):
+                terms[-1:] = ["or", arg, ")"]
+            elif UUID_RE.match(arg):
+                terms += ["(", arg, ")"]
+            else:
+                terms.append(arg)
+
+        test = parse_filter(terms)
+        return [t for t in self.tasks if test(t)]
+
+    def export(self, args, cancellable=False):
+        records = [TaskRecord(t) for t in self.matching(args)]
+        self.exports.append((args, records))
+        yield records
+
+    def names(self):
+        return sorted(r["description"] for r in self.wrapper.task_db.values())
+
+    def count(self, args):
+        return len(self.matching(args))
+
+    def test_full_export(self):
+        self.wrapper.update_task_db()
+
+        # older history isn't loaded up front, whichever side of the "or"
+        # it's on
+        self.assertEqual(self.names(), ["a1", "b1"])
+
+    def test_history_pages(self):
+        self.wrapper.update_task_db()
+        while self.wrapper.load_history_page():
+            pass
+
+        self.assertEqual(self.names(),
+                         ["a1", "a2", "b1", "b2"])
+        self.assertTrue(self.wrapper.history_exhausted)
+
+    def test_eager(self):
+        self.wrapper.history = "eager"
+        self.wrapper.update_task_db()
+
+        self.assertEqual(self.names(),
+                         ["a1", "a2", "b1", "b2"])
+
+    def test_no_filter(self):
+        self.wrapper.task_filter = []
+        self.wrapper.update_task_db()
+
+        self.assertEqual(self.names(), ["a1", "b1", "c1"])
+        self.assertEqual(self.exports[0][0][:2], ["(", "status:pending"])
+
+    def test_incremental(self):
+        self.wrapper.update_task_db()
+
+        # a1 modified, and c1 moved into project b
+        changed = [dict(self.tasks[0], description="a1 changed"),
+                   dict(self.tasks[4], project="b")]
+        self.tasks[0], self.tasks[4] = changed
+        with open(self.wrapper.backlog_path, "w") as f:
+            for record in changed:
+                f.write(json.dumps(record) + "\n")
+
+        self.wrapper.update_task_db_incremental({"backlog.data"})
+
+        self.assertEqual(self.names(), ["a1 changed", "b1", "c1"])
+
+        # only the changed tasks are exported
+        args, records = self.exports[-1]
+        self.assertEqual(sorted(r["uuid"] for r in records),
+                         sorted(r["uuid"] for r in changed))
+
+if __name__ == "__main__":
+    unittest.main()